@@ -1,18 +1,41 @@
-import struct
+import itertools
+import sys
 from abc import ABC, abstractmethod
 from pathlib import Path
-from jupyter_client import BlockingKernelClient
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
-plt.style.use("seaborn-whitegrid")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # shared routines in python/rapid
+from rapid.decimate import N_POINTS, minmax_envelope
+from rapid.events import SIGNALS, acceleration_magnitude, pressure
+from rapid.export import OUTPUTS, write_columns
+from rapid.formats import (
+    BDS100_COLUMNS,
+    BDS100_FMT,
+    BDS250_COLUMNS,
+    BDS250_FMT,
+    EDF_ACC_GAIN,
+    EDF_COLUMNS,
+    EDF_FMT,
+    EDF_FS,
+    EDF_P_GAIN,
+    FORMATS,
+    UNITS,
+)
+from rapid.manifest import Manifest, format_settings
+from rapid.orientation import rotate_vectors
+from rapid.overview import draw_overview
+from rapid.packets import fmt_to_dtype, unpack_array
+from rapid.profiling import profile_file, stage
+
+# the seaborn styles are named seaborn-v0_8-* since matplotlib 3.6
+PLOT_STYLES = ("seaborn-v0_8-whitegrid", "seaborn-whitegrid")
 
 
 class Rapid(ABC):
     def __init__(
-        self, filename: str
+        self, filename: str, directory: str = None
     ) -> None:  # Attributes same for all Sensors can be placed here
         """This is an abstract class (ABC).
         It provides methods which are the same between the sensor / subclasses.
@@ -20,49 +43,171 @@ class Rapid(ABC):
 
         """
         self.filename = Path(filename)
-        self.dir_csv = Path("csv/")
-        self.dir_plots = Path("plots/")
+        self.dir_csv = Path(directory or ".") / "csv"
+        self.dir_plots = Path(directory or ".") / "plots"
+        self.time0 = None  # raw time of the first packet, shared by all chunks
+        self.output = "csv"
+        self.profiler = None  # rapid.profiling.Profiler timing the stages of the conversion
 
     def _mkdir(self, path_object: Path) -> None:
         path_object.mkdir(parents=True, exist_ok=True)
 
+    def _export_path(self) -> Path:
+        return (self.dir_csv / self.filename.stem).with_suffix(OUTPUTS[self.output])
+
     def _save_as_csv(self, data, **kwargs) -> None:
         self._mkdir(self.dir_csv)
         data.to_csv(
-            (self.dir_csv / self.filename.stem).with_suffix(".csv"),
+            self._export_path(),
             sep=",",
             index=False,
             **kwargs
         )
 
-    def _process_and_save(self, savecsv, **kwargs) -> None:
-        data = self._read_data()
-        data = self._post_process(data)
-        if savecsv == True:
-            self._save_as_csv(data, **kwargs)
+    def _save(self, frames, **kwargs) -> None:
+        """Saves processed blocks in the format selected by self.output (csv, parquet or npz)."""
+        if self.output == "csv":
+            # mode and header apply to the first block, the following blocks are appended without header
+            mode = kwargs.pop("mode", "w")
+            header = kwargs.pop("header", True)
+            for i, data in enumerate(frames):
+                if i == 0:
+                    self._save_as_csv(data, mode=mode, header=header, **kwargs)
+                else:
+                    self._save_as_csv(data, mode="a", header=False, **kwargs)
+            return
+
+        frames = iter(frames)
+        first = next(frames, None)
+        if first is None:
+            return
+        self._mkdir(self.dir_csv)
+        metadata = FORMATS[type(self).__name__].metadata(
+            {column: column for column in first.columns}, self.filename
+        )
+        blocks = (
+            {column: data[column].to_numpy() for column in data.columns}
+            for data in itertools.chain([first], frames)
+        )
+        write_columns(
+            self._export_path(),
+            blocks,
+            metadata,
+            self.output,
+        )
+
+    def _settings(self, **kwargs) -> dict:
+        """Conversion settings recorded in the manifest of self.dir_csv."""
+        options = {
+            name: getattr(self, name)
+            for name in ("absolute_orientation", "p_gain", "acc_gain", "fs")
+            if hasattr(self, name)
+        }
+        return format_settings(
+            type(self).__name__,
+            self.output,
+            fmt=self.fmt,
+            columns=self.column_names_raw,
+            csv_options={key: repr(value) for key, value in kwargs.items()},
+            **options,
+        )
+
+    def _process_and_save(self, savecsv, chunksize=None, output="csv", cache=False, profiler=None, **kwargs) -> None:
+        self.output = output
+        self.profiler = profiler
+        if self.output not in OUTPUTS:
+            raise ValueError(f"Unknown output format {self.output!r}, expected one of {list(OUTPUTS)}")
+        cache = cache and savecsv == True
+        if cache:
+            manifest = Manifest(self.dir_csv)
+            settings = self._settings(**kwargs)
+            if manifest.is_current(self.filename, settings):
+                # unchanged since the last conversion, the saved file is kept and nothing is processed
+                if manifest.dirty:
+                    manifest.save()  # new modification time of a touched file
+                return None
+
+        data = None
+        with profile_file(profiler, self.filename, type(self).__name__):
+            if chunksize is not None:
+                # the processed blocks are appended to the output file and not kept in memory
+                frames = (self._timed_post_process(data) for data in self._read_chunks(chunksize))
+                if savecsv == True:
+                    self._timed_save(frames, **kwargs)
+                else:
+                    for _ in frames:
+                        pass
+            else:
+                data = self._read_data()
+                data = self._timed_post_process(data)
+                if savecsv == True:
+                    self._timed_save([data], **kwargs)
+
+        if cache and self._export_path().exists():
+            manifest.record(self.filename, self._export_path(), settings)
+            manifest.save()
         return data
 
+    def _timed_post_process(self, data: pd.DataFrame) -> pd.DataFrame:
+        with stage(self.profiler, "post_process"):
+            return self._post_process(data)
+
+    def _timed_save(self, frames, **kwargs) -> None:
+        # the blocks of chunksize are read and processed while saving, their stages are not part of 'write'
+        with stage(self.profiler, "write") as written:
+            self._save(frames, **kwargs)
+            if self._export_path().exists():
+                written.nbytes = self._export_path().stat().st_size
+
     @abstractmethod
     def _post_process(self, data: pd.DataFrame) -> pd.DataFrame:
         raise NotImplementedError("Child must override post_process")
         return data
 
-    def _read_data(self) -> pd.DataFrame:
-        with open(self.filename.as_posix(), mode="r+b") as f:
-            binary_data = f.read()
-        len_fmt = struct.calcsize(self.fmt)
-        max_accept_len = (len(binary_data) // len_fmt) * len_fmt
-        bin_new = binary_data[0:max_accept_len]
-        iter = struct.iter_unpack(self.fmt, bin_new)
-        data = [x for x in iter]
-        data = pd.DataFrame(data, columns=self.column_names_raw)
+    def _to_frame(self, packets: np.ndarray, start: int = 0) -> pd.DataFrame:
+        # struct unpacks integers to int and floats to double, cast the same way
+        casts = {"f": np.float64, "b": np.bool_}
+        data = pd.DataFrame(
+            {
+                name: packets[name].astype(casts.get(packets.dtype[name].kind, np.int64))
+                for name in self.column_names_raw
+            },
+            columns=self.column_names_raw,
+            index=pd.RangeIndex(start, start + len(packets)),
+        )
         return data
 
-    def plot_data_overview(self, save: bool = True, show: bool = False) -> None:
+    def _read_data(self) -> pd.DataFrame:
+        with stage(self.profiler, "read") as read:
+            with open(self.filename.as_posix(), mode="r+b") as f:
+                binary_data = f.read()
+            read.nbytes = len(binary_data)
+        with stage(self.profiler, "unpack"):
+            dtype = fmt_to_dtype(self.fmt, self.column_names_raw)
+            packets = unpack_array(binary_data, dtype)
+            return self._to_frame(packets)
+
+    def _read_chunks(self, chunksize: int):
+        """Yields the raw data in blocks of chunksize packets, indexed by packet number."""
+        dtype = fmt_to_dtype(self.fmt, self.column_names_raw)
+        n_packets = self.filename.stat().st_size // dtype.itemsize
+        with open(self.filename.as_posix(), mode="rb") as f:
+            for start in range(0, n_packets, chunksize):
+                count = min(chunksize, n_packets - start)
+                with stage(self.profiler, "read", count * dtype.itemsize):
+                    packets = np.fromfile(f, dtype=dtype, count=count)
+                with stage(self.profiler, "unpack"):
+                    data = self._to_frame(packets, start)
+                yield data
+
+    def plot_data_overview(self, save: bool = True, show: bool = False, n_points: int = N_POINTS) -> None:
         """Plots an overview for the generated data.
         This is primarily to spot problems before further user-processing.
         The save-option can be helpful as a visual aid for the future as to
         which measurements measured what.
+        Long recordings are reduced to the minimum and maximum of each pixel column,
+        so short strike peaks stay visible (see rapid.decimate). The acceleration magnitude
+        is drawn in g including gravity, as by rapid.overview.plot_file for the same file.
 
         Parameters
         ----------
@@ -70,39 +215,50 @@ class Rapid(ABC):
             Save the file at location specified in <sensorclass>.dir_plots, by default True
         show : bool
             Show an interactive plot when executed, by default False
+        n_points : int, optional
+            Largest number of points drawn per line, by default rapid.decimate.N_POINTS
         """
-        t = self.data["time"][::10]
-        pres = self.data["pres"].rolling(10).mean()[::10]
-        accmag = self.data["accmag"].rolling(10).mean()[::10]
-
-        color = "C0"
-        fig, ax1 = plt.subplots(figsize=(25, 5))
-        ax1.set_xlabel("time [s]")
-        ax1.set_ylabel("Pressure [hPa]", color=color)
-        ax1.plot(t, pres, color=color)
-        ax1.tick_params(axis="y", labelcolor=color)
-        ax1.ticklabel_format(useOffset=False)
-
-        ax2 = ax1.twinx()
-        color = "C1"
-        ax2.set_ylabel("Acceleration magnitude [g]", color=color)
-        ax2.plot(t, accmag, color=color)
-        ax2.tick_params(axis="y", labelcolor=color)
-        fig.tight_layout()
-
-        if save == True:
-            self._mkdir(self.dir_plots)
-            plt.savefig((self.dir_plots / self.filename.name).with_suffix(".png"))
-        if show == True:
-            plt.show()
-        plt.close()
-
-
-from importData import Rapid
+        if self.data is None:
+            raise ValueError(
+                "No data in memory (chunksize or cache), use rapid.overview.plot_file for the file instead"
+            )
+        sensor = type(self).__name__
+        t = self.data["time"].to_numpy()
+        t_pres, pres = minmax_envelope(t, pressure(self.data, sensor), n_points)
+        t_acc, accmag = minmax_envelope(t, acceleration_magnitude(self.data, sensor), n_points)
+
+        # imported here, so converting files does not load matplotlib
+        import matplotlib.pyplot as plt
+
+        style = next((s for s in PLOT_STYLES if s in plt.style.available), "default")
+        with plt.style.context(style):
+            fig, ax1 = plt.subplots(figsize=(25, 5))
+            draw_overview(ax1, t_pres, pres, t_acc, accmag,
+                          pres_label=f"Pressure [{UNITS[SIGNALS[sensor][2][0]]}]")
+            ax1.set_title(self.filename.name)
+            fig.tight_layout()
+
+            if save == True:
+                self._mkdir(self.dir_plots)
+                plt.savefig((self.dir_plots / self.filename.name).with_suffix(".png"))
+            if show == True:
+                plt.show()
+            plt.close()
 
 
 class BDS100(Rapid):
-    def __init__(self, filename: str, savecsv: bool = True, **kwargs) -> None:
+    def __init__(
+        self,
+        filename: str,
+        savecsv: bool = True,
+        chunksize: int = None,
+        output: str = "csv",
+        absolute_orientation: bool = False,
+        cache: bool = False,
+        profiler=None,
+        directory: str = None,
+        **kwargs,
+    ) -> None:
         """This class processes BDS measurements at 100 Hz. 
         At that speed, the internal data fusion algorithm computes an absolute orientation, 
         which is used to get from a relative to an absolute acceleration.
@@ -115,47 +271,36 @@ class BDS100(Rapid):
             Relative file location + filename of the measurement
         savecsv : bool, optional
             Saves the processed data as a csv file if True, by default True
+        chunksize : int, optional
+            Processes and saves the file in blocks of chunksize packets with constant memory use.
+            The data are then not kept in self.data (None), by default the whole file is processed at once
+        output : str, optional
+            Format of the saved file: "csv" (default), "parquet" (requires pyarrow) or "npz".
+            The binary formats keep the column names and store the sampling rate, units and gains.
+        absolute_orientation : bool, optional
+            Adds the earth-frame acceleration absaccx/y/z (gravity removed from absaccz), by default False
+        cache : bool, optional
+            Skips the file if it is unchanged since its last conversion with the same settings,
+            recorded in manifest.json of dir_csv. self.data is then None, by default False
+        profiler : rapid.profiling.Profiler, optional
+            Records the time, bytes and peak allocation of the stages read, unpack, post_process and write
+        directory : str, optional
+            Folder in which csv/ and plots/ are created, by default the working folder
         **kwargs : optional
             Keyword arguments for changing how the csv is generated and are feeded directly into pd.read_csv().
         """
-        super().__init__(filename)
+        super().__init__(filename, directory)
         self.dir_csv = self.dir_csv / "BDS100"
         self.dir_plots = self.dir_plots / "BDS100"
-        self.fmt = "HI22f4B"  # format string to set byteorder
-        self.column_names_raw = [
-            "sample rate",
-            "time",
-            "P1",
-            "T1",
-            "P2",
-            "T2",
-            "P3",
-            "T3",
-            "eul head",
-            "eul roll",
-            "eul pitch",
-            "quat w",
-            "quatx",
-            "quaty",
-            "quatz",
-            "magx",
-            "magy",
-            "magz",
-            "accx",
-            "accy",
-            "accz",
-            "gyrox",
-            "gyroy",
-            "gyroz",
-            "calmag",
-            "calacc",
-            "calgyro",
-            "calimu",
-        ]
-        self.data = super()._process_and_save(savecsv, **kwargs)
+        self.fmt = BDS100_FMT  # format string to set byteorder
+        self.column_names_raw = list(BDS100_COLUMNS)
+        self.absolute_orientation = absolute_orientation
+        self.data = super()._process_and_save(savecsv, chunksize, output, cache, profiler, **kwargs)
 
     def _post_process(self, data: pd.DataFrame) -> pd.DataFrame:
-        data["time"] = (data["time"] - data["time"][0]) / 1000
+        if self.time0 is None:
+            self.time0 = data["time"][0]
+        data["time"] = (data["time"] - self.time0) / 1000
         data.insert(1, "pres", np.average(data[["P1", "P2", "P3"]], axis=-1))
         data.insert(1, "accmag", np.linalg.norm(data[["accx", "accy", "accz"]], axis=-1))
         data["accmag"] -= 9.81
@@ -180,20 +325,16 @@ class BDS100(Rapid):
                 "calimu",
             ]
         ]
+        if self.absolute_orientation:
+            data = self._absolute_orientation(data)
         return data
 
     def _absolute_orientation(self, data: pd.DataFrame) -> pd.DataFrame:
-        import quaternion
-
         # Translate body acc with earths mag field to abs reference frame
-        quat_ref_frame = quaternion.as_quat_array(
-            data[["quat w", "quatx", "quaty", "quatz"]]
+        acc_earth = rotate_vectors(
+            data[["quat w", "quatx", "quaty", "quatz"]].to_numpy(),
+            data[["accx", "accy", "accz"]].to_numpy(),
         )
-
-        acc_earth = np.zeros((0, 3))
-        for idx, q in enumerate(quat_ref_frame):
-            acc = quaternion.rotate_vectors(q, data.loc[idx, "accx":"accz"])
-            acc_earth = np.vstack((acc_earth, acc))
         acc_earth[:, 2] -= 9.81
         data.insert(5, "absaccx", acc_earth[:, 0])
         data.insert(6, "absaccy", acc_earth[:, 1])
@@ -202,7 +343,17 @@ class BDS100(Rapid):
 
 
 class BDS250(Rapid):
-    def __init__(self, filename: str, savecsv: bool = True, **kwargs) -> None:
+    def __init__(
+        self,
+        filename: str,
+        savecsv: bool = True,
+        chunksize: int = None,
+        output: str = "csv",
+        cache: bool = False,
+        profiler=None,
+        directory: str = None,
+        **kwargs,
+    ) -> None:
         """This class processes BDS measurements at 250 Hz. 
         At that speed, there is no absolute orientation computation, 
         outputs are absolute pressure, accelerometer and gyroscope.
@@ -215,37 +366,33 @@ class BDS250(Rapid):
             Relative file location + filename of the measurement
         savecsv : bool, optional
             Saves the processed data as a csv file if True, by default True
+        chunksize : int, optional
+            Processes and saves the file in blocks of chunksize packets with constant memory use.
+            The data are then not kept in self.data (None), by default the whole file is processed at once
+        output : str, optional
+            Format of the saved file: "csv" (default), "parquet" (requires pyarrow) or "npz".
+            The binary formats keep the column names and store the sampling rate, units and gains.
+        cache : bool, optional
+            Skips the file if it is unchanged since its last conversion with the same settings,
+            recorded in manifest.json of dir_csv. self.data is then None, by default False
+        profiler : rapid.profiling.Profiler, optional
+            Records the time, bytes and peak allocation of the stages read, unpack, post_process and write
+        directory : str, optional
+            Folder in which csv/ and plots/ are created, by default the working folder
         **kwargs : optional
             Keyword arguments for changing how the csv is generated and are feeded directly into pd.read_csv().
         """
-        super().__init__(filename)
+        super().__init__(filename, directory)
         self.dir_csv = self.dir_csv / "BDS250"
         self.dir_plots = self.dir_plots / "BDS250"
-        self.fmt = "HI12f4B"
-        self.column_names_raw = [
-            "samplerate",
-            "time",
-            "P1",
-            "T1",
-            "P2",
-            "T2",
-            "P3",
-            "T3",
-            "accx",
-            "accy",
-            "accz",
-            "gyrox",
-            "gyroy",
-            "gyroz",
-            "calmag",
-            "calacc",
-            "calgyro",
-            "calimu",
-        ]
-        self.data = super()._process_and_save(savecsv, **kwargs)
+        self.fmt = BDS250_FMT
+        self.column_names_raw = list(BDS250_COLUMNS)
+        self.data = super()._process_and_save(savecsv, chunksize, output, cache, profiler, **kwargs)
 
     def _post_process(self, data: pd.DataFrame) -> pd.DataFrame:
-        data["time"] = (data["time"] - data["time"][0]) / 1000
+        if self.time0 is None:
+            self.time0 = data["time"][0]
+        data["time"] = (data["time"] - self.time0) / 1000
         data.insert(1, "pres", np.average(data[["P1", "P2", "P3"]], axis=-1))
         data.insert(1, "accmag", np.linalg.norm(data[["accx", "accy", "accz"]], axis=-1))
         data["accmag"] -= 9.81
@@ -269,7 +416,17 @@ class BDS250(Rapid):
 
 
 class EDF(Rapid):
-    def __init__(self, filename: str, savecsv: bool = True, **kwargs) -> None:
+    def __init__(
+        self,
+        filename: str,
+        savecsv: bool = True,
+        chunksize: int = None,
+        output: str = "csv",
+        cache: bool = False,
+        profiler=None,
+        directory: str = None,
+        **kwargs,
+    ) -> None:
         """This class processes EDF measurements at 2048 Hz. 
         Outputs are absolute pressure and accelerometer.
         Acceleration magnitude is included in the ouput and 
@@ -281,18 +438,31 @@ class EDF(Rapid):
             Relative file location + filename of the measurement
         savecsv : bool, optional
             Saves the processed data as a csv file if True, by default True
+        chunksize : int, optional
+            Processes and saves the file in blocks of chunksize packets with constant memory use.
+            The data are then not kept in self.data (None), by default the whole file is processed at once
+        output : str, optional
+            Format of the saved file: "csv" (default), "parquet" (requires pyarrow) or "npz".
+            The binary formats keep the column names and store the sampling rate, units and gains.
+        cache : bool, optional
+            Skips the file if it is unchanged since its last conversion with the same settings,
+            recorded in manifest.json of dir_csv. self.data is then None, by default False
+        profiler : rapid.profiling.Profiler, optional
+            Records the time, bytes and peak allocation of the stages read, unpack, post_process and write
+        directory : str, optional
+            Folder in which csv/ and plots/ are created, by default the working folder
         **kwargs : optional
             Keyword arguments for changing how the csv is generated and are feeded directly into pd.read_csv().
         """
-        super().__init__(filename)
+        super().__init__(filename, directory)
         self.dir_csv = self.dir_csv / "EDF"
         self.dir_plots = self.dir_plots / "EDF"
-        self.fmt = ">5hx"
-        self.column_names_raw = ["index", "accx", "accy", "accz", "pres"]
-        self.p_gain = 10
-        self.acc_gain = 10
-        self.fs = 2048
-        self.data = super()._process_and_save(savecsv, **kwargs)
+        self.fmt = EDF_FMT
+        self.column_names_raw = list(EDF_COLUMNS)
+        self.p_gain = EDF_P_GAIN
+        self.acc_gain = EDF_ACC_GAIN
+        self.fs = EDF_FS
+        self.data = super()._process_and_save(savecsv, chunksize, output, cache, profiler, **kwargs)
 
     def _post_process(self, data: pd.DataFrame) -> pd.DataFrame:
         data[["accx", "accy", "accz"]] /= self.acc_gain
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Shared import routines for the RAPID, BDS and Fish Backpack sensors.
+
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+The binary packets written by the sensors have a fixed size, so every file can be mapped
+directly onto a NumPy structured dtype and decoded in one vectorized pass. The scripts in
+the RAPID_V1 and RAPID_V3 folders use these routines for their conversions.
+
+The names of modules with heavier standard library imports (asyncio for rapid.live, sqlite3
+for rapid.catalog) are loaded on first access, so importing the package only loads NumPy.
+"""
+
+import importlib
+
+from rapid.batch import convert_directory
+from rapid.decimate import minmax_envelope
+from rapid.events import detect_events, file_events, fleet_events
+from rapid.export import convert_hig, convert_imp
+from rapid.formats import FORMATS, PacketFormat, get_format
+from rapid.framing import detect_sensor, frame_packets, validate_framing
+from rapid.merge import convert_merged, merge_files, pair_files
+from rapid.metrics import barotrauma_metrics, batch_metrics, file_metrics
+from rapid.overview import plot_directory, plot_file
+from rapid.packets import fmt_to_dtype, map_packets, unpack_array
+from rapid.profiling import Profiler
+from rapid.reader import iter_chunks, read
+from rapid.records import SensorRecord, load_record
+from rapid.resampling import interpolate_regular, resample, resample_file
+from rapid.spectra import file_spectra, fleet_spectra, spectral_summary
+from rapid.v3 import decode_hig, decode_imp, read_hig_packets, read_imp_packets
+
+__all__ = [
+    'Catalog', 'FORMATS', 'IncrementalDecoder', 'PacketFormat', 'Profiler', 'SensorRecord',
+    'barotrauma_metrics', 'batch_metrics', 'convert_directory', 'convert_hig', 'convert_imp',
+    'convert_merged', 'decode_hig', 'decode_imp', 'detect_events', 'detect_sensor', 'file_events',
+    'file_metrics', 'file_spectra', 'fleet_events', 'fleet_spectra', 'fmt_to_dtype', 'frame_packets',
+    'get_format', 'interpolate_regular', 'iter_chunks', 'iter_stream', 'load_record', 'map_packets',
+    'merge_files', 'minmax_envelope', 'pair_files', 'plot_directory', 'plot_file', 'read',
+    'read_hig_packets', 'read_imp_packets', 'resample', 'resample_file', 'spectral_summary', 'tail_file',
+    'unpack_array', 'update_catalog', 'validate_framing',
+]
+
+# name -> module, imported on first access
+_LAZY = {
+    'Catalog': 'rapid.catalog', 'update_catalog': 'rapid.catalog',
+    'IncrementalDecoder': 'rapid.live', 'iter_stream': 'rapid.live', 'tail_file': 'rapid.live',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module(_LAZY[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
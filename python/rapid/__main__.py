@@ -0,0 +1,7 @@
+"""Command line tool, see rapid.cli: python -m rapid --help"""
+
+import sys
+
+from rapid.cli import main
+
+sys.exit(main())
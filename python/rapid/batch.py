@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Parallel batch conversion of whole deployment directories.
+
+All .IMP and .HIG files below a directory are converted with a pool of worker processes. Each file is
+exported to a 'CSV' folder next to it, exactly as the import_IMP_RAPID_v3.py and import_HIG_RAPID_v3.py
+scripts do for a single folder. A file which fails to convert is reported and does not stop the batch.
+Files which are unchanged since their last conversion with the same settings are skipped, see rapid.manifest.
+"""
+
+import os
+import re
+
+from rapid.export import conversion_settings, convert_hig, convert_imp
+from rapid.manifest import Manifest, file_hash
+from rapid.profiling import Profiler, json_lines
+
+
+# sensor ID and start time (MMDDhhmmss) of file names like B38-0928141315.IMP, or C350419125306.txt of the
+# BDS and EDF loggers without the hyphen
+FILE_NAME = re.compile(r'^(?P<sensor>[A-Za-z0-9]+?)-?(?P<timestamp>\d{10})$')
+
+CONVERTERS = {
+    '.IMP': convert_imp,
+    '.HIG': convert_hig,
+}
+
+
+def find_files(filePath, suffixes=tuple(CONVERTERS), recursive=True):
+    """Lists all sensor files below a directory, skipping the exported 'CSV' folders.
+
+    Parameters
+    ----------
+    filePath : str or Path
+        Directory to search
+    suffixes : tuple of str, optional
+        File extensions to include, by default .IMP and .HIG
+    recursive : bool, optional
+        Also search all subfolders, by default True
+
+    Returns
+    -------
+    list of str
+        Sorted file locations
+    """
+    found = []
+    for root, dirs, files in os.walk(filePath):
+        dirs[:] = sorted(d for d in dirs if d != 'CSV') if recursive else []
+        found.extend(os.path.join(root, f) for f in sorted(files) if os.path.splitext(f)[1] in suffixes)
+    return found
+
+
+def parse_name(fileFull):
+    """Splits a file name like B38-0928141315.IMP or C350419125306.txt into the sensor ID and the start time stamp.
+
+    Parameters
+    ----------
+    fileFull : str or Path
+        Location or name of the sensor file
+
+    Returns
+    -------
+    tuple of str or None
+        (sensor ID, time stamp MMDDhhmmss), e.g. ('B38', '0928141315'), None if the name does not match
+    """
+    match = FILE_NAME.match(os.path.splitext(os.path.basename(fileFull))[0])
+    return None if match is None else (match['sensor'], match['timestamp'])
+
+
+def map_files(function, files, workers=None, verbose=True, callback=None, **kwargs):
+    """Applies function(fileFull, **kwargs) to many files with a pool of worker processes.
+
+    Parameters
+    ----------
+    function : callable
+        Module level function, so it can be sent to the worker processes
+    files : list
+        Files to process
+    workers : int, optional
+        Number of worker processes, by default os.cpu_count(). With 1 the files are processed in this process.
+    verbose : bool, optional
+        Print the failures, by default True
+    callback : callable, optional
+        callback(fileFull, result, error) is called in this process as each file finishes, error is None on
+        success and the exception otherwise, e.g. to record the progress
+    **kwargs : optional
+        Further arguments of function
+
+    Returns
+    -------
+    tuple of dict
+        (results, failed): source file -> result in the order of files, and source file -> error message
+    """
+    results, failed = {}, {}
+
+    def report(fileFull, result=None, error=None):
+        if error is None:
+            results[fileFull] = result
+        else:
+            failed[fileFull] = f'{type(error).__name__}: {error}'
+            if verbose:
+                print(f'{fileFull} FAILED ({failed[fileFull]})')
+        if callback is not None:
+            callback(fileFull, result, error)
+
+    if workers == 1:
+        for fileFull in files:
+            try:
+                report(fileFull, function(fileFull, **kwargs))
+            except Exception as error:
+                report(fileFull, error=error)
+    else:
+        # imported here, so a single conversion with the command line tool does not load multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(function, fileFull, **kwargs): fileFull for fileFull in files}
+            for future in as_completed(futures):
+                try:
+                    report(futures[future], future.result())
+                except Exception as error:
+                    report(futures[future], error=error)
+    return {f: results[f] for f in files if f in results}, failed
+
+
+def _export_folder(fileFull, filePathCSV=None):
+    return os.path.join(os.path.dirname(fileFull), 'CSV') if filePathCSV is None else os.fspath(filePathCSV)
+
+
+def _convert_one(fileFull, output='csv', filePathCSV=None, profile=None):
+    converter = CONVERTERS[os.path.splitext(fileFull)[1]]
+    sha256 = file_hash(fileFull)
+    profiler = Profiler(hooks=[json_lines(profile)]) if profile else None
+    exportFile = converter(fileFull, _export_folder(fileFull, filePathCSV), output=output, profiler=profiler)
+    return exportFile, sha256
+
+
+def convert_directory(filePath, workers=None, suffixes=tuple(CONVERTERS), recursive=True, verbose=True,
+                      output='csv', incremental=True, filePathCSV=None, profile=None):
+    """Converts all sensor files below a directory in parallel.
+
+    Parameters
+    ----------
+    filePath : str, Path or list
+        Directory holding the .IMP and .HIG files, e.g. data/RAPID/RAPID_V3/RAPID_V3_IMP, or a list of files
+    workers : int, optional
+        Number of worker processes, by default os.cpu_count(). With 1 the files are converted in this process.
+    suffixes : tuple of str, optional
+        File extensions to convert, by default .IMP and .HIG
+    recursive : bool, optional
+        Also convert the files in all subfolders, by default True
+    verbose : bool, optional
+        Print the progress and failures per file, by default True
+    output : str, optional
+        Export format: 'csv' (default), 'parquet' or 'npz', see rapid.export.OUTPUTS
+    incremental : bool, optional
+        Skip files recorded as unchanged in the manifest.json of their 'CSV' folder, by default True
+    filePathCSV : str or Path, optional
+        Export folder of all files, by default a 'CSV' folder next to each file
+    profile : str or Path, optional
+        JSON lines file to which the stage timings of each file are appended, see rapid.profiling
+
+    Returns
+    -------
+    tuple
+        (converted, failed, skipped): source file -> exported file, source file -> error message,
+        and the list of unchanged files which were not converted again
+    """
+    manifests = {}
+
+    def manifest(fileFull):
+        folder = _export_folder(fileFull, filePathCSV)
+        if folder not in manifests:
+            manifests[folder] = Manifest(folder)
+        return manifests[folder]
+
+    def settings(fileFull):
+        return conversion_settings(os.path.splitext(fileFull)[1][1:], output)
+
+    if isinstance(filePath, (str, os.PathLike)):
+        filePath = find_files(filePath, suffixes, recursive)
+    contents, skipped = [], []
+    for fileFull in map(os.fspath, filePath):
+        if incremental and manifest(fileFull).is_current(fileFull, settings(fileFull)):
+            skipped.append(fileFull)
+        else:
+            contents.append(fileFull)
+    for folder_manifest in manifests.values():
+        if folder_manifest.dirty:
+            folder_manifest.save()  # new modification times of touched but unchanged files
+    if verbose and skipped:
+        print(f'Skipping {len(skipped)} unchanged files')
+
+    converted, finished = {}, []
+
+    def report(fileFull, result, error):
+        # the manifest is saved after every conversion, so an interrupted run keeps the converted files
+        finished.append(fileFull)
+        if error is None:
+            exportFile, sha256 = result
+            converted[fileFull] = exportFile
+            manifest(fileFull).record(fileFull, exportFile, settings(fileFull), sha256)
+            manifest(fileFull).save()
+        if verbose:
+            status = 'done' if error is None else f'FAILED ({type(error).__name__}: {error})'
+            print(f'[{len(finished)}/{len(contents)}] {fileFull} {status}')
+
+    _, failed = map_files(_convert_one, contents, workers, False, report, output=output, filePathCSV=filePathCSV,
+                          profile=profile)
+    return converted, failed, skipped
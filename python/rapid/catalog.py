@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+SQLite catalog of all recordings of an archive with precomputed summary statistics.
+
+Questions like "all passages with impacts above 100 g and a pressure nadir below 500 mbar" would otherwise
+decode every file of the archive. update_catalog walks an archive (e.g. data/, with data/RAPID/... and
+data/BDS/...) once, detects the format of each file (.IMP and .HIG by extension, the .txt files of the EDF,
+BDS100 and BDS250 loggers by their packet framing, see rapid.framing.detect_sensor), streams it with the
+corrupted regions cut out and stores per file:
+
+    files     path, size, mtime_ns, sensor type, sensor ID and time stamp of the name (B38-0928141315:
+              'B38', '0928141315' = MMDDhhmmss), start_time (ISO 8601 if the year is given), fs (measured
+              row rate), n_samples, duration (s), valid_packets, framing_issues, peak_g (largest acceleration
+              magnitude), n_events (see rapid.events), acclimation, nadir and lrp (see rapid.metrics),
+              error (files which could not be read, with the other columns NULL)
+    channels  per file and channel (plus the derived 'accmag_g' and 'pressure'): unit, min, max, mean and the
+              PERCENTILES p01, p05, p50, p95, p99
+
+A later run only reads the files which are new or whose size or modification time changed, and removes the
+entries of deleted files. Queries then take milliseconds:
+
+    with Catalog('data/catalog.sqlite') as catalog:
+        catalog.search(min_peak_g=100, max_nadir=500)
+        catalog.query("SELECT path FROM files JOIN channels ON id = file_id WHERE channel = 'T1' AND max > 20")
+
+The percentiles are exact up to PERCENTILE_SAMPLES rows and taken from evenly spaced rows of longer files.
+"""
+
+import datetime
+import os
+import sqlite3
+
+import numpy as np
+
+from rapid.batch import find_files, map_files, parse_name
+from rapid.events import SIGNALS, EventDetector, acceleration_magnitude, pressure, time_key
+from rapid.formats import FORMATS, UNITS
+from rapid.framing import detect_sensor, validate_framing
+from rapid.metrics import PressureAccumulator
+from rapid.reader import CHUNK_SIZE, iter_chunks
+
+
+CATALOG_NAME = 'catalog.sqlite'
+CATALOG_VERSION = '2'  # increase when the schema or the statistics change, the catalog is then rebuilt
+SUFFIXES = ('.IMP', '.HIG', '.txt')
+PERCENTILES = (1, 5, 50, 95, 99)
+PERCENTILE_SAMPLES = 2**20  # rows per channel kept for the percentiles
+DERIVED = {'accmag_g': 'g', 'pressure': 'mbar'}  # acceleration magnitude and (mean) pressure of every sensor
+
+FILE_COLUMNS = ['path', 'size', 'mtime_ns', 'sensor', 'sensor_id', 'timestamp', 'start_time', 'fs', 'n_samples',
+                'duration', 'valid_packets', 'framing_issues', 'peak_g', 'n_events', 'acclimation', 'nadir', 'lrp',
+                'error']
+STAT_COLUMNS = ['min', 'max', 'mean'] + [f'p{q:02d}' for q in PERCENTILES]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL, size INTEGER, mtime_ns INTEGER,
+    sensor TEXT, sensor_id TEXT, timestamp TEXT, start_time TEXT,
+    fs REAL, n_samples INTEGER, duration REAL, valid_packets INTEGER, framing_issues INTEGER,
+    peak_g REAL, n_events INTEGER, acclimation REAL, nadir REAL, lrp REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS channels (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    channel TEXT NOT NULL, unit TEXT, {', '.join(f'{c} REAL' for c in STAT_COLUMNS)},
+    PRIMARY KEY (file_id, channel)
+);
+CREATE INDEX IF NOT EXISTS files_sensor ON files (sensor, sensor_id, timestamp);
+CREATE INDEX IF NOT EXISTS files_peak ON files (peak_g);
+CREATE INDEX IF NOT EXISTS files_nadir ON files (nadir);
+CREATE INDEX IF NOT EXISTS channels_max ON channels (channel, max);
+CREATE INDEX IF NOT EXISTS channels_min ON channels (channel, min);
+"""
+
+
+class ChannelStats:
+    def __init__(self, n_rows) -> None:
+        """Min, max, mean and percentiles of one channel, fed block by block.
+
+        Parameters
+        ----------
+        n_rows : int
+            Rows of the recording, sets the spacing of the rows kept for the percentiles
+        """
+        self.step = max(-(-n_rows // PERCENTILE_SAMPLES), 1)
+        self._min, self._max, self._sum, self._count = np.inf, -np.inf, 0.0, 0
+        self._samples = []
+        self._row = 0
+
+    def update(self, values) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        # every step-th row of the recording, continued over the blocks
+        self._samples.append(values[-self._row % self.step::self.step])
+        self._row += len(values)
+        values = values[np.isfinite(values)]
+        if len(values):
+            self._min = min(self._min, values.min())
+            self._max = max(self._max, values.max())
+            self._sum += values.sum()
+            self._count += len(values)
+
+    def result(self) -> dict:
+        """STAT_COLUMNS -> value, None without finite values."""
+        if self._count == 0:
+            return dict.fromkeys(STAT_COLUMNS)
+        samples = np.concatenate(self._samples)
+        samples = samples[np.isfinite(samples)]
+        stats = {'min': float(self._min), 'max': float(self._max), 'mean': self._sum / self._count}
+        for q, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+            stats[f'p{q:02d}'] = float(value)
+        return stats
+
+
+def _start_time(timestamp, year):
+    if timestamp is None or year is None:
+        return None
+    try:
+        return datetime.datetime.strptime(f'{year}{timestamp}', '%Y%m%d%H%M%S').isoformat()
+    except ValueError:
+        return None
+
+
+def summarize_file(fileFull, sensor=None, year=None, chunk_size=CHUNK_SIZE) -> dict:
+    """Catalog entry of one sensor file, streamed block by block with the corrupted regions cut out.
+
+    Parameters
+    ----------
+    fileFull : str or Path
+        Location of the binary file
+    sensor : str, optional
+        Sensor type, detected from the extension or the packet framing by default
+    year : int, optional
+        Year of the recording, the file names only hold month, day and time
+    chunk_size : int, optional
+        Rows decoded at a time, by default rapid.reader.CHUNK_SIZE
+
+    Returns
+    -------
+    dict
+        FILE_COLUMNS -> value, plus 'channels': channel -> dict of unit and STAT_COLUMNS
+    """
+    fileFull = os.path.abspath(fileFull)
+    stat = os.stat(fileFull)
+    sensor = sensor or detect_sensor(fileFull)
+    if sensor is None:
+        raise ValueError('Unknown file format, not an IMP, HIG, EDF, BDS100 or BDS250 recording')
+    packet_format = FORMATS[sensor]
+    report = validate_framing(fileFull, sensor)
+    n_rows = packet_format.n_rows(report['valid_packets'])
+
+    stats = {key: ChannelStats(n_rows) for key in list(packet_format.channels) + list(DERIVED)}
+    detector = EventDetector(None)  # measures the row rate, 100 Hz for the .IMP rows
+    has_pressure = bool(SIGNALS[sensor][2])
+    accumulator = PressureAccumulator() if has_pressure else None
+    t_first = t_last = None
+    n_events = 0
+    for data in iter_chunks(fileFull, chunk_size, sensor=sensor, resync=True):
+        time = data[time_key(sensor)]
+        if len(time) == 0:
+            continue
+        t_first = time[0] if t_first is None else t_first
+        t_last = time[-1]
+        magnitude = acceleration_magnitude(data, sensor)
+        pres = pressure(data, sensor)
+        for key in packet_format.channels:
+            stats[key].update(data[key])
+        stats['accmag_g'].update(magnitude)
+        n_events += len(detector.update(time, magnitude)['t_peak'])
+        if has_pressure:
+            stats['pressure'].update(pres)
+            accumulator.update(time, pres)
+    n_events += len(detector.finish()['t_peak'])
+
+    name = parse_name(fileFull)
+    sensor_id, timestamp = name if name is not None else (None, None)
+    metrics = accumulator.result() if has_pressure else {}
+    channels = {}
+    for key, channel in stats.items():
+        if key == 'pressure' and not has_pressure:
+            continue
+        channels[key] = {'unit': DERIVED.get(key, UNITS.get(key, '')), **channel.result()}
+    return {
+        'path': fileFull,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sensor': sensor,
+        'sensor_id': sensor_id,
+        'timestamp': timestamp,
+        'start_time': _start_time(timestamp, year),
+        'fs': None if np.isnan(detector.fs) else detector.fs,
+        'n_samples': n_rows,
+        'duration': None if t_first is None else float(t_last - t_first),
+        'valid_packets': report['valid_packets'],
+        'framing_issues': len(report['issues']),
+        'peak_g': channels['accmag_g']['max'],
+        'n_events': n_events,
+        'acclimation': _scalar(metrics.get('acclimation')),
+        'nadir': _scalar(metrics.get('nadir')),
+        'lrp': _scalar(metrics.get('lrp')),
+        'error': None,
+        'channels': channels,
+    }
+
+
+def _scalar(values):
+    if values is None or len(values) == 0 or not np.isfinite(values[0]):
+        return None
+    return float(values[0])
+
+
+class Catalog:
+    def __init__(self, database=CATALOG_NAME) -> None:
+        """Catalog of recordings in a SQLite database, created if missing.
+
+        A database written by an older CATALOG_VERSION is emptied, the next update then indexes all files again.
+
+        Parameters
+        ----------
+        database : str or Path
+            Location of the SQLite file, by default CATALOG_NAME in the working folder
+        """
+        self.database = os.fspath(database)
+        self.connection = sqlite3.connect(self.database)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row['value'] != CATALOG_VERSION:
+            with self.connection:
+                self.connection.execute('DELETE FROM channels')
+                self.connection.execute('DELETE FROM files')
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (CATALOG_VERSION,))
+
+    def __enter__(self) -> "Catalog":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def is_current(self, fileFull) -> bool:
+        """True if fileFull is in the catalog with its current size and modification time."""
+        row = self.connection.execute('SELECT size, mtime_ns FROM files WHERE path = ?',
+                                      (os.path.abspath(fileFull),)).fetchone()
+        if row is None:
+            return False
+        stat = os.stat(fileFull)
+        return row['size'] == stat.st_size and row['mtime_ns'] == stat.st_mtime_ns
+
+    def add(self, entry) -> None:
+        """Inserts or replaces the entry of a file, see summarize_file."""
+        with self.connection:
+            self.connection.execute('DELETE FROM files WHERE path = ?', (entry['path'],))
+            cursor = self.connection.execute(
+                f"INSERT INTO files ({', '.join(FILE_COLUMNS)}) VALUES ({', '.join('?' * len(FILE_COLUMNS))})",
+                [entry.get(column) for column in FILE_COLUMNS],
+            )
+            self.connection.executemany(
+                f"INSERT INTO channels VALUES (?, ?, ?, {', '.join('?' * len(STAT_COLUMNS))})",
+                [(cursor.lastrowid, key, values['unit'], *(values[c] for c in STAT_COLUMNS))
+                 for key, values in entry.get('channels', {}).items()],
+            )
+
+    def add_error(self, fileFull, error) -> None:
+        """Records a file which could not be read, so it is only tried again once it changes."""
+        stat = os.stat(fileFull)
+        self.add({'path': os.path.abspath(fileFull), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                  'error': error})
+
+    def remove(self, paths) -> None:
+        """Removes the entries of files, e.g. deleted from the archive."""
+        with self.connection:
+            self.connection.executemany('DELETE FROM files WHERE path = ?', [(os.fspath(p),) for p in paths])
+
+    def set_start_times(self, paths, year) -> int:
+        """Sets start_time of the entries of paths from their time stamp and year, returns the rows changed."""
+        changes = []
+        for fileFull in paths:
+            row = self.connection.execute('SELECT id, timestamp, start_time FROM files WHERE path = ?',
+                                          (os.path.abspath(fileFull),)).fetchone()
+            start_time = None if row is None else _start_time(row['timestamp'], year)
+            if row is not None and start_time != row['start_time']:
+                changes.append((start_time, row['id']))
+        with self.connection:
+            self.connection.executemany('UPDATE files SET start_time = ? WHERE id = ?', changes)
+        return len(changes)
+
+    def paths(self, below=None) -> list:
+        """Files in the catalog, only the ones in the folder below and its subfolders if given."""
+        if below is None:
+            rows = self.connection.execute('SELECT path FROM files')
+        else:
+            prefix = os.path.join(os.path.abspath(below), '')
+            rows = self.connection.execute('SELECT path FROM files WHERE substr(path, 1, ?) = ?',
+                                           (len(prefix), prefix))
+        return [row['path'] for row in rows]
+
+    def query(self, sql, params=()) -> list:
+        """Runs a SELECT statement, returns the rows as dicts."""
+        return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def search(self, min_peak_g=None, max_nadir=None, sensor=None, sensor_id=None) -> list:
+        """Files with impacts of at least min_peak_g and a pressure nadir of at most max_nadir (mbar / hPa).
+
+        Parameters
+        ----------
+        min_peak_g : float, optional
+            Lowest peak acceleration magnitude in g
+        max_nadir : float, optional
+            Highest pressure nadir
+        sensor : str, optional
+            Sensor type, e.g. 'IMP'
+        sensor_id : str, optional
+            Sensor ID of the file names, e.g. 'B38'
+
+        Returns
+        -------
+        list of dict
+            Rows of the files table, ordered by sensor ID and time stamp
+        """
+        conditions, params = ['error IS NULL'], []
+        for column, operator, value in (('peak_g', '>=', min_peak_g), ('nadir', '<=', max_nadir),
+                                        ('sensor', '=', sensor), ('sensor_id', '=', sensor_id)):
+            if value is not None:
+                conditions.append(f'{column} {operator} ?')
+                params.append(value)
+        return self.query(f"SELECT * FROM files WHERE {' AND '.join(conditions)} ORDER BY sensor_id, timestamp",
+                          params)
+
+    def channel_stats(self, fileFull) -> dict:
+        """Channel -> unit and STAT_COLUMNS of a file in the catalog."""
+        rows = self.query('SELECT channels.* FROM channels JOIN files ON id = file_id WHERE path = ?',
+                          (os.path.abspath(fileFull),))
+        return {row.pop('channel'): {k: v for k, v in row.items() if k != 'file_id'} for row in rows}
+
+
+def update_catalog(archive, database=None, workers=None, recursive=True, verbose=True, year=None,
+                   suffixes=SUFFIXES):
+    """Indexes the new and changed recordings of an archive and removes the entries of deleted files.
+
+    Parameters
+    ----------
+    archive : str or Path
+        Folder searched for sensor files, e.g. data
+    database : str or Path, optional
+        Location of the SQLite file, by default CATALOG_NAME in the archive folder
+    workers : int, optional
+        Number of worker processes, by default os.cpu_count(). With 1 the files are read in this process.
+    recursive : bool, optional
+        Also search all subfolders, by default True
+    verbose : bool, optional
+        Print the progress and failures, by default True
+    year : int, optional
+        Year of the recordings, for start_time, also applied to the unchanged files
+    suffixes : tuple of str, optional
+        File extensions to index, by default SUFFIXES
+
+    Returns
+    -------
+    tuple
+        (indexed, failed, skipped, removed): lists of the indexed, unreadable, unchanged and removed files
+    """
+    archive = os.path.abspath(archive)
+    database = os.path.join(archive, CATALOG_NAME) if database is None else database
+    files = find_files(archive, suffixes, recursive)
+    with Catalog(database) as catalog:
+        # only the files which are gone, not the ones outside the searched folders or suffixes
+        found = set(files)
+        removed = sorted(p for p in catalog.paths(archive) if p not in found and not os.path.isfile(p))
+        catalog.remove(removed)
+        current = {f for f in files if catalog.is_current(f)}
+        skipped = [f for f in files if f in current]
+        contents = [f for f in files if f not in current]
+        if year is not None:
+            # the year is not part of the file, a new year only changes start_time of the unchanged files
+            dated = catalog.set_start_times(skipped, year)
+        if verbose:
+            print(f'{len(contents)} files to index, {len(skipped)} unchanged, {len(removed)} removed')
+            if year is not None and dated:
+                print(f'start_time of {dated} unchanged files set for the year {year}')
+        entries, failed = map_files(summarize_file, contents, workers, verbose, year=year)
+        for entry in entries.values():
+            catalog.add(entry)
+        for fileFull, error in failed.items():
+            catalog.add_error(fileFull, error)
+    return list(entries), list(failed), skipped, removed
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Command line tool for the conversion of all sensor types, run from the python folder or, after
+`pip install -e python` (editable, as the bds100, bds250 and edf commands load ../RAPID_V1), as `rapid`:
+
+    python -m rapid imp data/RAPID/RAPID_V3/RAPID_V3_IMP --output npz
+    python -m rapid hig B38-0928141315.HIG --out CSV --workers 1
+    python -m rapid bds100 measurements/ --absolute-orientation --chunksize 100000
+    python -m rapid edf EDF-0101000000.txt -C results --plot
+    python -m rapid index data --year 2019
+    python -m rapid spectra data/RAPID/RAPID_V3 --summary spectra.csv
+
+Each path is a sensor file or a folder searched for them. The .IMP and .HIG files are converted like the
+V3 scripts into a 'CSV' folder next to each file; the BDS and EDF files with the classes of
+RAPID_V1/import_BDS_RAPID_v1.py into csv/<sensor>/ below the working folder or -C. Files which are unchanged
+since their last conversion are skipped unless --force is given.
+
+Only NumPy is loaded at start-up. pandas and the BDS / EDF classes are imported for the bds100, bds250 and
+edf commands, matplotlib only with --plot, and the worker processes only for more than one file.
+The index command adds the new and changed recordings of an archive to its SQLite catalog, see rapid.catalog.
+The spectra command writes the dominant frequency, RMS and band powers of the vibration channels of all files,
+see rapid.spectra. Segments with longer gaps than a few dropped packets are skipped unless --no-skip-gaps.
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+from rapid.batch import convert_directory, find_files, map_files
+from rapid.export import OUTPUTS
+
+
+V1_SCRIPT = Path(__file__).resolve().parents[1] / 'RAPID_V1' / 'import_BDS_RAPID_v1.py'
+V3_SENSORS = {'imp': 'IMP', 'hig': 'HIG'}
+V1_SENSORS = {'bds100': 'BDS100', 'bds250': 'BDS250', 'edf': 'EDF'}
+
+
+def load_v1():
+    """Imports RAPID_V1/import_BDS_RAPID_v1.py, which holds the BDS100, BDS250 and EDF classes."""
+    name = 'import_BDS_RAPID_v1'
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, V1_SCRIPT)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+def _files(paths, suffixes, recursive, quiet=False):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(find_files(os.path.abspath(path), suffixes, recursive))
+        elif os.path.isfile(path):
+            files.append(os.path.abspath(path))
+        else:
+            raise FileNotFoundError(f'No such file or directory: {path}')
+    if not files and not quiet:
+        print(f'no {" or ".join(suffixes)} files found', file=sys.stderr)
+    return files
+
+
+def _convert_v1(fileFull, sensor, output='csv', chunksize=None, cache=True, profile=None, plot=False, directory=None,
+                **options):
+    """Converts one BDS or EDF file with its class, returns the location of the saved file."""
+    from rapid.profiling import Profiler, json_lines
+
+    profiler = Profiler(hooks=[json_lines(profile)]) if profile else None
+    measurement = getattr(load_v1(), sensor)(fileFull, chunksize=chunksize, output=output, cache=cache,
+                                             profiler=profiler, directory=directory, **options)
+    if plot:
+        from rapid.overview import plot_file
+
+        plot_file(fileFull, sensor, dir_plots=measurement.dir_plots)
+    return str(measurement._export_path())
+
+
+def _plot(fileFull, sensor):
+    from rapid.overview import plot_file
+
+    return plot_file(fileFull, sensor)
+
+
+def run_v3(args):
+    sensor = V3_SENSORS[args.command]
+    files = _files(args.paths, (f'.{sensor}',), not args.no_recursive, args.quiet)
+    workers = 1 if len(files) <= 1 else args.workers
+    converted, failed, skipped = convert_directory(
+        files, workers=workers, verbose=not args.quiet, output=args.output, incremental=not args.force,
+        filePathCSV=args.out, profile=args.profile,
+    )
+    if args.plot:
+        _, failed_plots = map_files(_plot, list(converted), workers, not args.quiet, sensor=sensor)
+        failed.update(failed_plots)
+    return failed
+
+
+def run_v1(args):
+    sensor = V1_SENSORS[args.command]
+    files = _files(args.paths, ('.txt',), not args.no_recursive, args.quiet)
+    profile = args.profile and os.path.abspath(args.profile)
+    options = {'absolute_orientation': True} if getattr(args, 'absolute_orientation', False) else {}
+    workers = 1 if len(files) <= 1 else args.workers
+    converted, failed = map_files(
+        _convert_v1, files, workers, not args.quiet, sensor=sensor, output=args.output, chunksize=args.chunksize,
+        cache=not args.force, profile=profile, plot=args.plot, directory=args.directory, **options,
+    )
+    if not args.quiet:
+        for fileFull, exportFile in converted.items():
+            print(f'{fileFull} -> {exportFile}')
+    return failed
+
+
+def run_index(args):
+    from rapid.catalog import update_catalog
+
+    failed = {}
+    for archive in args.paths:
+        _, unreadable, _, _ = update_catalog(archive, args.db, workers=args.workers, recursive=not args.no_recursive,
+                                             verbose=not args.quiet, year=args.year)
+        failed.update(dict.fromkeys(unreadable, 'not indexed'))
+    return failed
+
+
+def run_spectra(args):
+    from rapid.spectra import NPERSEG, fleet_spectra, spectral_summary, write_summary
+
+    files = _files(args.paths, ('.txt',) if args.sensor else ('.IMP', '.HIG'), not args.no_recursive, args.quiet)
+    if not files:
+        return {}
+    workers = 1 if len(files) <= 1 else args.workers
+    spectra, failed = fleet_spectra(files, args.sensor, workers, not args.quiet, nperseg=args.nperseg or NPERSEG,
+                                    skip_gaps=not args.no_skip_gaps)
+    write_summary(args.summary, spectral_summary(spectra))
+    if not args.quiet:
+        for fileFull, result in spectra.items():
+            if result['n_segments'] == 0:
+                print(f'{fileFull}: all {result["skipped"]} segments hold gaps, use a smaller --nperseg '
+                      f'or --no-skip-gaps', file=sys.stderr)
+        print(f'{len(spectra)} files -> {args.summary}')
+    return failed
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m rapid', description='Converts RAPID, BDS and EDF sensor files.',
+        epilog='See the docstring of rapid/cli.py for examples.',
+    )
+    commands = parser.add_subparsers(dest='command', required=True, metavar='command')
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('paths', nargs='+', help='sensor files or folders searched for them')
+    common.add_argument('--output', choices=list(OUTPUTS), default='csv', help='export format (default csv)')
+    common.add_argument('--workers', type=int, default=None,
+                        help='worker processes for several files (default: number of CPUs)')
+    common.add_argument('--force', action='store_true', help='also convert files which are unchanged')
+    common.add_argument('--no-recursive', action='store_true', help='do not search the subfolders')
+    common.add_argument('--plot', action='store_true', help='also save an overview plot (requires matplotlib)')
+    common.add_argument('--profile', metavar='FILE', help='append the stage timings to a JSON lines file')
+    common.add_argument('-q', '--quiet', action='store_true', help='only report failures')
+
+    for command, sensor in V3_SENSORS.items():
+        sub = commands.add_parser(command, parents=[common], help=f'RAPID V3 .{sensor} files')
+        sub.add_argument('--out', metavar='DIR', help="export folder (default: 'CSV' next to each file)")
+        sub.set_defaults(run=run_v3)
+
+    for command, sensor in V1_SENSORS.items():
+        sub = commands.add_parser(command, parents=[common], help=f'{sensor} .txt files')
+        sub.add_argument('-C', '--directory', metavar='DIR',
+                         help='folder of csv/ and plots/ (default: the working folder)')
+        sub.add_argument('--chunksize', type=int, default=None,
+                         help='packets processed at a time, bounds the memory use (default: whole file)')
+        if sensor == 'BDS100':
+            sub.add_argument('--absolute-orientation', action='store_true',
+                             help='add the earth-frame acceleration absaccx/y/z')
+        sub.set_defaults(run=run_v1)
+
+    sub = commands.add_parser('index', help='SQLite catalog of the recordings of an archive')
+    sub.add_argument('paths', nargs='+', help='archive folders, e.g. data')
+    sub.add_argument('--db', metavar='FILE', help='catalog file (default: catalog.sqlite in each archive folder)')
+    sub.add_argument('--year', type=int, help='year of the recordings, the file names only hold month and day')
+    sub.add_argument('--workers', type=int, default=None,
+                     help='worker processes (default: number of CPUs)')
+    sub.add_argument('--no-recursive', action='store_true', help='do not search the subfolders')
+    sub.add_argument('-q', '--quiet', action='store_true', help='only report failures')
+    sub.set_defaults(run=run_index)
+
+    sub = commands.add_parser('spectra', help='Welch spectra summary of the vibration channels')
+    sub.add_argument('paths', nargs='+', help='sensor files or folders searched for them')
+    sub.add_argument('--sensor', choices=list(V1_SENSORS.values()),
+                     help='sensor type of .txt files (default: the .IMP and .HIG files)')
+    sub.add_argument('--summary', metavar='FILE', default='spectra.csv', help='summary table (default spectra.csv)')
+    sub.add_argument('--nperseg', type=int, help='samples per segment (default 256)')
+    sub.add_argument('--no-skip-gaps', action='store_true',
+                     help='also use the segments holding gaps of more than GAP_PERIODS sample periods')
+    sub.add_argument('--workers', type=int, default=None,
+                     help='worker processes for several files (default: number of CPUs)')
+    sub.add_argument('--no-recursive', action='store_true', help='do not search the subfolders')
+    sub.add_argument('-q', '--quiet', action='store_true', help='only report failures')
+    sub.set_defaults(run=run_spectra)
+    return parser
+
+
+def main(argv=None):
+    """Runs the command line tool, returns the exit status: 0, or 1 if a file failed."""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    missing = [path for path in args.paths if not os.path.exists(path)]
+    if missing:
+        parser.error(f'no such file or directory: {", ".join(missing)}')
+    failed = args.run(args)
+    if args.quiet:
+        # without --quiet the failures are already reported with the progress
+        for fileFull, error in failed.items():
+            print(f'{fileFull} FAILED ({error})', file=sys.stderr)
+    return 1 if failed else 0
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Min/max envelope decimation of long series for plotting.
+
+A plot cannot show more than one value per pixel column, so a series of millions of samples is split into
+n_points / 2 buckets of consecutive samples and only the smallest and the largest sample of each bucket are
+kept, in their original order. Unlike a rolling mean, the envelope keeps every strike peak and pressure nadir
+at its full height. The buckets follow the row number, so a file can be decimated block by block with
+EnvelopeAccumulator when its number of rows is known, e.g. from the file size.
+"""
+
+import numpy as np
+
+
+PIXELS = 2500  # width of the overview plots in pixels (25 inch at 100 dpi)
+N_POINTS = 2 * PIXELS  # minimum and maximum of each pixel column
+
+
+class EnvelopeAccumulator:
+    def __init__(self, n_rows, n_points=N_POINTS) -> None:
+        """Min/max envelope of a series of n_rows samples, fed block by block.
+
+        Parameters
+        ----------
+        n_rows : int
+            Total number of samples of the series
+        n_points : int, optional
+            Number of points of the envelope, by default N_POINTS
+        """
+        self.n_rows = n_rows
+        self.buckets = max(min(n_points // 2, n_rows), 1)
+        self._min = np.full(self.buckets, np.inf)
+        self._max = np.full(self.buckets, -np.inf)
+        self._min_row = np.full(self.buckets, -1)
+        self._max_row = np.full(self.buckets, -1)
+        self._min_x = np.full(self.buckets, np.nan)
+        self._max_x = np.full(self.buckets, np.nan)
+
+    def update(self, rows, x, y) -> None:
+        """Adds consecutive samples.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            Row numbers of the samples in the series, increasing
+        x, y : np.ndarray
+            Coordinates of the samples, NaN values of y are ignored
+        """
+        if len(rows) == 0:
+            return
+        rows, x, y = np.asarray(rows), np.asarray(x), np.asarray(y, dtype=np.float64)
+        bucket = rows * self.buckets // self.n_rows
+        starts = np.flatnonzero(np.diff(bucket, prepend=-1))
+        ids = bucket[starts]
+        local = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(y))))  # bucket index in the block
+        for ufunc, better, value, row, xs in (
+            (np.fmin, np.less, self._min, self._min_row, self._min_x),
+            (np.fmax, np.greater, self._max, self._max_row, self._max_x),
+        ):
+            block = ufunc.reduceat(y, starts)
+            # first sample of each bucket holding its extreme, replacing the one of earlier blocks if beyond it
+            hit = np.flatnonzero(y == block[local])
+            found, first = np.unique(local[hit], return_index=True)
+            at = hit[first]
+            take = better(block[found], value[ids[found]])
+            found, at = found[take], at[take]
+            value[ids[found]] = block[found]
+            row[ids[found]] = rows[at]
+            xs[ids[found]] = x[at]
+
+    def result(self):
+        """Envelope points in the order of the rows.
+
+        Returns
+        -------
+        tuple of np.ndarray
+            (x, y) with the minimum and the maximum of each bucket, buckets without values are skipped
+        """
+        rows = np.column_stack((self._min_row, self._max_row))
+        x = np.column_stack((self._min_x, self._max_x))
+        y = np.column_stack((self._min, self._max))
+        order = np.argsort(rows, axis=1, kind='stable')
+        rows, x, y = (np.take_along_axis(a, order, axis=1).ravel() for a in (rows, x, y))
+        # a bucket with a single sample or a constant value gives the same point twice
+        keep = (rows >= 0) & np.concatenate(([True], rows[1:] != rows[:-1]))
+        return x[keep], y[keep]
+
+
+def minmax_envelope(x, y, n_points=N_POINTS):
+    """Reduces a series to the minimum and maximum of n_points / 2 buckets of consecutive samples.
+
+    Parameters
+    ----------
+    x, y : array_like
+        Coordinates of the series, e.g. time and acceleration magnitude
+    n_points : int, optional
+        Largest number of points returned, by default N_POINTS
+
+    Returns
+    -------
+    tuple of np.ndarray
+        (x, y) of the envelope, the series itself if it has at most n_points samples
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    if len(y) <= n_points:
+        return x, y
+    envelope = EnvelopeAccumulator(len(y), n_points)
+    envelope.update(np.arange(len(y)), x, y)
+    return envelope.result()
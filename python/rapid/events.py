@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Detection of blade strikes and collisions in the acceleration magnitude.
+
+An event starts where the acceleration magnitude crosses the threshold and ends where it falls below it.
+Crossings which follow the end of an event within the refractory window belong to the same event, so the
+ringing after a strike is not counted twice. Runs, peaks and durations are found with array operations on
+whole blocks of samples, the blocks of a file are streamed with rapid.reader.iter_chunks and the first,
+last and peak sample of an event spanning two blocks are carried over to the next one. The row rate is
+measured from the time of the rows (100 Hz for .IMP files, whose counter runs at FS = 2000). The event
+table holds per event:
+
+    t_start   time of the first sample above the threshold (s)
+    t_peak    time of the peak (s)
+    row       row of the peak in the converted file
+    peak_g    acceleration magnitude at the peak (g)
+    duration  time from the first sample above the threshold to the first sample below it after the event (s)
+    pressure  pressure at the peak (mbar / hPa), NaN for sensors without pressure channel (.HIG)
+"""
+
+import os
+
+import numpy as np
+
+from rapid.batch import find_files, map_files
+from rapid.export import write_table
+from rapid.formats import get_format
+from rapid.reader import CHUNK_SIZE, iter_chunks
+
+
+G = 9.81  # m/s2 per g
+THRESHOLD_G = 10.0  # acceleration magnitude (g) marking a strike or collision
+REFRACTORY_S = 0.05  # crossings less than this after the end of an event are merged into it (s)
+RATE_ROWS = 1000  # rows of which the row rate is measured
+
+# acceleration channels, their factor to convert into g and pressure channels of each sensor type
+SIGNALS = {
+    'IMP': (('ax', 'ay', 'az'), 1.0, ('p',)),
+    'HIG': (('ax', 'ay', 'az'), 1.0, ()),
+    'EDF': (('accx', 'accy', 'accz'), 1 / G, ('pres',)),
+    'BDS100': (('accx', 'accy', 'accz'), 1 / G, ('P1', 'P2', 'P3')),
+    'BDS250': (('accx', 'accy', 'accz'), 1 / G, ('P1', 'P2', 'P3')),
+}
+EVENT_COLUMNS = ['t_start', 't_peak', 'row', 'peak_g', 'duration', 'pressure']
+EVENT_FORMATS = {'t_start': '%.4f', 't_peak': '%.4f', 'row': '%d', 'peak_g': '%.3f', 'duration': '%.4f',
+                 'pressure': '%.2f', 'file': '%s'}  # printf-style format of each column of the exported table
+
+
+def time_key(sensor):
+    """Key of the time in s in the decoded data of a sensor type."""
+    return 'ts' if sensor in ('IMP', 'HIG') else 'time'
+
+
+def acceleration_magnitude(data, sensor) -> np.ndarray:
+    """Acceleration magnitude in g, including gravity.
+
+    Parameters
+    ----------
+    data : dict or pd.DataFrame
+        Decoded channels, e.g. RAPIDIMP, rapid.read(...) or the data of a BDS / EDF class
+    sensor : str
+        Sensor type, key in SIGNALS
+    """
+    keys, to_g, _ = SIGNALS[sensor]
+    ax, ay, az = (np.asarray(data[key], dtype=np.float64) for key in keys)
+    return np.sqrt(ax**2 + ay**2 + az**2) * to_g
+
+
+def pressure(data, sensor) -> np.ndarray:
+    """Pressure of the decoded channels, the mean of P1, P2 and P3 for BDS, None without pressure channel."""
+    _, _, keys = SIGNALS[sensor]
+    if 'pres' in data:
+        return np.asarray(data['pres'], dtype=np.float64)  # already averaged by the BDS classes
+    if not keys:
+        return None
+    return np.mean([np.asarray(data[key], dtype=np.float64) for key in keys], axis=0)
+
+
+def find_events(time, magnitude, threshold=THRESHOLD_G, refractory=REFRACTORY_S):
+    """Finds the events of an acceleration magnitude signal.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Time of the samples in s
+    magnitude : np.ndarray
+        Acceleration magnitude in g
+    threshold : float, optional
+        Samples with magnitude >= threshold belong to an event, by default THRESHOLD_G
+    refractory : float, optional
+        A crossing at most this time in s after the last sample above the threshold continues the event,
+        by default REFRACTORY_S
+
+    Returns
+    -------
+    tuple of np.ndarray
+        (first, last, peak): first and last sample above the threshold and sample of the peak of each event
+    """
+    time, magnitude = np.asarray(time), np.asarray(magnitude)
+    above = magnitude >= threshold
+    edges = np.diff(above.astype(np.int8), prepend=0, append=0)
+    first = np.flatnonzero(edges == 1)
+    last = np.flatnonzero(edges == -1) - 1
+    if len(first) > 1:
+        # a run starts a new event only if it follows the previous one by more than the refractory window
+        new = np.concatenate(([True], time[first[1:]] - time[last[:-1]] > refractory))
+        first, last = first[new], last[np.concatenate((new[1:], [True]))]
+    if len(first) == 0:
+        return first, last, first
+
+    # the peak is the first maximum of the samples above the threshold of each event
+    candidates = np.flatnonzero(above)
+    event = np.searchsorted(first, candidates, side='right') - 1
+    peak_g = np.maximum.reduceat(magnitude[candidates], np.searchsorted(candidates, first))
+    is_peak = magnitude[candidates] == peak_g[event]
+    _, index = np.unique(event[is_peak], return_index=True)
+    peak = candidates[is_peak][index]
+    return first, last, peak
+
+
+def _table(time, magnitude, pres, rows, first, last, peak, fs) -> dict:
+    # up to the first sample below the threshold, one sample period at the end of the recording
+    end = np.minimum(last + 1, len(time) - 1)
+    duration = np.where(last + 1 < len(time), time[end] - time[first], time[last] - time[first] + 1 / fs)
+    return {
+        't_start': time[first],
+        't_peak': time[peak],
+        'row': rows[peak],
+        'peak_g': magnitude[peak],
+        'duration': duration,
+        'pressure': pres[peak] if pres is not None else np.full(len(peak), np.nan),
+    }
+
+
+def empty_table() -> dict:
+    """Event table without events."""
+    return {key: np.empty(0, dtype=np.int64 if key == 'row' else np.float64) for key in EVENT_COLUMNS}
+
+
+def concat_tables(tables) -> dict:
+    """Concatenates event tables."""
+    tables = list(tables)
+    if not tables:
+        return empty_table()
+    return {key: np.concatenate([table[key] for table in tables]) for key in tables[0]}
+
+
+def measured_rate(time) -> float:
+    """Rows per second from the median time step, rounded to mHz (100 for the .IMP rows, whose counter runs
+    at FS = 2000)."""
+    step = np.median(np.diff(time))
+    return float(np.round(1 / step, 3))
+
+
+class EventDetector:
+    def __init__(self, fs=None, threshold=THRESHOLD_G, refractory=REFRACTORY_S) -> None:
+        """Streaming event detection over consecutive blocks of one recording.
+
+        Only the first, last and peak sample of an event which may still continue in the next block are kept,
+        so an event spanning many blocks costs no more than one block.
+
+        Parameters
+        ----------
+        fs : float, optional
+            Rows per second, by default measured from the time of the first RATE_ROWS rows
+        threshold : float, optional
+            Acceleration magnitude in g which starts an event, by default THRESHOLD_G
+        refractory : float, optional
+            Crossings within this time in s after the end of an event are merged into it, by default REFRACTORY_S
+        """
+        self.fs = fs
+        self.threshold = threshold
+        self.refractory = refractory
+        self._open = None  # the event which may continue: rows, times and values of its first, last and peak sample
+        self._row = 0  # row of the next block in the file
+        self._rate_times = []  # times of the first rows, while fs is measured
+
+    def update(self, time, magnitude, pres=None) -> dict:
+        """Adds the next block of samples.
+
+        Parameters
+        ----------
+        time : np.ndarray
+            Time of the samples in s
+        magnitude : np.ndarray
+            Acceleration magnitude in g
+        pres : np.ndarray, optional
+            Pressure of the samples
+
+        Returns
+        -------
+        dict
+            Event table of the events which are complete
+        """
+        time = np.asarray(time, dtype=np.float64)
+        magnitude = np.asarray(magnitude, dtype=np.float64)
+        pres = None if pres is None else np.asarray(pres, dtype=np.float64)
+        n, row0 = len(time), self._row
+        self._row += n
+        self._measure(time)
+        if n == 0:
+            return empty_table()
+        first, last, peak = find_events(time, magnitude, self.threshold, self.refractory)
+
+        closed = []
+        event = self._open
+        if event is not None:
+            if event['t_after'] is None:
+                event['t_after'] = time[0]
+            # the first run of the block continues the open event
+            if len(first) and ((first[0] == 0 and event['last'] == row0 - 1)
+                               or time[first[0]] - event['t_last'] <= self.refractory):
+                self._extend(event, time, magnitude, pres, row0, last[0], peak[0])
+                first, last, peak = first[1:], last[1:], peak[1:]
+            if len(first) or not self._may_continue(event, time[-1], row0 + n):
+                closed.append(event)
+                self._open = None
+
+        if len(first) and self._open is None:
+            i = len(first) - 1
+            candidate = {'first': row0 + first[i], 't_first': time[first[i]], 'last': -1, 't_last': None,
+                         't_after': None, 'peak': -1, 'peak_g': -np.inf}
+            self._extend(candidate, time, magnitude, pres, row0, last[i], peak[i])
+            if self._may_continue(candidate, time[-1], row0 + n):
+                self._open = candidate
+                first, last, peak = first[:-1], last[:-1], peak[:-1]
+
+        # the other events of the block end before its last sample, their duration needs no sample period
+        table = _table(time, magnitude, pres, np.arange(row0, row0 + n), first, last, peak, self._rate())
+        return concat_tables([self._closed_table(closed), table])
+
+    def finish(self) -> dict:
+        """Event table of the event still open at the end of the recording. self.fs is then the row rate,
+        also for recordings shorter than RATE_ROWS rows (NaN for less than two rows)."""
+        if self.fs is None:
+            self.fs, self._rate_times = self._rate(), []
+        if self._open is None:
+            return empty_table()
+        events, self._open = [self._open], None
+        return self._closed_table(events)
+
+    def _measure(self, time) -> None:
+        if self.fs is not None or len(time) == 0:
+            return
+        self._rate_times.append(time[:RATE_ROWS - sum(map(len, self._rate_times))])
+        times = np.concatenate(self._rate_times)
+        if len(times) >= RATE_ROWS:
+            self.fs, self._rate_times = measured_rate(times), []
+
+    def _rate(self) -> float:
+        if self.fs is None:
+            times = np.concatenate(self._rate_times) if self._rate_times else np.zeros(0)
+            return measured_rate(times) if len(times) > 1 else np.nan
+        return self.fs
+
+    def _may_continue(self, event, t_end, rows_end) -> bool:
+        # a run reaching the end of the block, or a crossing in the next block within the refractory window
+        return event['last'] == rows_end - 1 or t_end - event['t_last'] < self.refractory
+
+    @staticmethod
+    def _extend(event, time, magnitude, pres, row0, last, peak) -> None:
+        """Moves the end of event to row last of the block and takes its peak if higher."""
+        event['last'], event['t_last'] = row0 + last, time[last]
+        event['t_after'] = time[last + 1] if last + 1 < len(time) else None
+        if magnitude[peak] > event['peak_g']:
+            event.update(peak=row0 + peak, t_peak=time[peak], peak_g=magnitude[peak],
+                         pressure=np.nan if pres is None else pres[peak])
+
+    def _closed_table(self, events) -> dict:
+        if not events:
+            return empty_table()
+        # up to the first sample below the threshold, one sample period at the end of the recording
+        duration = [event['t_after'] - event['t_first'] if event['t_after'] is not None
+                    else event['t_last'] - event['t_first'] + 1 / self._rate() for event in events]
+        table = {'t_start': [e['t_first'] for e in events], 't_peak': [e['t_peak'] for e in events],
+                 'row': [e['peak'] for e in events], 'peak_g': [e['peak_g'] for e in events],
+                 'duration': duration, 'pressure': [e['pressure'] for e in events]}
+        return {key: np.asarray(values, dtype=np.int64 if key == 'row' else np.float64)
+                for key, values in table.items()}
+
+
+def detect_events(data, sensor, threshold=THRESHOLD_G, refractory=REFRACTORY_S) -> dict:
+    """Detects the events of decoded data in memory.
+
+    Parameters
+    ----------
+    data : dict or pd.DataFrame
+        Decoded channels with the time key of the sensor (ts for RAPID V3, time otherwise),
+        e.g. RAPIDIMP, rapid.read(...) or the data of a BDS / EDF class
+    sensor : str
+        Sensor type, key in SIGNALS
+    threshold : float, optional
+        Acceleration magnitude in g which starts an event, by default THRESHOLD_G
+    refractory : float, optional
+        Crossings within this time in s after the end of an event are merged into it, by default REFRACTORY_S
+
+    Returns
+    -------
+    dict
+        Event table, EVENT_COLUMNS -> array
+    """
+    detector = EventDetector(None, threshold, refractory)
+    events = detector.update(data[time_key(sensor)], acceleration_magnitude(data, sensor), pressure(data, sensor))
+    return concat_tables([events, detector.finish()])
+
+
+def iter_events(path, sensor=None, chunk_size=CHUNK_SIZE, threshold=THRESHOLD_G, refractory=REFRACTORY_S):
+    """Detects the events of a sensor file block by block with bounded memory.
+
+    Parameters
+    ----------
+    path : str or Path
+        Location of the binary file
+    sensor : str, optional
+        Sensor type, inferred from the extension for .IMP and .HIG
+    chunk_size : int, optional
+        Rows decoded at a time, by default rapid.reader.CHUNK_SIZE
+    threshold, refractory : float, optional
+        See detect_events
+
+    Yields
+    ------
+    dict
+        Event table of the events completed in each block
+    """
+    packet_format = get_format(path, sensor)
+    sensor = packet_format.name
+    acc, _, pres = SIGNALS[sensor]
+    detector = EventDetector(None, threshold, refractory)
+    for data in iter_chunks(path, chunk_size, list(acc + pres), sensor):
+        yield detector.update(data[time_key(sensor)], acceleration_magnitude(data, sensor), pressure(data, sensor))
+    yield detector.finish()
+
+
+def file_events(path, sensor=None, chunk_size=CHUNK_SIZE, threshold=THRESHOLD_G, refractory=REFRACTORY_S) -> dict:
+    """Event table of a sensor file, see iter_events."""
+    return concat_tables(iter_events(path, sensor, chunk_size, threshold, refractory))
+
+
+def fleet_events(files, sensor=None, workers=None, threshold=THRESHOLD_G, refractory=REFRACTORY_S,
+                 verbose=True):
+    """Detects the events of many sensor files with a pool of worker processes.
+
+    Parameters
+    ----------
+    files : str, Path or list
+        Directory searched for .IMP and .HIG files (.txt files if sensor is given), or a list of files
+    sensor : str, optional
+        Sensor type of all files, required for the .txt files of BDS and EDF sensors
+    workers : int, optional
+        Number of worker processes, by default os.cpu_count(). With 1 the files are processed in this process.
+    threshold, refractory : float, optional
+        See detect_events
+    verbose : bool, optional
+        Print the failures, by default True
+
+    Returns
+    -------
+    tuple
+        (events, failed): event table of all files with an additional 'file' column, sorted by file and time,
+        and dict source file -> error message
+    """
+    if isinstance(files, (str, os.PathLike)):
+        files = find_files(files, ('.IMP', '.HIG') if sensor is None else ('.txt',))
+    files = [os.fspath(f) for f in files]
+    tables, failed = map_files(file_events, files, workers, verbose, sensor=sensor, threshold=threshold,
+                               refractory=refractory)
+    events = concat_tables(tables.values())
+    events['file'] = np.repeat(np.array(list(tables), dtype=object), [len(table['row']) for table in tables.values()])
+    return events, failed
+
+
+def write_events(exportFile, events):
+    """Exports an event table in ASCII .csv text format, see rapid.export.write_table."""
+    write_table(exportFile, events, EVENT_FORMATS)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Export of the RAPID V3 .IMP and .HIG files to ASCII .csv text format or to columnar binary files.
+
+The files are decoded and written block by block (see rapid.reader.iter_chunks), so the memory use is
+constant regardless of the recording length. The .csv files have the same columns as the ones written
+by the original import_IMP_RAPID_v3.py and import_HIG_RAPID_v3.py scripts, each column printed with the
+precision it is rounded to (IMU_PREC, P_PREC, T_BAT_PREC, HIG_PREC, the time with TIME_PREC) without the
+trailing zeros, so the text is the same as the one of the scripts.
+
+Besides .csv, the data can be exported as compressed Parquet (requires pyarrow) or as a NumPy .npz
+archive. Both keep the column names of the .csv header and store the sensor type, the sampling rate FS
+and the unit, gain and precision of every column, so a single channel loads in milliseconds:
+
+    np.load('B38-0928141315-IMP.npz')['Pressure (mbar)']
+"""
+
+import json
+import os
+import numpy as np
+
+from rapid.formats import FORMATS
+from rapid.manifest import format_settings
+from rapid.profiling import profile_file, stage
+from rapid.reader import CHUNK_SIZE, iter_chunks
+from rapid.v3 import HIG_CHANNELS, HIG_PREC, IMP_CHANNELS, IMU_PREC, TIME_PREC
+
+
+# header of the exported .csv files and the matching keys of the RAPIDIMP / RAPIDHIG dicts
+IMP_HEADER = ['Time (s)', 'Accel_X (g)', 'Accel_Y (g)', 'Accel_Z (g)', 'Accel_Mag (g)',
+              'Gyro_X (deg/s)', 'Gyro_Y (deg/s)', 'Gyro_Z (deg/s)', 'Mag_X (mT)',
+              'Mag_Y (mT)', 'Mag_Z (mT)', 'Pressure (mbar)', 'P_Temp (C)', 'Battery (V)']
+IMP_KEYS = ['ts', 'ax', 'ay', 'az', 'aMag', 'gx', 'gy', 'gz', 'mx', 'my', 'mz', 'p', 't', 'b']
+HIG_HEADER = ['Time (s)', 'HIGAccel_X (g)', 'HIGAccel_Y (g)', 'HIGAccel_Z (g)', 'HIGAccel_Mag (g)']
+HIG_KEYS = ['ts', 'ax', 'ay', 'az', 'aMag']
+
+# decimal place precision of each exported column: IMU_PREC, P_PREC, T_BAT_PREC, HIG_PREC and TIME_PREC
+IMP_PRECISION = [TIME_PREC if key == 'ts' else IMU_PREC if key == 'aMag' else IMP_CHANNELS[key][2]
+                 for key in IMP_KEYS]
+HIG_PRECISION = [TIME_PREC if key == 'ts' else HIG_PREC if key == 'aMag' else HIG_CHANNELS[key][2]
+                 for key in HIG_KEYS]
+
+OUTPUTS = {'csv': '.csv', 'parquet': '.parquet', 'npz': '.npz'}
+PARQUET_COMPRESSION = 'zstd'
+
+
+def imp_columns(RAPIDIMP):
+    """Exported columns of a RAPIDIMP dict, keyed by IMP_HEADER, adding the acceleration magnitude."""
+    # calculate the acceleration magnitude
+    aMag = np.round(np.sqrt(RAPIDIMP['ax']**2 + RAPIDIMP['ay']**2 + RAPIDIMP['az']**2),IMU_PREC)
+    return {name: aMag if key == 'aMag' else RAPIDIMP[key] for name, key in zip(IMP_HEADER, IMP_KEYS)}
+
+
+def hig_columns(RAPIDHIG):
+    """Exported columns of a RAPIDHIG dict, keyed by HIG_HEADER, adding the acceleration magnitude."""
+    # calculate the acceleration magnitude
+    aMag = np.round(np.sqrt(RAPIDHIG['ax']**2 + RAPIDHIG['ay']**2 + RAPIDHIG['az']**2),HIG_PREC)
+    return {name: aMag if key == 'aMag' else RAPIDHIG[key] for name, key in zip(HIG_HEADER, HIG_KEYS)}
+
+
+def imp_table(RAPIDIMP):
+    """Arranges the RAPIDIMP dict in the column order of IMP_HEADER, adding the acceleration magnitude."""
+    return np.column_stack(tuple(imp_columns(RAPIDIMP).values()))
+
+
+def hig_table(RAPIDHIG):
+    """Arranges the RAPIDHIG dict in the column order of HIG_HEADER, adding the acceleration magnitude."""
+    return np.column_stack(tuple(hig_columns(RAPIDHIG).values()))
+
+
+def trim_zeros(text, precision):
+    """Removes the trailing zeros of the decimals of comma separated, fixed precision values, keeping one decimal
+    (431.700 -> 431.7, -1.000 -> -1.0). Each pass of str.replace removes one zero from every value, at most
+    max(precision) passes; the '.' of every value stops it before the integer digits."""
+    for _ in range(max(precision)):
+        text = text.replace('0,', ',').replace('0\r', '\r')
+    return text.replace('.,', '.0,').replace('.\r', '.0\r')
+
+
+def write_csv(exportFile, cHeader, blocks, precision):
+    """Exports data matrices block by block in ASCII .csv text format with fixed precision per column.
+
+    Each block is formatted with a single printf-style operation instead of one repr() call per value.
+    The values are printed with the decimal places they were rounded to and the trailing zeros removed, so
+    the text equals the shortest repr of the rounded values written by csv.writer (gyro 431.7, not 431.700)
+    without its floating point noise.
+
+    Parameters
+    ----------
+    exportFile : str or Path
+        Location of the .csv file
+    cHeader : list of str
+        Column names
+    blocks : iterable of np.ndarray
+        Data matrices with one column per entry of cHeader, written one after the other
+    precision : list of int
+        Decimal places of each column, at least 1
+    """
+    if min(precision) < 1:
+        raise ValueError(f'Every column needs at least one decimal place, got precision {precision}')
+    rowFormat = ','.join(f'%.{prec}f' for prec in precision) + '\r\n'
+    with open(exportFile, 'w', newline='') as csvfile:
+        csvfile.write(','.join(cHeader) + '\r\n')
+        for dataExportCSV in blocks:
+            values = np.asarray(dataExportCSV, dtype=np.float64).ravel().tolist()
+            csvfile.write(trim_zeros((rowFormat * len(dataExportCSV)) % tuple(values), precision))
+
+
+def write_table(exportFile, table, formats):
+    """Exports a table of columns (e.g. events or metrics of many files) in ASCII .csv text format.
+
+    Parameters
+    ----------
+    exportFile : str or Path
+        Location of the .csv file
+    table : dict
+        Column name -> array or list, written in the order of the dict
+    formats : dict
+        Column name -> printf-style format, '%s' for the columns not listed
+    """
+    columns = list(table)
+    rowFormat = ','.join(formats.get(column, '%s') for column in columns) + '\r\n'
+    with open(exportFile, 'w', newline='') as csvfile:
+        csvfile.write(','.join(columns) + '\r\n')
+        for values in zip(*(np.asarray(table[column]).tolist() for column in columns)):
+            csvfile.write(rowFormat % values)
+
+
+def write_parquet(exportFile, blocks, metadata, compression=PARQUET_COMPRESSION):
+    """Exports column blocks as one row group each to a compressed Parquet file.
+
+    Parameters
+    ----------
+    exportFile : str or Path
+        Location of the .parquet file
+    blocks : iterable of dict
+        Column name -> array, all blocks with the same columns
+    metadata : dict
+        Stored as JSON under the 'rapid' key of the schema metadata
+    compression : str, optional
+        Parquet compression codec, by default PARQUET_COMPRESSION
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Parquet export requires pyarrow, install it with: pip install pyarrow') from None
+
+    writer = None
+    try:
+        for block in blocks:
+            table = pa.table({name: np.ascontiguousarray(values) for name, values in block.items()})
+            if writer is None:
+                schema = table.schema.with_metadata({'rapid': json.dumps(metadata)})
+                writer = pq.ParquetWriter(exportFile, schema, compression=compression)
+            writer.write_table(table.replace_schema_metadata(schema.metadata))
+        if writer is None:
+            empty = pa.table({name: pa.array([], pa.float64()) for name in metadata['columns']})
+            pq.write_table(empty.replace_schema_metadata({'rapid': json.dumps(metadata)}), exportFile,
+                           compression=compression)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_npz(exportFile, blocks, metadata):
+    """Exports column blocks to an uncompressed NumPy .npz archive.
+
+    The archive holds one array per column plus the JSON string 'metadata'. Unlike .csv and Parquet
+    the blocks are concatenated in memory before writing.
+
+    Parameters
+    ----------
+    exportFile : str or Path
+        Location of the .npz file
+    blocks : iterable of dict
+        Column name -> array, all blocks with the same columns
+    metadata : dict
+        Stored as JSON string under the key 'metadata'
+    """
+    parts = {name: [] for name in metadata['columns']}
+    for block in blocks:
+        for name, values in block.items():
+            parts.setdefault(name, []).append(np.asarray(values))
+    arrays = {name: np.concatenate(values) if values else np.zeros(0) for name, values in parts.items()}
+    with open(exportFile, 'wb') as f:
+        np.savez(f, metadata=np.array(json.dumps(metadata)), **arrays)
+
+
+def write_columns(exportFile, blocks, metadata, output):
+    """Exports column blocks with the binary writer selected by output ('parquet' or 'npz')."""
+    if output == 'parquet':
+        write_parquet(exportFile, blocks, metadata)
+    elif output == 'npz':
+        write_npz(exportFile, blocks, metadata)
+    else:
+        raise ValueError(f'Unknown output format {output!r}, expected one of {list(OUTPUTS)}')
+
+
+def conversion_settings(sensor, output='csv'):
+    """Settings of convert_imp / convert_hig recorded in the manifest of the export folder."""
+    precision = {'IMP': IMP_PRECISION, 'HIG': HIG_PRECISION}[sensor]
+    return format_settings(sensor, output, precision=precision)
+
+
+def _blocks(fileFull, sensor, columns, chunk_size, profiler):
+    for chunk in iter_chunks(fileFull, chunk_size, sensor=sensor, profiler=profiler):
+        with stage(profiler, 'columns'):
+            block = columns(chunk)
+        yield block
+
+
+def _stacked(blocks, profiler):
+    for block in blocks:
+        with stage(profiler, 'column_stack'):
+            table = np.column_stack(tuple(block.values()))
+        yield table
+
+
+def _convert(fileFull, filePathCSV, sensor, columns, cHeader, keys, precision, chunk_size, output, profiler):
+    if output not in OUTPUTS:
+        raise ValueError(f'Unknown output format {output!r}, expected one of {list(OUTPUTS)}')
+    os.makedirs(filePathCSV, exist_ok=True)
+    fileNameNoExt = os.path.splitext(os.path.basename(fileFull))[0]
+    exportFile = os.path.join(filePathCSV, f'{fileNameNoExt}-{sensor}{OUTPUTS[output]}')
+
+    with profile_file(profiler, fileFull, sensor):
+        chunks = _blocks(fileFull, sensor, columns, chunk_size, profiler)
+        # the blocks are decoded while the export is written, their stages are not part of 'write'
+        with stage(profiler, 'write') as written:
+            if output == 'csv':
+                write_csv(exportFile, cHeader, _stacked(chunks, profiler), precision)
+            else:
+                metadata = FORMATS[sensor].metadata(dict(zip(cHeader, keys)), fileFull)
+                for name, prec in zip(cHeader, precision):
+                    metadata['columns'][name]['precision'] = prec
+                write_columns(exportFile, chunks, metadata, output)
+            written.nbytes = os.stat(exportFile).st_size
+    return exportFile
+
+
+def convert_imp(fileFull, filePathCSV, chunk_size=CHUNK_SIZE, output='csv', profiler=None):
+    """Converts a .IMP file into <filePathCSV>/<name>-IMP.csv (or .parquet / .npz).
+
+    Parameters
+    ----------
+    fileFull : str or Path
+        Location of the .IMP file
+    filePathCSV : str or Path
+        Export folder, created if missing
+    chunk_size : int, optional
+        Packets decoded and written at a time, by default rapid.reader.CHUNK_SIZE
+    output : str, optional
+        Export format, one of OUTPUTS: 'csv' (default), 'parquet' or 'npz'
+    profiler : rapid.profiling.Profiler, optional
+        Records the time, bytes and peak allocation of the stages read, unpack, scale, columns,
+        column_stack (.csv only) and write of the file
+
+    Returns
+    -------
+    str
+        Location of the exported file
+    """
+    return _convert(fileFull, filePathCSV, 'IMP', imp_columns, IMP_HEADER, IMP_KEYS, IMP_PRECISION, chunk_size,
+                    output, profiler)
+
+
+def convert_hig(fileFull, filePathCSV, chunk_size=CHUNK_SIZE, output='csv', profiler=None):
+    """Converts a .HIG file into <filePathCSV>/<name>-HIG.csv (or .parquet / .npz), see convert_imp."""
+    return _convert(fileFull, filePathCSV, 'HIG', hig_columns, HIG_HEADER, HIG_KEYS, HIG_PRECISION, chunk_size,
+                    output, profiler)
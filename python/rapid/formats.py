@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Packet layouts of all supported sensor files.
+
+Every format has a fixed packet size, so packet k of a file always starts at byte k * packet_size:
+29 bytes for RAPID V3 .IMP, 11 bytes for RAPID V3 .HIG and RAPID V1 / EDF, struct.calcsize(fmt) for BDS.
+FORMATS holds one PacketFormat per sensor type, used by the BDS/EDF classes, the V3 decoders and the reader.
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+from rapid import v3
+from rapid.packets import fmt_to_dtype
+
+
+BDS100_FMT = "HI22f4B"  # format string to set byteorder
+BDS100_COLUMNS = [
+    "sample rate",
+    "time",
+    "P1",
+    "T1",
+    "P2",
+    "T2",
+    "P3",
+    "T3",
+    "eul head",
+    "eul roll",
+    "eul pitch",
+    "quat w",
+    "quatx",
+    "quaty",
+    "quatz",
+    "magx",
+    "magy",
+    "magz",
+    "accx",
+    "accy",
+    "accz",
+    "gyrox",
+    "gyroy",
+    "gyroz",
+    "calmag",
+    "calacc",
+    "calgyro",
+    "calimu",
+]
+
+BDS250_FMT = "HI12f4B"
+BDS250_COLUMNS = [
+    "samplerate",
+    "time",
+    "P1",
+    "T1",
+    "P2",
+    "T2",
+    "P3",
+    "T3",
+    "accx",
+    "accy",
+    "accz",
+    "gyrox",
+    "gyroy",
+    "gyroz",
+    "calmag",
+    "calacc",
+    "calgyro",
+    "calimu",
+]
+
+EDF_FMT = ">5hx"
+EDF_COLUMNS = ["index", "accx", "accy", "accz", "pres"]
+EDF_FS = 2048  # Sampling rate in Hz
+EDF_P_GAIN = 10  # raw pressure / gain = hPa
+EDF_ACC_GAIN = 10  # raw acceleration / gain = ms-2
+
+# physical units of the converted channels of all formats, stored with the binary exports
+UNITS = {
+    "td": "counts", "ts": "s", "time": "s",
+    "ax": "g", "ay": "g", "az": "g", "aMag": "g",
+    "gx": "deg/s", "gy": "deg/s", "gz": "deg/s",
+    "mx": "mT", "my": "mT", "mz": "mT",
+    "p": "mbar", "t": "C", "b": "V",
+    "pres": "hPa", "P1": "hPa", "P2": "hPa", "P3": "hPa",
+    "T1": "C", "T2": "C", "T3": "C",
+    "accx": "m/s2", "accy": "m/s2", "accz": "m/s2", "accmag": "m/s2",
+    "absaccx": "m/s2", "absaccy": "m/s2", "absaccz": "m/s2",
+    "gyrox": "deg/s", "gyroy": "deg/s", "gyroz": "deg/s",
+    "eul head": "deg", "eul roll": "deg", "eul pitch": "deg",
+}
+
+
+class PacketFormat:
+    def __init__(
+        self,
+        name: str,
+        dtype: np.dtype,
+        fs: float,
+        channels: dict,
+        time_field: str = None,
+        time_rate: float = None,
+        relative_time: bool = False,
+        divide: bool = False,
+        skip_last: bool = False,
+        source_rows=None,
+        suffix: str = None,
+    ) -> None:
+        """Describes the fixed-size packets of one sensor file format.
+
+        Parameters
+        ----------
+        name : str
+            Sensor type, key in FORMATS
+        dtype : np.dtype
+            Structured dtype of one packet
+        fs : float
+            Sampling rate in Hz
+        channels : dict
+            Output key -> (packet field, gain, decimal place precision or None)
+        time_field : str, optional
+            Field holding the monotonic time counter, None if the time follows from the packet index
+        time_rate : float, optional
+            Counts of the time counter per second
+        relative_time : bool, optional
+            Time starts at zero at the first packet, as in the BDS classes
+        divide : bool, optional
+            Raw values are divided by the gain (EDF) instead of multiplied with it (RAPID V3)
+        skip_last : bool, optional
+            The last complete packet is not exported, as in the RAPID V3 scripts
+        source_rows : callable, optional
+            Maps exported rows to the packets holding their sensor values, see rapid.v3.imp_source_rows
+        suffix : str, optional
+            File extension which identifies the format unambiguously, e.g. ".IMP"
+        """
+        self.name = name
+        self.dtype = dtype
+        self.packet_size = dtype.itemsize
+        self.fs = fs
+        self.channels = channels
+        self.time_field = time_field
+        self.time_rate = time_rate
+        self.relative_time = relative_time
+        self.divide = divide
+        self.skip_last = skip_last
+        self.source_rows = source_rows
+        self.suffix = suffix
+        self.time_keys = ["td", "ts"] if name in ("IMP", "HIG") else ["time"]
+
+    def __repr__(self) -> str:
+        return f"PacketFormat({self.name!r}, packet_size={self.packet_size})"
+
+    def n_rows(self, n_packets: int) -> int:
+        """Number of exported rows of a file with n_packets complete packets."""
+        return max(n_packets - int(self.skip_last), 0)
+
+    def metadata(self, columns: dict, source=None) -> dict:
+        """Describes exported columns for the binary output formats.
+
+        Parameters
+        ----------
+        columns : dict
+            Exported column name -> channel key of the format (or derived key, e.g. aMag)
+        source : str or Path, optional
+            Converted sensor file
+
+        Returns
+        -------
+        dict
+            Sensor type, sampling rate FS and unit, gain and precision of each column
+        """
+        meta = {"sensor": self.name, "fs": self.fs, "columns": {}}
+        if source is not None:
+            meta["source"] = Path(source).name
+        for column, key in columns.items():
+            info = {"key": key, "unit": UNITS.get(key, "")}
+            if key in self.channels and self.channels[key][1] is not None:
+                _, gain, prec = self.channels[key]
+                info["gain"] = 1 / gain if self.divide else gain
+                info["precision"] = prec
+            meta["columns"][column] = info
+        return meta
+
+    def convert(self, key: str, raw: np.ndarray) -> np.ndarray:
+        """Converts raw packet values of one channel into physical units."""
+        field, gain, prec = self.channels[key]
+        if gain is None:
+            # struct unpacks integers to int and floats to double, cast the same way
+            casts = {"f": np.float64, "b": np.bool_}
+            return raw.astype(casts.get(raw.dtype.kind, np.int64))
+        data = raw.astype(np.int64) / gain if self.divide else raw * gain
+        if prec is not None:
+            data = np.round(data, prec)
+        return data
+
+    def time(self, counter: np.ndarray, first=None) -> dict:
+        """Converts raw time counter values (or packet indices) into the time keys of the format.
+
+        Parameters
+        ----------
+        counter : np.ndarray
+            Raw values of time_field, or packet indices if the format has no time counter
+        first : int, optional
+            Raw counter of the first packet of the file, needed for relative_time
+        """
+        if self.time_field is None:
+            return {"time": counter / self.fs}
+        if self.name in ("IMP", "HIG"):
+            td = counter.astype(np.float64)
+            return {"td": td, "ts": td / self.fs}
+        counter = counter.astype(np.int64)
+        if self.relative_time:
+            counter = counter - first
+        return {"time": counter / self.time_rate}
+
+
+def _raw_channels(columns, skip):
+    return {name: (name, None, None) for name in columns if name not in skip}
+
+
+FORMATS = {
+    "IMP": PacketFormat(
+        "IMP",
+        v3.IMP_DTYPE,
+        v3.FS,
+        v3.IMP_CHANNELS,
+        time_field="time",
+        time_rate=v3.FS,
+        skip_last=True,
+        source_rows=v3.imp_source_rows,
+        suffix=".IMP",
+    ),
+    "HIG": PacketFormat(
+        "HIG",
+        v3.HIG_DTYPE,
+        v3.FS,
+        v3.HIG_CHANNELS,
+        time_field="time",
+        time_rate=v3.FS,
+        skip_last=True,
+        source_rows=v3.hig_source_rows,
+        suffix=".HIG",
+    ),
+    "EDF": PacketFormat(
+        "EDF",
+        fmt_to_dtype(EDF_FMT, EDF_COLUMNS),
+        EDF_FS,
+        {
+            "pres": ("pres", EDF_P_GAIN, None),
+            "accx": ("accx", EDF_ACC_GAIN, None),
+            "accy": ("accy", EDF_ACC_GAIN, None),
+            "accz": ("accz", EDF_ACC_GAIN, None),
+        },
+        divide=True,
+    ),
+    "BDS100": PacketFormat(
+        "BDS100",
+        fmt_to_dtype(BDS100_FMT, BDS100_COLUMNS),
+        100,
+        _raw_channels(BDS100_COLUMNS, ("time",)),
+        time_field="time",
+        time_rate=1000,
+        relative_time=True,
+    ),
+    "BDS250": PacketFormat(
+        "BDS250",
+        fmt_to_dtype(BDS250_FMT, BDS250_COLUMNS),
+        250,
+        _raw_channels(BDS250_COLUMNS, ("time",)),
+        time_field="time",
+        time_rate=1000,
+        relative_time=True,
+    ),
+}
+
+
+def get_format(path, sensor: str = None) -> PacketFormat:
+    """Looks up the packet format of a file by sensor name or by file extension.
+
+    Parameters
+    ----------
+    path : str or Path
+        Location of the binary file
+    sensor : str, optional
+        One of the keys in FORMATS, required for the .txt files of BDS and EDF sensors
+
+    Returns
+    -------
+    PacketFormat
+    """
+    if sensor is not None:
+        try:
+            return FORMATS[sensor]
+        except KeyError:
+            raise ValueError(f"Unknown sensor {sensor!r}, expected one of {list(FORMATS)}") from None
+    suffix = Path(path).suffix.upper()
+    for packet_format in FORMATS.values():
+        if packet_format.suffix == suffix:
+            return packet_format
+    raise ValueError(f"Cannot infer the sensor type of {path}, pass sensor= as one of {list(FORMATS)}")
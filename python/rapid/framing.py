@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Validation of the packet framing of sensor files and resynchronization after corrupted regions.
+
+The decoders expect packet k at byte k * packet_size. A single byte dropped or inserted on the SD card shifts
+every later packet, which then decodes to plausible looking garbage. Every packet of the supported formats
+carries a fixed marker: the 0x0B end of line byte of the RAPID V3 .IMP / .HIG and the EDF packets, and the
+bytes 0x0D 0x0A (the 'sample rate' field 2573) at the start of the BDS packets. validate_framing checks the
+marker of all packets with one strided array comparison and the time counter (EDF: the packet index) with
+np.diff, so a healthy file is validated at memory bandwidth. Where a marker is missing, the next offset from
+which MIN_RUN consecutive packets have their marker and a continuous counter is searched, and the skipped
+bytes are reported. Dropped packets (counter jumps) and counter resets are reported as well.
+
+detect_sensor tells the .txt files of the EDF, BDS100 and BDS250 loggers apart by the framing of their first
+packets. FramedPackets holds the valid packets as zero-copy views of the memory mapped file, so read(..., resync=True)
+and iter_chunks(..., resync=True) decode a damaged file as if the corrupted bytes were cut out.
+"""
+
+import os
+
+import numpy as np
+
+from rapid.formats import FORMATS, get_format
+
+
+MIN_RUN = 4  # consecutive valid packets required to accept a resynchronization offset
+SCAN_BLOCK = 2**20  # packets checked at a time while searching the first invalid packet
+MAX_GAP_S = 3600  # larger counter jumps (or any step back) are reported as counter resets
+PROBE_PACKETS = 256  # packets checked per candidate format by detect_sensor
+DETECT_SCORE = 0.5  # share of valid packets required to accept a format
+TXT_SENSORS = ('EDF', 'BDS100', 'BDS250')  # formats of the .txt files, told apart by their framing
+
+# byte offset and value of the marker in each packet
+SYNC = {
+    'IMP': (28, b'\x0b'),
+    'HIG': (10, b'\x0b'),
+    'EDF': (10, b'\x0b'),  # the pad byte of >5hx
+    'BDS100': (0, b'\r\n'),  # sample rate field 2573
+    'BDS250': (0, b'\r\n'),
+}
+# counter field, nominal step, largest step still counted as regular (BDS: jitter of the ms clock),
+# counts per second and wrap-around of the counter
+COUNTERS = {
+    'IMP': ('time', 20, 20, 2000, None),
+    'HIG': ('time', 1, 1, 2000, None),
+    'EDF': ('index', 1, 1, 2048, 2048),
+    'BDS100': ('time', 10, 15, 1000, None),  # both BDS sample files step by 10 to 11 ms
+    'BDS250': ('time', 10, 15, 1000, None),
+}
+
+
+def _sync_ok(frames, sensor):
+    """Marker check of frames, a (n, packet_size) uint8 array."""
+    offset, marker = SYNC[sensor]
+    ok = frames[:, offset] == marker[0]
+    for i in range(1, len(marker)):
+        ok &= frames[:, offset + i] == marker[i]
+    return ok
+
+
+def _first_invalid(buf, pos, n, size, sensor):
+    """Index of the first packet without marker among the n packets from byte pos, n if all are valid."""
+    for k0 in range(0, n, SCAN_BLOCK):
+        k1 = min(k0 + SCAN_BLOCK, n)
+        frames = buf[pos + k0 * size:pos + k1 * size].reshape(k1 - k0, size)
+        bad = np.flatnonzero(~_sync_ok(frames, sensor))
+        if len(bad):
+            return k0 + int(bad[0])
+    return n
+
+
+def _steps(counter, sensor):
+    """Counter steps between consecutive packets, unwrapped for the EDF packet index."""
+    step = np.diff(counter.astype(np.int64))
+    wrap = COUNTERS[sensor][4]
+    return step % wrap if wrap else step
+
+
+def _classify(step, sensor):
+    """0 for regular steps, 1 for dropped packets, 2 for resets and implausible jumps."""
+    _, nominal, regular, rate, wrap = COUNTERS[sensor]
+    if wrap:
+        return np.where(step == nominal, 0, 1)
+    return np.where((step > 0) & (step <= regular), 0, np.where((step > 0) & (step <= MAX_GAP_S * rate), 1, 2))
+
+
+def _missing(step, sensor):
+    nominal = COUNTERS[sensor][1]
+    return max(int(round(step / nominal)) - 1, 0)
+
+
+def _resync(buf, start, size, dtype, sensor, min_run=MIN_RUN):
+    """First byte offset >= start from which min_run packets have their marker and regular counter steps."""
+    offset, marker = SYNC[sensor]
+    field = COUNTERS[sensor][0]
+    window = 64 * size
+    while start + min_run * size <= len(buf):
+        end = min(start + window + min_run * size, len(buf))
+        block = np.asarray(buf[start:end])
+        n_cand = len(block) - min_run * size + 1
+        if n_cand > 0:
+            # candidates with the marker in each of the min_run packets
+            ok = np.ones(n_cand, dtype=bool)
+            for k in range(min_run):
+                for i, value in enumerate(marker):
+                    at = k * size + offset + i
+                    ok &= block[at:at + n_cand] == value
+            for q in np.flatnonzero(ok):
+                packets = np.frombuffer(block[q:q + min_run * size].tobytes(), dtype=dtype)
+                if np.all(_classify(_steps(packets[field], sensor), sensor) == 0):
+                    return start + int(q)
+        if end == len(buf):
+            break
+        start += window
+        window *= 2
+    return None
+
+
+def _implausible(buf, pos, j, new, dtype, sensor):
+    """True if the counter steps back or jumps from packet j - 1 of the segment at pos to the packet at new."""
+    field = COUNTERS[sensor][0]
+    before = np.ndarray((1,), dtype=dtype, buffer=buf, offset=pos + (j - 1) * dtype.itemsize)[field]
+    after = np.ndarray((1,), dtype=dtype, buffer=buf, offset=new)[field]
+    return _classify(_steps(np.concatenate([before, after]), sensor), sensor)[0] == 2
+
+
+def validate_framing(path, sensor=None, min_run=MIN_RUN) -> dict:
+    """Checks the packet markers and the time counter of a sensor file.
+
+    Parameters
+    ----------
+    path : str or Path
+        Location of the binary file
+    sensor : str, optional
+        Sensor type, inferred from the extension for .IMP and .HIG
+    min_run : int, optional
+        Consecutive valid packets required after a corrupted region, by default MIN_RUN
+
+    Returns
+    -------
+    dict
+        sensor, file_bytes, valid_packets, segments (list of (byte offset, number of packets) of the aligned
+        runs of valid packets) and issues, a list of dicts with the keys:
+
+        - kind: 'misaligned' (bytes without valid packets, skipped), 'gap' (counter jump of dropped packets),
+          'reset' (counter steps back or jumps by more than MAX_GAP_S) or 'partial' (incomplete last packet)
+        - offset: byte offset of the issue in the file
+        - bytes: number of bytes skipped (0 for gap and reset)
+        - packet: index of the first packet after the issue among the valid packets
+        - counter_before, counter_after: raw counter around the issue (None if not available)
+        - missing: estimated number of dropped packets (None for resets)
+    """
+    packet_format = get_format(path, sensor)
+    sensor = packet_format.name
+    dtype = packet_format.dtype
+    size = dtype.itemsize
+    field = COUNTERS[sensor][0]
+    buf = np.memmap(path, dtype=np.uint8, mode='r') if os.stat(path).st_size else np.zeros(0, dtype=np.uint8)
+
+    segments, issues = [], []
+    pos = 0
+    total = 0
+    previous = None  # last counter of the previous segment
+    while pos + size <= len(buf):
+        n = (len(buf) - pos) // size
+        j = _first_invalid(buf, pos, n, size, sensor)
+        new = None
+        if j < n:
+            if j > 0 and SYNC[sensor][0] == 0:
+                # with the marker at the start (BDS) the corrupted bytes may lie in the packet before the first
+                # invalid one: it is dropped if the packets are shifted or its counter does not fit
+                new = _resync(buf, pos + (j - 1) * size + 1, size, dtype, sensor, min_run)
+                if new is None or (new - pos - j * size) % size or _implausible(buf, pos, j, new, dtype, sensor):
+                    j -= 1
+            else:
+                new = _resync(buf, pos + j * size + 1, size, dtype, sensor, min_run)
+        if j > 0:
+            segment = np.ndarray((j,), dtype=dtype, buffer=buf, offset=pos)
+            counter = segment[field]
+            if previous is not None and issues and issues[-1]['kind'] == 'misaligned':
+                issue = issues[-1]
+                issue['counter_after'] = int(counter[0])
+                step = _steps(np.array([previous, counter[0]]), sensor)
+                issue['missing'] = _missing(step[0], sensor) if _classify(step, sensor)[0] < 2 else None
+            steps = _steps(counter, sensor)
+            kinds = _classify(steps, sensor)
+            for k in np.flatnonzero(kinds):
+                issues.append({
+                    'kind': 'gap' if kinds[k] == 1 else 'reset',
+                    'offset': pos + int(k + 1) * size,
+                    'bytes': 0,
+                    'packet': total + int(k) + 1,
+                    'counter_before': int(counter[k]),
+                    'counter_after': int(counter[k + 1]),
+                    'missing': _missing(steps[k], sensor) if kinds[k] == 1 else None,
+                })
+            segments.append((pos, j))
+            total += j
+            previous = int(counter[-1])
+        if j == n:
+            pos += n * size
+            break
+        bad = pos + j * size
+        end = len(buf) if new is None else new
+        issues.append({'kind': 'misaligned', 'offset': bad, 'bytes': end - bad, 'packet': total,
+                       'counter_before': previous, 'counter_after': None, 'missing': None})
+        pos = end
+    if pos < len(buf):
+        issues.append({'kind': 'partial', 'offset': pos, 'bytes': len(buf) - pos, 'packet': total,
+                       'counter_before': previous, 'counter_after': None, 'missing': None})
+    return {'sensor': sensor, 'file_bytes': len(buf), 'valid_packets': total, 'segments': segments,
+            'issues': issues}
+
+
+class FramedPackets:
+    def __init__(self, path, segments, dtype) -> None:
+        """Valid packets of a file as zero-copy views of its aligned segments, see frame_packets.
+
+        Parameters
+        ----------
+        path : str or Path
+            Location of the binary file
+        segments : list of tuple
+            (byte offset, number of packets) of the aligned runs of valid packets
+        dtype : np.dtype
+            Structured dtype of one packet
+        """
+        self.dtype = dtype
+        buf = np.memmap(path, dtype=np.uint8, mode='r') if segments else None
+        self.views = [np.ndarray((n,), dtype=dtype, buffer=buf, offset=offset) for offset, n in segments]
+        self.starts = np.cumsum([0] + [n for _, n in segments])
+
+    def __len__(self) -> int:
+        return int(self.starts[-1])
+
+    def __getitem__(self, index):
+        """Packets of a slice, a view if they are in one segment and a copy otherwise."""
+        if not isinstance(index, slice):
+            index = int(index)
+            index = slice(index, index + 1) if index >= 0 else slice(len(self) + index, len(self) + index + 1)
+            return self[index][0]
+        i0, i1, step = index.indices(len(self))
+        i1 = max(i0, i1)
+        first = max(int(np.searchsorted(self.starts, i0, side='right')) - 1, 0)
+        parts = []
+        for k in range(first, len(self.views)):
+            s0 = self.starts[k]
+            if s0 >= i1:
+                break
+            parts.append(self.views[k][max(i0 - s0, 0):i1 - s0])
+        if len(parts) == 1:
+            return parts[0][::step]
+        return (np.concatenate(parts) if parts else np.zeros(0, dtype=self.dtype))[::step]
+
+    def to_array(self):
+        """All valid packets, the memory mapped view itself for a file without corrupted regions."""
+        return self[:]
+
+
+def detect_sensor(path, candidates=TXT_SENSORS, probe=PROBE_PACKETS):
+    """Sensor type of a file from the framing of its first packets.
+
+    The .IMP and .HIG files are identified by their extension. The .txt files of the EDF and BDS loggers
+    are tried with each candidate format: the share of the first probe packets which have their marker and a
+    regular counter step from the previous packet decides.
+
+    Parameters
+    ----------
+    path : str or Path
+        Location of the binary file
+    candidates : tuple of str, optional
+        Sensor types tried for files without a known extension, by default TXT_SENSORS
+    probe : int, optional
+        Packets checked per candidate, by default PROBE_PACKETS
+
+    Returns
+    -------
+    str or None
+        Sensor type, None if no candidate has at least DETECT_SCORE of valid packets
+    """
+    try:
+        return get_format(path).name
+    except ValueError:
+        pass
+    size = max(FORMATS[sensor].packet_size for sensor in candidates) * probe
+    with open(path, 'rb') as f:
+        head = np.frombuffer(f.read(size), dtype=np.uint8)
+    scores = {}
+    for sensor in candidates:
+        dtype = FORMATS[sensor].dtype
+        n = min(len(head) // dtype.itemsize, probe)
+        if n < 2:
+            continue
+        frames = head[:n * dtype.itemsize].reshape(n, dtype.itemsize)
+        ok = _sync_ok(frames, sensor)
+        regular = _classify(_steps(frames.view(dtype)[:, 0][COUNTERS[sensor][0]], sensor), sensor) == 0
+        scores[sensor] = np.mean(ok[1:] & ok[:-1] & regular)
+    best = max(scores, key=scores.get, default=None)
+    return best if best is not None and scores[best] >= DETECT_SCORE else None
+
+
+def frame_packets(path, sensor=None, min_run=MIN_RUN):
+    """Valid packets of a sensor file with the corrupted regions cut out.
+
+    Parameters
+    ----------
+    path : str or Path
+        Location of the binary file
+    sensor : str, optional
+        Sensor type, inferred from the extension for .IMP and .HIG
+    min_run : int, optional
+        See validate_framing
+
+    Returns
+    -------
+    tuple
+        (FramedPackets, report of validate_framing)
+    """
+    report = validate_framing(path, sensor, min_run)
+    return FramedPackets(path, report['segments'], get_format(path, sensor).dtype), report
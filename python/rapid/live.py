@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Live decoding of sensor files which are still being written, and of byte streams.
+
+The readers of rapid.reader need the final file size. IncrementalDecoder is fed the bytes in pieces of any
+size, decodes the complete packets and holds a partial packet (and the neighbouring packet needed for the
+row alignment of the RAPID V3 files) over to the next piece. The blocks it returns concatenate to the same
+values as rapid.reader.read of the finished file. The asyncio generators tail_file and iter_stream feed it
+from a growing file or an asyncio.StreamReader (serial link, socket, pipe of a writer process):
+
+    async for block in tail_file('B38-0928141315.IMP', idle_timeout=10):
+        print(block['ts'][-1], block['p'][-1])
+
+A block is yielded as soon as new packets arrive, so the latency is bounded by poll_interval for files.
+A large backlog (e.g. when starting on a file which is already long) is split into blocks of chunk_size rows.
+"""
+
+import asyncio
+import os
+import time
+
+import numpy as np
+
+from rapid.formats import get_format
+from rapid.reader import CHUNK_SIZE, _check_channels, decode_rows
+
+
+POLL_INTERVAL = 0.1  # seconds between the size checks of a growing file
+
+
+class IncrementalDecoder:
+    def __init__(self, sensor, channels=None) -> None:
+        """Decodes a sensor file from pieces of bytes, see feed.
+
+        Parameters
+        ----------
+        sensor : str
+            Sensor type (IMP, HIG, EDF, BDS100 or BDS250)
+        channels : list of str, optional
+            Channels to decode, by default all channels of the format
+        """
+        self.format = get_format(None, sensor)
+        self.channels = _check_channels(self.format, channels)
+        self.n_packets = 0  # complete packets received
+        self.n_rows = 0  # rows decoded
+        self.first = None  # raw time counter of the first packet, for relative time
+        self._pending = b""  # bytes of an incomplete packet
+        self._packets = np.zeros(0, dtype=self.format.dtype)  # packets still needed, from packet _offset on
+        self._offset = 0
+
+    def __repr__(self) -> str:
+        return f"IncrementalDecoder({self.format.name!r}, packets={self.n_packets}, rows={self.n_rows})"
+
+    @property
+    def pending_bytes(self) -> int:
+        """Bytes of the incomplete packet held over to the next piece."""
+        return len(self._pending)
+
+    def feed(self, data) -> dict:
+        """Adds bytes and decodes the rows they complete.
+
+        Parameters
+        ----------
+        data : bytes
+            Next bytes of the file or stream, any length
+
+        Returns
+        -------
+        dict or None
+            Time keys of the format and one array per channel for the new rows, None if the bytes complete no row
+        """
+        size = self.format.packet_size
+        data = self._pending + bytes(data)
+        n = len(data) // size
+        self._pending = data[n * size:]
+        if n == 0:
+            return None
+        new = np.frombuffer(data, dtype=self.format.dtype, count=n)
+        if self.first is None and self.format.time_field is not None:
+            self.first = new[self.format.time_field][0]
+        packets = np.concatenate([self._packets, new]) if len(self._packets) else new
+        self.n_packets += n
+
+        n_rows = self.format.n_rows(self.n_packets)
+        if n_rows <= self.n_rows:
+            self._packets = packets
+            return None
+        rows = np.arange(self.n_rows, n_rows)
+        block = decode_rows(packets, self.format, rows, self.channels, offset=self._offset, first=self.first)
+        self.n_rows = n_rows
+
+        # keep the packets of the next row onwards
+        src = n_rows if self.format.source_rows is None else int(self.format.source_rows(np.array([n_rows]))[0])
+        lo = max(min(n_rows, src), self._offset)
+        self._packets = packets[lo - self._offset:].copy()
+        self._offset = lo
+        return block
+
+
+async def iter_stream(reader, sensor, chunk_size=CHUNK_SIZE, channels=None):
+    """Decodes the packets of an asyncio.StreamReader until the end of the stream.
+
+    Parameters
+    ----------
+    reader : asyncio.StreamReader
+        Byte stream of a sensor file, e.g. the stdout of a writer process or a socket
+    sensor : str
+        Sensor type (IMP, HIG, EDF, BDS100 or BDS250)
+    chunk_size : int, optional
+        Largest number of rows per block, by default rapid.reader.CHUNK_SIZE
+    channels : list of str, optional
+        Channels to decode, by default all channels of the format
+
+    Yields
+    ------
+    dict
+        Time keys of the format and one array per channel for the rows received
+    """
+    decoder = IncrementalDecoder(sensor, channels)
+    read_size = chunk_size * decoder.format.packet_size
+    while True:
+        data = await reader.read(read_size)
+        if not data:
+            break
+        block = decoder.feed(data)
+        if block is not None:
+            yield block
+
+
+async def tail_file(path, sensor=None, chunk_size=CHUNK_SIZE, channels=None, poll_interval=POLL_INTERVAL,
+                    idle_timeout=None, stop=None):
+    """Decodes a sensor file while it is being written.
+
+    The file is read from the start. When no new bytes arrive, the size is checked every poll_interval seconds.
+    The file may not exist yet when the generator starts.
+
+    Parameters
+    ----------
+    path : str or Path
+        Location of the binary file
+    sensor : str, optional
+        Sensor type, inferred from the extension for .IMP and .HIG
+    chunk_size : int, optional
+        Largest number of rows per block, by default rapid.reader.CHUNK_SIZE
+    channels : list of str, optional
+        Channels to decode, by default all channels of the format
+    poll_interval : float, optional
+        Seconds between the checks for new bytes, by default POLL_INTERVAL
+    idle_timeout : float, optional
+        Stop after this many seconds without new bytes, by default the file is followed until stop is set
+        or the generator is closed
+    stop : asyncio.Event, optional
+        Stops the generator once set and the bytes written so far are decoded
+
+    Yields
+    ------
+    dict
+        Time keys of the format and one array per channel for the rows written since the last block
+    """
+    decoder = IncrementalDecoder(get_format(path, sensor).name, channels)
+    read_size = chunk_size * decoder.format.packet_size
+    last = time.monotonic()
+    f = None
+    try:
+        while True:
+            if f is None and os.path.exists(path):
+                f = open(path, "rb", buffering=0)
+            data = await asyncio.to_thread(f.read, read_size - decoder.pending_bytes) if f is not None else b""
+            if data:
+                last = time.monotonic()
+                block = decoder.feed(data)
+                if block is not None:
+                    yield block
+                continue
+            if stop is not None and stop.is_set():
+                break
+            if idle_timeout is not None and time.monotonic() - last > idle_timeout:
+                break
+            await asyncio.sleep(poll_interval)
+    finally:
+        if f is not None:
+            f.close()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Incremental conversion cache.
+
+A manifest.json in each export folder ('CSV/' of the V3 scripts, 'csv/<class>/' of the BDS and EDF classes)
+records for every converted file its size, modification time and SHA-256 content hash, together with the
+converter version and the settings (gains, precisions, output format) used. A later run converts only
+the files which are new, changed, converted with other settings, or whose export is missing.
+"""
+
+import hashlib
+import json
+import os
+
+from rapid.formats import FORMATS
+
+
+CONVERTER_VERSION = '1'  # increase when a change of the converters alters the exported values
+MANIFEST_NAME = 'manifest.json'
+
+
+def file_hash(fileFull, block_size=2**20):
+    """SHA-256 hex digest of a file, read in blocks of block_size bytes."""
+    digest = hashlib.sha256()
+    with open(fileFull, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def format_settings(sensor, output, **extra):
+    """Settings which determine the exported values of a sensor file.
+
+    Parameters
+    ----------
+    sensor : str
+        Key in rapid.formats.FORMATS
+    output : str
+        Export format (csv, parquet or npz)
+    **extra : optional
+        Further options of the converter, must be JSON serializable
+
+    Returns
+    -------
+    dict
+        Converter version, sampling rate, gains and precisions of the format, output format and extra options
+    """
+    packet_format = FORMATS[sensor]
+    settings = {
+        'converter_version': CONVERTER_VERSION,
+        'sensor': sensor,
+        'fs': packet_format.fs,
+        'channels': {key: list(spec) for key, spec in packet_format.channels.items()},
+        'output': output,
+    }
+    settings.update(extra)
+    # round trip through JSON so the settings compare equal to the ones loaded from the manifest
+    return json.loads(json.dumps(settings))
+
+
+class Manifest:
+    def __init__(self, folder) -> None:
+        """Conversion records of one export folder.
+
+        Parameters
+        ----------
+        folder : str or Path
+            Export folder holding manifest.json and the converted files
+        """
+        self.folder = os.fspath(folder)
+        self.path = os.path.join(self.folder, MANIFEST_NAME)
+        self.entries = {}
+        self.dirty = False  # entries changed since the manifest was loaded or saved
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}  # unreadable manifest, everything is converted again
+
+    @staticmethod
+    def _key(fileFull):
+        return os.path.abspath(fileFull)
+
+    def is_current(self, fileFull, settings) -> bool:
+        """True if fileFull was converted with the same settings, is unchanged and its export still exists.
+
+        A file with a new modification time but the same content hash is current, its new time is recorded and
+        the manifest is marked dirty.
+        """
+        entry = self.entries.get(self._key(fileFull))
+        if entry is None or entry['settings'] != settings:
+            return False
+        if not os.path.exists(os.path.join(self.folder, entry['export'])):
+            return False
+        stat = os.stat(fileFull)
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime_ns == entry['mtime_ns']:
+            return True
+        # touched or copied, only the content decides
+        if file_hash(fileFull) != entry['sha256']:
+            return False
+        # remember the new time, so the next run does not hash the file again; call save() to keep it
+        entry['mtime_ns'] = stat.st_mtime_ns
+        self.dirty = True
+        return True
+
+    def record(self, fileFull, exportFile, settings, sha256=None) -> None:
+        """Records a successful conversion, call save() to write the manifest.
+
+        Parameters
+        ----------
+        fileFull : str or Path
+            Converted sensor file
+        exportFile : str or Path
+            Exported file in the manifest folder
+        settings : dict
+            Conversion settings, see format_settings
+        sha256 : str, optional
+            Content hash of fileFull if already known, e.g. computed by a worker process
+        """
+        stat = os.stat(fileFull)
+        self.entries[self._key(fileFull)] = {
+            'export': os.path.relpath(exportFile, self.folder),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': sha256 if sha256 is not None else file_hash(fileFull),
+            'settings': settings,
+        }
+        self.dirty = True
+
+    def save(self) -> None:
+        """Writes manifest.json, replacing the previous one atomically."""
+        os.makedirs(self.folder, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.dirty = False
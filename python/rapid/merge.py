@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Synchronized merge of the .IMP and .HIG files of a RAPID V3 sensor.
+
+Both files of a deployment are written by the same sensor and carry the same time counter (TimeRaw, counts
+of FS): the .HIG rows every count (2000 Hz), the .IMP rows every 20 counts (100 Hz). Instead of exporting
+two .csv files and joining them again in pandas, the rows of both files are aligned on their counters with
+a sorted merge (np.searchsorted) and written as one table with the IMU, pressure and high-g channels side
+by side: each .HIG row carries the values of the .IMP row of its period. A constant offset of the counters
+is estimated from the first counters of both files. Rows of packets dropped by one of the two loggers are
+kept and the channels of the other file are left empty (NaN). The files are merged block by block, so the
+memory use does not depend on the length of the recording.
+"""
+
+import os
+from collections import defaultdict
+
+import numpy as np
+
+from rapid.batch import find_files, parse_name
+from rapid.export import (
+    HIG_HEADER,
+    HIG_KEYS,
+    HIG_PRECISION,
+    IMP_HEADER,
+    IMP_KEYS,
+    IMP_PRECISION,
+    OUTPUTS,
+    hig_columns,
+    imp_columns,
+    write_columns,
+    write_csv,
+)
+from rapid.formats import FORMATS
+from rapid.packets import map_packets
+from rapid.reader import CHUNK_SIZE, decode_rows
+from rapid.v3 import FS
+
+
+# IMP columns first, then the high-g columns; the time of both files is the shared 'Time (s)' column
+MERGED_HEADER = IMP_HEADER + HIG_HEADER[1:]
+MERGED_PRECISION = IMP_PRECISION + HIG_PRECISION[1:]
+JOINS = ('outer', 'inner', 'imp', 'hig')
+IMP_PERIOD = 20  # counts of FS between the 100 Hz .IMP rows
+PERIOD_ROWS = 10000  # .IMP rows of which the median step is taken
+
+
+def pair_files(filePath, recursive=True):
+    """Pairs the .IMP and .HIG files of the same sensor and deployment.
+
+    Files in the same folder are paired by equal names (B38-0928141315.IMP and B38-0928141315.HIG).
+    The remaining files are paired by the start time stamp of their names if it is unambiguous.
+
+    Parameters
+    ----------
+    filePath : str or Path
+        Directory to search
+    recursive : bool, optional
+        Also search all subfolders, by default True
+
+    Returns
+    -------
+    tuple
+        (pairs, unpaired): sorted list of (.IMP file, .HIG file) tuples and list of the files without partner
+    """
+    files = defaultdict(dict)
+    for fileFull in find_files(filePath, ('.IMP', '.HIG'), recursive):
+        stem, suffix = os.path.splitext(fileFull)
+        files[stem][suffix] = fileFull
+
+    pairs, single = [], defaultdict(lambda: defaultdict(list))
+    for stem, found in files.items():
+        if len(found) == 2:
+            pairs.append((found['.IMP'], found['.HIG']))
+            continue
+        (suffix, fileFull), = found.items()
+        name = parse_name(fileFull)
+        timestamp = None if name is None else name[1]
+        single[(os.path.dirname(fileFull), timestamp)][suffix].append(fileFull)
+
+    unpaired = []
+    for (folder, timestamp), found in single.items():
+        imp, hig = found.get('.IMP', []), found.get('.HIG', [])
+        if timestamp is not None and len(imp) == 1 and len(hig) == 1:
+            pairs.append((imp[0], hig[0]))
+        else:
+            unpaired.extend(imp + hig)
+    return sorted(pairs), sorted(unpaired)
+
+
+def estimate_offset(counter_imp, counter_hig) -> int:
+    """Counts to add to the .HIG counter so that both files start at the same counter.
+
+    Both loggers of a sensor start with the same packet, a difference of the first counters is an offset of
+    the counters (e.g. a restarted counter) and not a later start.
+    """
+    if len(counter_imp) == 0 or len(counter_hig) == 0:
+        return 0
+    return int(counter_imp[0]) - int(counter_hig[0])
+
+
+def imp_period(counter_imp) -> int:
+    """Counts between the .IMP rows (20 at FS for the 100 Hz rows), the median step of the counter."""
+    if len(counter_imp) < 2:
+        return IMP_PERIOD
+    return max(int(np.median(np.diff(np.asarray(counter_imp[:PERIOD_ROWS], dtype=np.int64)))), 1)
+
+
+def align(td_imp, td_hig, offset=0, how='outer', period=None):
+    """Aligns the time counters of a .IMP and a .HIG file by a sorted merge.
+
+    The .IMP rows are 100 Hz (every 20 counts of FS), the .HIG rows 2000 Hz (every count). Each .HIG row is
+    attached to the .IMP row with the last counter at or before its own, if it is less than one .IMP period
+    earlier, so the IMU and pressure values of a .IMP row are repeated for the .HIG rows of its period.
+    Duplicate counters are kept: every .HIG row stays a row of its own, and the .HIG rows of a duplicated
+    .IMP counter are attached to the last .IMP row with that counter.
+
+    Parameters
+    ----------
+    td_imp, td_hig : np.ndarray
+        Raw time counters (TimeRaw) of the rows of both files, increasing
+    offset : int, optional
+        Counts added to the .HIG counter before the alignment, corrects a constant counter offset, by default 0
+    how : str, optional
+        Rows of the merged table: 'outer' (default) all .HIG rows plus the .IMP rows without .HIG rows in their
+        period (dropped .HIG packets), 'inner' only the .HIG rows with a .IMP row, 'hig' the .HIG rows and
+        'imp' the .IMP rows with the first .HIG row of their period
+    period : int, optional
+        Counts between the .IMP rows, by default measured with imp_period
+
+    Returns
+    -------
+    tuple of np.ndarray
+        (td, rows_imp, rows_hig): merged counter and the row of each file for it, -1 where the row is missing
+    """
+    if how not in JOINS:
+        raise ValueError(f'Unknown join {how!r}, expected one of {list(JOINS)}')
+    td_imp = np.asarray(td_imp, dtype=np.int64)
+    td_hig = np.asarray(td_hig, dtype=np.int64) + offset
+    period = imp_period(td_imp) if period is None else period
+
+    # .IMP row of each .HIG row
+    k = np.searchsorted(td_imp, td_hig, side='right') - 1
+    attached = (k >= 0) & (td_hig - td_imp[np.maximum(k, 0)] < period) if len(td_imp) else k >= 0
+    imp_of_hig = np.where(attached, k, -1)
+    rows = np.arange(len(td_hig))
+    if how == 'hig':
+        return td_hig, imp_of_hig, rows
+    if how == 'inner':
+        return td_hig[attached], imp_of_hig[attached], rows[attached]
+
+    # first .HIG row of each .IMP row
+    j = np.minimum(np.searchsorted(td_hig, td_imp, side='left'), max(len(td_hig) - 1, 0))
+    has_hig = (imp_of_hig[j] == np.arange(len(td_imp))) if len(td_hig) else np.zeros(len(td_imp), dtype=bool)
+    if how == 'imp':
+        return td_imp, np.arange(len(td_imp)), np.where(has_hig, j, -1)
+
+    # outer: the .IMP rows without .HIG rows go before the .HIG rows of the same counter
+    lonely = np.flatnonzero(~has_hig)
+    td = np.concatenate((td_imp[lonely], td_hig))
+    order = np.argsort(td, kind='stable')
+    rows_imp = np.concatenate((lonely, imp_of_hig))[order]
+    rows_hig = np.concatenate((np.full(len(lonely), -1), rows))[order]
+    return td[order], rows_imp, rows_hig
+
+
+def _take(values, rows):
+    out = np.full(len(rows), np.nan)
+    found = rows >= 0
+    out[found] = values[rows[found]]
+    return out
+
+
+def _counters(impFile, higFile):
+    imp_format, hig_format = FORMATS['IMP'], FORMATS['HIG']
+    imp = map_packets(impFile, imp_format.dtype)
+    hig = map_packets(higFile, hig_format.dtype)
+    n_imp, n_hig = imp_format.n_rows(len(imp)), hig_format.n_rows(len(hig))
+    return imp, hig, imp['time'][:n_imp], hig['time'][:n_hig]
+
+
+def file_offset(impFile, higFile) -> int:
+    """Counter offset of a pair of files, see estimate_offset."""
+    _, _, counter_imp, counter_hig = _counters(impFile, higFile)
+    return estimate_offset(counter_imp, counter_hig)
+
+
+def iter_merged(impFile, higFile, chunk_size=CHUNK_SIZE, offset=None, how='outer'):
+    """Merges a .IMP and a .HIG file block by block.
+
+    The blocks follow the rows of the .IMP file, the .HIG rows of each block are found by binary search of
+    the mapped .HIG counter, so the time counters of both files must be monotonic.
+
+    Parameters
+    ----------
+    impFile, higFile : str or Path
+        Location of the .IMP and the .HIG file
+    chunk_size : int, optional
+        .IMP rows merged at a time, by default rapid.reader.CHUNK_SIZE
+    offset : int, optional
+        Counts added to the .HIG counter, by default estimated from the first counters (see estimate_offset)
+    how : str, optional
+        Rows of the merged table, see align
+
+    Yields
+    ------
+    dict
+        Column of MERGED_HEADER -> array for the rows of the block, NaN where the row is missing in a file
+    """
+    if how not in JOINS:
+        raise ValueError(f'Unknown join {how!r}, expected one of {list(JOINS)}')
+    imp_format, hig_format = FORMATS['IMP'], FORMATS['HIG']
+    imp, hig, counter_imp, counter_hig = _counters(impFile, higFile)
+    n_imp, n_hig = len(counter_imp), len(counter_hig)
+    for fileFull, counter in ((impFile, counter_imp), (higFile, counter_hig)):
+        if np.any(counter[1:] < counter[:-1]):
+            raise ValueError(f'Time counter is not monotonic, the file cannot be merged in blocks: {fileFull}')
+    offset = estimate_offset(counter_imp, counter_hig) if offset is None else offset
+    period = imp_period(counter_imp)
+
+    starts = list(range(0, n_imp, chunk_size)) or [0]
+    for k, i0 in enumerate(starts):
+        i1 = min(i0 + chunk_size, n_imp)
+        # .HIG rows from the counter of this block up to the counter of the next one, all rows for the ends
+        j0 = 0 if k == 0 else int(np.searchsorted(counter_hig, int(counter_imp[i0]) - offset))
+        j1 = n_hig if k == len(starts) - 1 else int(np.searchsorted(counter_hig, int(counter_imp[i1]) - offset))
+        RAPIDIMP = decode_rows(imp, imp_format, np.arange(i0, i1), list(imp_format.channels))
+        RAPIDHIG = decode_rows(hig, hig_format, np.arange(j0, j1), list(hig_format.channels))
+
+        td, rows_imp, rows_hig = align(RAPIDIMP['td'], RAPIDHIG['td'], offset, how, period)
+        block = {MERGED_HEADER[0]: td / FS}
+        for name, values in list(imp_columns(RAPIDIMP).items())[1:]:
+            block[name] = _take(values, rows_imp)
+        for name, values in list(hig_columns(RAPIDHIG).items())[1:]:
+            block[name] = _take(values, rows_hig)
+        yield block
+
+
+def merge_files(impFile, higFile, offset=None, how='outer'):
+    """Merges a .IMP and a .HIG file into one table.
+
+    Parameters
+    ----------
+    impFile, higFile : str or Path
+        Location of the .IMP and the .HIG file
+    offset : int, optional
+        Counts added to the .HIG counter, by default estimated, see iter_merged
+    how : str, optional
+        Rows of the merged table, see align
+
+    Returns
+    -------
+    dict
+        Column of MERGED_HEADER -> array, NaN where the row is missing in one of the files
+    """
+    blocks = list(iter_merged(impFile, higFile, offset=offset, how=how))
+    return {name: np.concatenate([block[name] for block in blocks]) for name in MERGED_HEADER}
+
+
+def convert_merged(impFile, higFile, filePathCSV, chunk_size=CHUNK_SIZE, output='csv', offset=None, how='outer'):
+    """Merges a .IMP and a .HIG file into <filePathCSV>/<name>-MRG.csv (or .parquet / .npz).
+
+    Parameters
+    ----------
+    impFile, higFile : str or Path
+        Location of the .IMP and the .HIG file, the export is named after the .IMP file
+    filePathCSV : str or Path
+        Export folder, created if missing
+    chunk_size : int, optional
+        .IMP rows merged and written at a time, by default rapid.reader.CHUNK_SIZE
+    output : str, optional
+        Export format, one of rapid.export.OUTPUTS: 'csv' (default), 'parquet' or 'npz'
+    offset : int, optional
+        Counts added to the .HIG counter, by default estimated, see iter_merged
+    how : str, optional
+        Rows of the merged table, see align
+
+    Returns
+    -------
+    str
+        Location of the exported file
+    """
+    if output not in OUTPUTS:
+        raise ValueError(f'Unknown output format {output!r}, expected one of {list(OUTPUTS)}')
+    os.makedirs(filePathCSV, exist_ok=True)
+    fileNameNoExt = os.path.splitext(os.path.basename(impFile))[0]
+    exportFile = os.path.join(filePathCSV, f'{fileNameNoExt}-MRG{OUTPUTS[output]}')
+    offset = file_offset(impFile, higFile) if offset is None else offset
+    blocks = iter_merged(impFile, higFile, chunk_size, offset, how)
+
+    if output == 'csv':
+        write_csv(exportFile, MERGED_HEADER, (np.column_stack(tuple(block.values())) for block in blocks),
+                  MERGED_PRECISION)
+    else:
+        metadata = FORMATS['IMP'].metadata(dict(zip(IMP_HEADER, IMP_KEYS)), impFile)
+        hig_metadata = FORMATS['HIG'].metadata(dict(zip(HIG_HEADER[1:], HIG_KEYS[1:])), higFile)
+        metadata.update(sensor='IMP+HIG', source=[metadata['source'], hig_metadata['source']],
+                        offset=offset, join=how)
+        metadata['columns'].update(hig_metadata['columns'])
+        for name, prec in zip(MERGED_HEADER, MERGED_PRECISION):
+            metadata['columns'][name]['precision'] = prec
+        write_columns(exportFile, blocks, metadata, output)
+    return exportFile
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Pressure metrics of the barotrauma risk of a passage.
+
+For each passage window (by default the whole recording) the metrics table holds:
+
+    t_start, t_end  limits of the window (s)
+    acclimation     mean pressure of the ACCLIMATION_S before the window, or of the first ACCLIMATION_S of the
+                    window if the recording starts later (mbar / hPa)
+    nadir           lowest pressure in the window (mbar / hPa)
+    t_nadir         time of the nadir (s)
+    lrp             log ratio of pressure change, ln(acclimation / nadir)
+    max_rate        largest absolute rate of pressure change over RATE_WINDOW_S in the window (mbar/s / hPa/s)
+
+The means are taken from prefix sums and the extrema of all windows with one reduceat call each, so the
+metrics of any number of windows cost a few passes over the pressure signal. Whole files are streamed in
+blocks with bounded memory, passage windows are read directly with rapid.reader.read.
+"""
+
+import os
+
+import numpy as np
+
+from rapid.batch import find_files, map_files
+from rapid.events import SIGNALS, pressure, time_key
+from rapid.export import write_table
+from rapid.formats import get_format
+from rapid.reader import CHUNK_SIZE, iter_chunks, read
+
+
+ACCLIMATION_S = 10.0  # pressure averaged before a passage to the acclimation pressure (s)
+RATE_WINDOW_S = 0.1  # time span of the pressure difference of the rate of pressure change (s)
+METRIC_COLUMNS = ['t_start', 't_end', 'acclimation', 'nadir', 't_nadir', 'lrp', 'max_rate']
+METRIC_FORMATS = {'t_start': '%.4f', 't_end': '%.4f', 'acclimation': '%.2f', 'nadir': '%.2f', 't_nadir': '%.4f',
+                  'lrp': '%.4f', 'max_rate': '%.2f', 'file': '%s'}  # printf-style format of each exported column
+
+
+def rate_of_change(time, pres, rate_window=RATE_WINDOW_S) -> np.ndarray:
+    """Rate of pressure change of each sample over the preceding rate_window seconds.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Monotonic time of the samples in s
+    pres : np.ndarray
+        Pressure of the samples
+    rate_window : float, optional
+        Time span of the difference in s, by default RATE_WINDOW_S
+
+    Returns
+    -------
+    np.ndarray
+        (pres[i] - pres[j]) / (time[i] - time[j]) with j the first sample within rate_window before sample i,
+        zero for the first sample
+    """
+    j = np.searchsorted(time, time - rate_window, side='left')
+    dt = time - time[j]
+    return np.divide(pres - pres[j], dt, out=np.zeros(len(pres)), where=dt > 0)
+
+
+def _reduce(ufunc, values, i0, i1):
+    """ufunc reduction of values[i0:i1] for each pair of limits, NaN for empty ranges."""
+    if len(i0) == 0:
+        return np.empty(0)
+    values = np.append(values, np.nan)  # reduceat needs valid indices, also for ranges ending at the end
+    result = ufunc.reduceat(values, np.column_stack((i0, i1)).ravel())[::2]
+    return np.where(i1 > i0, result, np.nan)
+
+
+def _first_equal(values, target, i0, i1):
+    """Index of the first value equal to target[k] in values[i0[k]:i1[k]] of each non-empty range (the first NaN
+    for a NaN target, as np.argmin). The ranges may overlap, their indices are laid out one after the other."""
+    full = i1 > i0
+    i0, i1, target = i0[full], i1[full], target[full]
+    if len(i0) == 0:
+        return np.zeros(0, dtype=np.int64)
+    lengths = i1 - i0
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    index = np.arange(lengths.sum()) - np.repeat(starts - i0, lengths)
+    expected = np.repeat(target, lengths)
+    found = (values[index] == expected) | (np.isnan(values[index]) & np.isnan(expected))
+    return np.minimum.reduceat(np.where(found, index, len(values)), starts)
+
+
+def pressure_metrics(time, pres, windows=None, acclimation=ACCLIMATION_S, rate_window=RATE_WINDOW_S) -> dict:
+    """Barotrauma metrics of passage windows of a pressure signal.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Monotonic time of the samples in s
+    pres : np.ndarray
+        Pressure of the samples
+    windows : list of tuple, optional
+        (t_start, t_end) of each passage in s, both inclusive, by default the whole signal
+    acclimation : float, optional
+        Time in s averaged to the acclimation pressure, by default ACCLIMATION_S
+    rate_window : float, optional
+        Time span of the rate of pressure change in s, by default RATE_WINDOW_S
+
+    Returns
+    -------
+    dict
+        Metrics table, METRIC_COLUMNS -> array with one entry per window
+    """
+    time = np.asarray(time, dtype=np.float64)
+    pres = np.asarray(pres, dtype=np.float64)
+    if windows is None:
+        windows = [(time[0], time[-1])] if len(time) else []
+    t0, t1 = np.asarray(windows, dtype=np.float64).reshape(-1, 2).T
+    i0 = np.searchsorted(time, t0, side='left')
+    i1 = np.searchsorted(time, t1, side='right')
+
+    # acclimation before the window, or at its beginning if the recording starts with the window
+    a0 = np.searchsorted(time, t0 - acclimation, side='left')
+    a1 = i0.copy()
+    start = a1 == a0
+    a0[start] = i0[start]
+    a1[start] = np.searchsorted(time, t0[start] + acclimation, side='left')
+    cumsum = np.concatenate(([0.0], np.cumsum(pres)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        acclimation_p = (cumsum[a1] - cumsum[a0]) / (a1 - a0)
+
+    nadir = _reduce(np.minimum, pres, i0, i1)
+    t_nadir = np.full(len(t0), np.nan)
+    t_nadir[i1 > i0] = time[_first_equal(pres, nadir, i0, i1)]
+    max_rate = _reduce(np.maximum, np.abs(rate_of_change(time, pres, rate_window)), i0, i1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        lrp = np.log(acclimation_p / nadir)
+    return {'t_start': t0, 't_end': t1, 'acclimation': acclimation_p, 'nadir': nadir, 't_nadir': t_nadir,
+            'lrp': lrp, 'max_rate': max_rate}
+
+
+def _check_sensor(sensor):
+    if not SIGNALS[sensor][2]:
+        raise ValueError(f'{sensor} files have no pressure channel')
+
+
+def barotrauma_metrics(data, sensor, windows=None, acclimation=ACCLIMATION_S, rate_window=RATE_WINDOW_S) -> dict:
+    """Barotrauma metrics of decoded data in memory.
+
+    Parameters
+    ----------
+    data : dict or pd.DataFrame
+        Decoded channels with the time key of the sensor (ts for RAPID V3, time otherwise),
+        e.g. RAPIDIMP, rapid.read(...) or the data of a BDS / EDF class
+    sensor : str
+        Sensor type, IMP, EDF, BDS100 or BDS250
+    windows, acclimation, rate_window : optional
+        See pressure_metrics
+
+    Returns
+    -------
+    dict
+        Metrics table, METRIC_COLUMNS -> array with one entry per window
+    """
+    _check_sensor(sensor)
+    return pressure_metrics(data[time_key(sensor)], pressure(data, sensor), windows, acclimation, rate_window)
+
+
+class PressureAccumulator:
+    def __init__(self, acclimation=ACCLIMATION_S, rate_window=RATE_WINDOW_S) -> None:
+        """Streaming barotrauma metrics of a whole recording, fed block by block.
+
+        Only the running sums and extrema and the samples of the last rate_window seconds are kept.
+
+        Parameters
+        ----------
+        acclimation : float, optional
+            Time in s at the beginning of the recording averaged to the acclimation pressure, by default ACCLIMATION_S
+        rate_window : float, optional
+            Time span of the rate of pressure change in s, by default RATE_WINDOW_S
+        """
+        self.acclimation = acclimation
+        self.rate_window = rate_window
+        self.t_start = self.t_end = None
+        self._sum, self._count = 0.0, 0
+        self._nadir, self._t_nadir = np.inf, np.nan
+        self._max_rate = np.nan
+        self._tail = (np.empty(0), np.empty(0))
+
+    def update(self, time, pres) -> None:
+        """Adds the next block of samples, see pressure_metrics."""
+        time = np.asarray(time, dtype=np.float64)
+        pres = np.asarray(pres, dtype=np.float64)
+        if len(time) == 0:
+            return
+        if self.t_start is None:
+            self.t_start = time[0]
+        self.t_end = time[-1]
+
+        n = np.searchsorted(time, self.t_start + self.acclimation, side='left')
+        self._sum += np.sum(pres[:n])
+        self._count += n
+        k = np.argmin(pres)
+        if pres[k] < self._nadir:
+            self._nadir, self._t_nadir = pres[k], time[k]
+
+        # the rate of the first samples of the block looks back into the previous block
+        t = np.concatenate((self._tail[0], time))
+        p = np.concatenate((self._tail[1], pres))
+        rate = np.abs(rate_of_change(t, p, self.rate_window))[len(self._tail[0]):]
+        self._max_rate = np.fmax(self._max_rate, rate.max())
+        keep = np.searchsorted(t, t[-1] - self.rate_window, side='left')
+        self._tail = (t[keep:], p[keep:])
+
+    def result(self) -> dict:
+        """Metrics table with one entry for the whole recording."""
+        if self.t_start is None:
+            return pressure_metrics([], [])
+        acclimation_p = self._sum / self._count if self._count else np.nan
+        with np.errstate(invalid='ignore', divide='ignore'):
+            lrp = np.log(acclimation_p / self._nadir)
+        return {key: np.array([value]) for key, value in zip(METRIC_COLUMNS, (
+            self.t_start, self.t_end, acclimation_p, self._nadir, self._t_nadir, lrp, self._max_rate))}
+
+
+def file_metrics(path, sensor=None, windows=None, chunk_size=CHUNK_SIZE, acclimation=ACCLIMATION_S,
+                 rate_window=RATE_WINDOW_S) -> dict:
+    """Barotrauma metrics of a sensor file with bounded memory.
+
+    Without windows the whole file is streamed block by block. Passage windows are read with
+    rapid.reader.read together with the acclimation time before them, so the time counter of the file
+    must be monotonic.
+
+    Parameters
+    ----------
+    path : str or Path
+        Location of the binary file
+    sensor : str, optional
+        Sensor type, inferred from the extension for .IMP files
+    windows : list of tuple, optional
+        (t_start, t_end) of each passage in s, by default the whole file
+    chunk_size : int, optional
+        Rows decoded at a time for the whole file, by default rapid.reader.CHUNK_SIZE
+    acclimation, rate_window : float, optional
+        See pressure_metrics
+
+    Returns
+    -------
+    dict
+        Metrics table, METRIC_COLUMNS -> array with one entry per window
+    """
+    sensor = get_format(path, sensor).name
+    _check_sensor(sensor)
+    channels = list(SIGNALS[sensor][2])
+    if windows is None:
+        accumulator = PressureAccumulator(acclimation, rate_window)
+        for data in iter_chunks(path, chunk_size, channels, sensor):
+            accumulator.update(data[time_key(sensor)], pressure(data, sensor))
+        return accumulator.result()
+
+    tables = []
+    for t_start, t_end in windows:
+        lookback = max(acclimation, rate_window)
+        data = read(path, t_start - lookback, max(t_end, t_start + acclimation), channels, sensor)
+        tables.append(barotrauma_metrics(data, sensor, [(t_start, t_end)], acclimation, rate_window))
+    return {key: np.concatenate([table[key] for table in tables]) if tables else np.empty(0)
+            for key in METRIC_COLUMNS}
+
+
+def batch_metrics(files, sensor=None, windows=None, workers=None, acclimation=ACCLIMATION_S,
+                  rate_window=RATE_WINDOW_S, verbose=True):
+    """Barotrauma metrics of many sensor files with a pool of worker processes.
+
+    Parameters
+    ----------
+    files : str, Path or list
+        Directory searched for .IMP files (.txt files if sensor is given), or a list of files
+    sensor : str, optional
+        Sensor type of all files, required for the .txt files of BDS and EDF sensors
+    windows : dict, optional
+        Source file -> list of (t_start, t_end) passage windows, by default the whole file
+    workers : int, optional
+        Number of worker processes, by default os.cpu_count(). With 1 the files are processed in this process.
+    acclimation, rate_window : float, optional
+        See pressure_metrics
+    verbose : bool, optional
+        Print the failures, by default True
+
+    Returns
+    -------
+    tuple
+        (metrics, failed): metrics table of all files with an additional 'file' column,
+        and dict source file -> error message
+    """
+    if isinstance(files, (str, os.PathLike)):
+        files = find_files(files, ('.IMP',) if sensor is None else ('.txt',))
+    files = [os.fspath(f) for f in files]
+    windows = {os.fspath(f): w for f, w in (windows or {}).items()}
+    tables, failed = map_files(_file_metrics, files, workers, verbose, sensor=sensor, windows=windows,
+                               acclimation=acclimation, rate_window=rate_window)
+    metrics = {key: np.concatenate([table[key] for table in tables.values()]) if tables else np.empty(0)
+               for key in METRIC_COLUMNS}
+    metrics['file'] = np.repeat(np.array(list(tables), dtype=object), [len(t['t_start']) for t in tables.values()])
+    return metrics, failed
+
+
+def _file_metrics(path, sensor, windows, acclimation, rate_window):
+    return file_metrics(path, sensor, windows.get(path), acclimation=acclimation, rate_window=rate_window)
+
+
+def write_metrics(exportFile, metrics):
+    """Exports a metrics table in ASCII .csv text format, see rapid.export.write_table."""
+    write_table(exportFile, metrics, METRIC_FORMATS)
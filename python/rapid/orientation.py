@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Batched quaternion rotation of sensor vectors, e.g. body-frame acceleration into the earth frame.
+
+The rotation v' = q v q^-1 is evaluated for all samples at once as v' = v + 2w(u x v) + 2u x (u x v)
+with the normalized quaternion q = (w, u), so no per-sample Python work and no numpy-quaternion are needed.
+"""
+
+import numpy as np
+
+
+def rotate_vectors(quat, vectors):
+    """Rotates one vector per sample by the orientation quaternion of that sample.
+
+    Parameters
+    ----------
+    quat : array_like, shape (n, 4)
+        Quaternions in (w, x, y, z) order, normalized before use. All-zero quaternions give NaN.
+    vectors : array_like, shape (n, 3)
+        Vectors in the body frame
+
+    Returns
+    -------
+    np.ndarray, shape (n, 3)
+        Vectors in the reference frame of the quaternions
+    """
+    quat = np.asarray(quat, dtype=np.float64)
+    vectors = np.asarray(vectors, dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        quat = quat / np.linalg.norm(quat, axis=-1, keepdims=True)
+    w = quat[:, :1]
+    u = quat[:, 1:]
+    uv = np.cross(u, vectors)
+    return vectors + 2 * (w * uv + np.cross(u, uv))
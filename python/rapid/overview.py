@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Overview plots of pressure and acceleration magnitude for whole deployment directories.
+
+The files are streamed block by block into a min/max envelope of the pixel budget of the plot
+(see rapid.decimate), so strike peaks stay visible and the memory use does not depend on the recording
+length. The figures are drawn on the non-interactive Agg canvas without pyplot, so many worker processes
+can render at the same time. matplotlib is only imported when a plot is drawn.
+"""
+
+import os
+
+import numpy as np
+
+from rapid.batch import find_files, map_files
+from rapid.decimate import N_POINTS, EnvelopeAccumulator
+from rapid.events import SIGNALS, acceleration_magnitude, pressure, time_key
+from rapid.formats import UNITS, get_format
+from rapid.reader import CHUNK_SIZE, iter_chunks
+
+
+FIGSIZE = (25, 5)  # inch, PIXELS wide at 100 dpi
+
+
+def draw_overview(ax1, t_pres, pres, t_acc, acc, pres_label="Pressure [hPa]",
+                  acc_label="Acceleration magnitude [g]"):
+    """Draws pressure on ax1 and acceleration magnitude on a twin y-axis.
+
+    Parameters
+    ----------
+    ax1 : matplotlib.axes.Axes
+        Axes of the pressure
+    t_pres, pres : np.ndarray
+        Time and pressure, pres None for sensors without pressure
+    t_acc, acc : np.ndarray
+        Time and acceleration magnitude
+    pres_label, acc_label : str, optional
+        Labels of the y-axes
+
+    Returns
+    -------
+    matplotlib.axes.Axes
+        Twin axes of the acceleration magnitude, ax1 itself without pressure
+    """
+    color = "C0"
+    ax1.set_xlabel("time [s]")
+    if pres is None:
+        ax2 = ax1  # no pressure axis
+    else:
+        ax1.set_ylabel(pres_label, color=color)
+        ax1.plot(t_pres, pres, color=color)
+        ax1.tick_params(axis="y", labelcolor=color)
+        ax1.ticklabel_format(useOffset=False)
+        ax2 = ax1.twinx()
+    color = "C1"
+    ax2.set_ylabel(acc_label, color=color)
+    ax2.plot(t_acc, acc, color=color)
+    ax2.tick_params(axis="y", labelcolor=color)
+    return ax2
+
+
+def file_envelopes(path, sensor=None, n_points=N_POINTS, chunk_size=CHUNK_SIZE):
+    """Min/max envelopes of the pressure and the acceleration magnitude (g) of a sensor file.
+
+    Parameters
+    ----------
+    path : str or Path
+        Location of the binary file
+    sensor : str, optional
+        Sensor type, inferred from the extension for .IMP and .HIG
+    n_points : int, optional
+        Points of each envelope, by default rapid.decimate.N_POINTS
+    chunk_size : int, optional
+        Rows decoded at a time, by default rapid.reader.CHUNK_SIZE
+
+    Returns
+    -------
+    tuple
+        ((t_pres, pres), (t_acc, acc)), (None, None) for the pressure of sensors without pressure channel
+    """
+    packet_format = get_format(path, sensor)
+    sensor = packet_format.name
+    acc_keys, _, pres_keys = SIGNALS[sensor]
+    n_rows = packet_format.n_rows(os.stat(path).st_size // packet_format.packet_size)
+    envelope_acc = EnvelopeAccumulator(n_rows, n_points)
+    envelope_pres = EnvelopeAccumulator(n_rows, n_points) if pres_keys else None
+
+    row = 0
+    for data in iter_chunks(path, chunk_size, list(acc_keys + pres_keys), sensor):
+        t = data[time_key(sensor)]
+        rows = np.arange(row, row + len(t))
+        row += len(t)
+        envelope_acc.update(rows, t, acceleration_magnitude(data, sensor))
+        if envelope_pres is not None:
+            envelope_pres.update(rows, t, pressure(data, sensor))
+    return (envelope_pres.result() if envelope_pres is not None else (None, None)), envelope_acc.result()
+
+
+def plot_file(path, sensor=None, dir_plots=None, n_points=N_POINTS, chunk_size=CHUNK_SIZE, dpi=100):
+    """Saves the overview plot of a sensor file as <dir_plots>/<name>-<sensor>.png.
+
+    Parameters
+    ----------
+    path : str or Path
+        Location of the binary file
+    sensor : str, optional
+        Sensor type, inferred from the extension for .IMP and .HIG
+    dir_plots : str or Path, optional
+        Folder of the plot, created if missing, by default a 'plots' folder next to the file
+    n_points, chunk_size : int, optional
+        See file_envelopes
+    dpi : int, optional
+        Resolution of the .png file, by default 100
+
+    Returns
+    -------
+    str
+        Location of the .png file
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    sensor = get_format(path, sensor).name
+    (t_pres, pres), (t_acc, acc) = file_envelopes(path, sensor, n_points, chunk_size)
+    pres_keys = SIGNALS[sensor][2]
+
+    fig = Figure(figsize=FIGSIZE)
+    FigureCanvasAgg(fig)
+    ax1 = fig.add_subplot()
+    draw_overview(ax1, t_pres, pres, t_acc, acc,
+                  pres_label=f"Pressure [{UNITS[pres_keys[0]]}]" if pres_keys else "")
+    ax1.set_title(os.path.basename(path))
+    fig.tight_layout()
+
+    if dir_plots is None:
+        dir_plots = os.path.join(os.path.dirname(os.path.abspath(path)), "plots")
+    os.makedirs(dir_plots, exist_ok=True)
+    fileNameNoExt = os.path.splitext(os.path.basename(path))[0]
+    plotFile = os.path.join(dir_plots, f"{fileNameNoExt}-{sensor}.png")
+    fig.savefig(plotFile, dpi=dpi)
+    return plotFile
+
+
+def plot_directory(files, sensor=None, dir_plots=None, workers=None, n_points=N_POINTS, verbose=True):
+    """Saves the overview plots of many sensor files with a pool of worker processes.
+
+    Parameters
+    ----------
+    files : str, Path or list
+        Directory searched for .IMP and .HIG files (.txt files if sensor is given), or a list of files
+    sensor : str, optional
+        Sensor type of all files, required for the .txt files of BDS and EDF sensors
+    dir_plots : str or Path, optional
+        Folder of all plots, by default a 'plots' folder next to each file
+    workers : int, optional
+        Number of worker processes, by default os.cpu_count(). With 1 the files are plotted in this process.
+    n_points : int, optional
+        Points of each envelope, by default rapid.decimate.N_POINTS
+    verbose : bool, optional
+        Print the failures, by default True
+
+    Returns
+    -------
+    tuple of dict
+        (plotted, failed): source file -> .png file, and source file -> error message
+    """
+    if isinstance(files, (str, os.PathLike)):
+        files = find_files(files, ('.IMP', '.HIG') if sensor is None else ('.txt',))
+    files = [os.fspath(f) for f in files]
+    return map_files(plot_file, files, workers, verbose, sensor=sensor, dir_plots=dir_plots, n_points=n_points)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Conversion of struct format strings into NumPy structured dtypes.
+
+The BDS and EDF classes describe their packets with struct format strings (e.g. "HI22f4B" or ">5hx").
+fmt_to_dtype builds the equivalent structured dtype with the same field offsets, padding and item size,
+so a whole file can be decoded with np.frombuffer instead of struct.iter_unpack.
+"""
+
+import os
+import re
+import struct
+import numpy as np
+
+
+_BYTE_ORDERS = {'@': '=', '=': '=', '<': '<', '>': '>', '!': '>'}
+_KINDS = {
+    'b': 'i', 'h': 'i', 'i': 'i', 'l': 'i', 'q': 'i', 'n': 'i',
+    'B': 'u', 'H': 'u', 'I': 'u', 'L': 'u', 'Q': 'u', 'N': 'u',
+    'e': 'f', 'f': 'f', 'd': 'f',
+    '?': 'b',
+}
+_TOKEN = re.compile(r'\s*(\d*)([a-zA-Z?])')
+
+
+def fmt_to_dtype(fmt, names):
+    """Builds a structured dtype equivalent to a struct format string.
+
+    Parameters
+    ----------
+    fmt : str
+        struct format string, optionally starting with a byte order character (@, =, <, >, !)
+    names : list of str
+        One field name per value unpacked by struct, pad bytes (x) do not get a name
+
+    Returns
+    -------
+    np.dtype
+        Structured dtype with itemsize == struct.calcsize(fmt)
+    """
+    order = '@'
+    body = fmt
+    if fmt and fmt[0] in _BYTE_ORDERS:
+        order, body = fmt[0], fmt[1:]
+
+    fields = {'names': [], 'formats': [], 'offsets': []}
+    consumed = order
+    pos = 0
+    for match in _TOKEN.finditer(body):
+        if match.start() != pos:
+            raise ValueError(f'Unsupported format string: {fmt!r}')
+        pos = match.end()
+        count = int(match.group(1)) if match.group(1) else 1
+        code = match.group(2)
+
+        if code == 'x':
+            consumed += f'{count}x'
+            continue
+        if code == 's':
+            consumed += f'{count}s'
+            fields['formats'].append(f'S{count}')
+            fields['offsets'].append(struct.calcsize(consumed) - count)
+            continue
+        if code not in _KINDS:
+            raise ValueError(f'Unsupported format character {code!r} in {fmt!r}')
+
+        size = struct.calcsize(order + code)
+        dt = _KINDS[code] + str(size) if _KINDS[code] != 'b' else '?'
+        for _ in range(count):
+            consumed += code
+            fields['formats'].append(_BYTE_ORDERS[order] + dt)
+            fields['offsets'].append(struct.calcsize(consumed) - size)
+
+    if body[pos:].strip():
+        raise ValueError(f'Unsupported format string: {fmt!r}')
+    if len(names) != len(fields['formats']):
+        raise ValueError(f'{fmt!r} unpacks {len(fields["formats"])} values but {len(names)} names were given')
+
+    fields['names'] = list(names)
+    fields['itemsize'] = struct.calcsize(fmt)
+    return np.dtype(fields)
+
+
+def unpack_array(binary_data, dtype):
+    """Decodes all complete packets of a bytes-like object, trailing partial packets are ignored.
+
+    Parameters
+    ----------
+    binary_data : bytes-like
+        Raw file contents
+    dtype : np.dtype
+        Structured dtype of one packet, see fmt_to_dtype
+
+    Returns
+    -------
+    np.ndarray
+        Read-only structured view on binary_data, one record per packet
+    """
+    count = len(binary_data) // dtype.itemsize
+    return np.frombuffer(binary_data, dtype=dtype, count=count)
+
+
+def map_packets(fileFull, dtype):
+    """Memory maps all complete packets of a binary file, trailing partial packets are ignored.
+
+    Parameters
+    ----------
+    fileFull : str or Path
+        Location of the binary file
+    dtype : np.dtype
+        Structured dtype of one packet
+
+    Returns
+    -------
+    np.ndarray
+        Read-only structured array, one record per packet. Only the pages that are accessed are read from disk.
+    """
+    count = os.stat(fileFull).st_size // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(fileFull, dtype=dtype, mode='r', shape=(count,))
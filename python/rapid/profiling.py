@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Optional per-stage timing and memory instrumentation of the conversions.
+
+The converters (rapid.export.convert_imp / convert_hig, the V3 scripts and the BDS and EDF classes) accept
+a Profiler and time each stage of the pipeline: reading the file, unpacking the packet fields, scaling with
+the gains and rounding, arranging the columns and writing the export. The stages of a file are summed over
+all its blocks and reported as one record per stage when the file is finished:
+
+    {"file": "B38-0928141315.IMP", "sensor": "IMP", "stage": "read", "calls": 12, "seconds": 0.031,
+     "bytes": 22806528, "peak_alloc": 2097216}
+
+seconds excludes the time of stages nested inside the stage, so the stages of a file add up to its 'total'
+record, apart from the time spent outside of any stage. peak_alloc is the largest memory allocated by Python
+and NumPy during the stage above the memory in use at its start, measured with tracemalloc (None with
+trace_memory=False). Each record is passed to the hooks of the profiler, e.g. json_lines to append it to a
+JSON lines file for monitoring.
+"""
+
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+
+class _Frame:
+    def __init__(self, name, nbytes) -> None:
+        self.name = name
+        self.nbytes = nbytes
+        self.start = time.perf_counter()
+        self.nested = 0.0  # seconds spent in nested stages
+        self.mem_start = 0
+        self.mem_peak = 0
+
+
+class Profiler:
+    def __init__(self, hooks=(), trace_memory=True) -> None:
+        """Collects the wall time, bytes processed and peak allocation of the stages of each converted file.
+
+        Parameters
+        ----------
+        hooks : iterable of callable, optional
+            Called with each record (dict) when it is complete, see json_lines
+        trace_memory : bool, optional
+            Measure the peak allocation of each stage with tracemalloc, by default True. Tracing slows down
+            stages creating many Python objects (e.g. the .csv formatting), set False to measure time only.
+        """
+        self.hooks = list(hooks)
+        self.trace_memory = trace_memory
+        self.records = []
+        self._stack = []
+        self._file = None  # (file, sensor, stage -> totals) of the file being profiled
+        self._started_tracing = False
+
+    def add_hook(self, hook) -> None:
+        """Adds a callable called with each complete record."""
+        self.hooks.append(hook)
+
+    def _emit(self, record) -> None:
+        self.records.append(record)
+        for hook in self.hooks:
+            hook(record)
+
+    def _memory(self):
+        return tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+
+    @contextmanager
+    def stage(self, name, nbytes=0):
+        """Times a stage, repeated calls within the same file are summed.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage, e.g. 'read', 'unpack', 'scale' or 'write'
+        nbytes : int, optional
+            Bytes processed by the stage, by default 0. Can also be set on the yielded frame (frame.nbytes),
+            e.g. the size of a file once it is written.
+        """
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        frame = _Frame(name, nbytes)
+        if self._stack:
+            # the peak of the enclosing stage so far, before the peak is reset for this one
+            parent = self._stack[-1]
+            parent.mem_peak = max(parent.mem_peak, self._memory()[1])
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        frame.mem_start = self._memory()[0]
+        self._stack.append(frame)
+        try:
+            yield frame
+        finally:
+            self._stack.pop()
+            seconds = time.perf_counter() - frame.start
+            peak = max(frame.mem_peak, self._memory()[1])
+            if self._stack:
+                parent = self._stack[-1]
+                parent.nested += seconds
+                parent.mem_peak = max(parent.mem_peak, peak)
+            self._add(name, seconds - frame.nested, frame.nbytes, peak - frame.mem_start)
+            if not self._stack and self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    def _add(self, name, seconds, nbytes, peak_alloc) -> None:
+        peak_alloc = peak_alloc if self.trace_memory else None
+        if self._file is None:
+            self._emit({'file': None, 'sensor': None, 'stage': name, 'calls': 1, 'seconds': seconds,
+                        'bytes': nbytes, 'peak_alloc': peak_alloc})
+            return
+        stages = self._file[2]
+        if name not in stages:
+            stages[name] = {'calls': 0, 'seconds': 0.0, 'bytes': 0, 'peak_alloc': peak_alloc}
+        totals = stages[name]
+        totals['calls'] += 1
+        totals['seconds'] += seconds
+        totals['bytes'] += nbytes
+        if peak_alloc is not None:
+            totals['peak_alloc'] = max(totals['peak_alloc'], peak_alloc)
+
+    @contextmanager
+    def file(self, fileFull, sensor=None):
+        """Profiles the conversion of one file, its stage records are emitted when the block ends.
+
+        The whole block is timed as the stage 'total' with the size of the file as bytes.
+        """
+        previous = self._file
+        self._file = (os.path.basename(os.fspath(fileFull)), sensor, {})
+        try:
+            with self.stage('total', os.stat(fileFull).st_size):
+                yield self
+        finally:
+            name, sensor, stages = self._file
+            self._file = previous
+            total = stages.pop('total')
+            total['seconds'] += sum(totals['seconds'] for totals in stages.values())  # inclusive
+            for stage, totals in list(stages.items()) + [('total', total)]:
+                self._emit({'file': name, 'sensor': sensor, 'stage': stage, **totals})
+
+    def dump(self, path) -> None:
+        """Appends all records collected so far to a JSON lines file."""
+        write = json_lines(path)
+        for record in self.records:
+            write(record)
+
+    def summary(self) -> dict:
+        """Seconds and bytes of each stage summed over all files, e.g. to print after a batch."""
+        summary = {}
+        for record in self.records:
+            totals = summary.setdefault(record['stage'], {'seconds': 0.0, 'bytes': 0})
+            totals['seconds'] += record['seconds']
+            totals['bytes'] += record['bytes']
+        return summary
+
+
+def json_lines(path):
+    """Hook appending each record as one line of JSON to a file."""
+    def write(record):
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+    return write
+
+
+def stage(profiler, name, nbytes=0):
+    """profiler.stage(name, nbytes), or a context doing nothing if profiler is None."""
+    return nullcontext(_Frame(name, nbytes)) if profiler is None else profiler.stage(name, nbytes)
+
+
+def profile_file(profiler, fileFull, sensor=None):
+    """profiler.file(fileFull, sensor), or a context doing nothing if profiler is None."""
+    return nullcontext() if profiler is None else profiler.file(fileFull, sensor)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Compact in-memory sensor records with lazy conversion into physical units.
+
+The RAPIDIMP / RAPIDHIG dicts and read() hold every channel as float64, so the 2 byte samples of the sensors
+take 8 bytes each. A SensorRecord keeps the raw int16 / uint16 (BDS: float32) values of each channel and the
+raw time counter, together with the gain, precision and unit of the channels from rapid.formats. A channel
+is converted with its gain and rounded only when it is accessed, and only for the rows asked for:
+
+    record = load_record('B38-0928141315.IMP')
+    record['p']                 # whole pressure channel in mbar, like RAPIDIMP['p']
+    record['ax', 1000:2000]     # only these rows are converted
+    record.raw['ax']            # int16 values as stored in the file
+
+A .IMP recording takes 28 bytes per row instead of 112 bytes for td, ts and the 12 channels as float64,
+so about a quarter of the memory. The converted values are identical to read() and the V3 scripts.
+"""
+
+import numpy as np
+
+from rapid.formats import UNITS, get_format
+from rapid.packets import map_packets
+from rapid.reader import _check_channels, find_rows
+
+
+class SensorRecord:
+    def __init__(self, packet_format, raw, counter=None, row0=0, first=None, source=None) -> None:
+        """Raw channels of consecutive rows of a sensor file, see load_record.
+
+        Parameters
+        ----------
+        packet_format : PacketFormat
+            Format of the file, holds the gain and precision of each channel
+        raw : dict
+            Channel key -> raw values, one per row
+        counter : np.ndarray, optional
+            Raw time counter of each row, None for formats without time counter (EDF)
+        row0 : int, optional
+            Row number in the file of the first row, for the time of formats without time counter
+        first : int, optional
+            Raw time counter of the first packet of the file, for relative time (BDS)
+        source : str, optional
+            Location of the sensor file
+        """
+        self.format = packet_format
+        self.raw = raw
+        self.counter = counter
+        self.row0 = row0
+        self.first = first
+        self.source = source
+        self._length = len(counter) if counter is not None else len(next(iter(raw.values()), ()))
+
+    def __repr__(self) -> str:
+        return (f"SensorRecord({self.format.name!r}, rows={len(self)}, channels={list(self.raw)}, "
+                f"nbytes={self.nbytes})")
+
+    def __len__(self) -> int:
+        return self._length
+
+    def keys(self) -> list:
+        """Time keys of the format and the channel keys, like the keys of read()."""
+        return self.format.time_keys + list(self.raw)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key) -> bool:
+        return key in self.raw or key in self.format.time_keys
+
+    def __getitem__(self, key):
+        """Values in physical units of a key, or of a key and rows: record['ax'], record['ax', 100:200]."""
+        index = slice(None)
+        if isinstance(key, tuple):
+            key, index = key
+        if key in self.raw:
+            return self.format.convert(key, self.raw[key][index])
+        if key in self.format.time_keys:
+            return self._time(index)[key]
+        raise KeyError(key)
+
+    def _time(self, index) -> dict:
+        if self.counter is None:
+            return self.format.time(self.row0 + np.arange(len(self))[index])
+        return self.format.time(self.counter[index], self.first)
+
+    def items(self):
+        """(key, values) pairs in physical units, each converted when it is reached."""
+        return ((key, self[key]) for key in self.keys())
+
+    def to_dict(self) -> dict:
+        """All keys converted into physical units, the same dict as read()."""
+        data = self._time(slice(None))
+        for key in self.raw:
+            data[key] = self[key]
+        return data
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the raw values and the time counter."""
+        counter = 0 if self.counter is None else self.counter.nbytes
+        return counter + sum(values.nbytes for values in self.raw.values())
+
+    def info(self, key) -> dict:
+        """Unit, gain (multiplied with the raw values), decimal place precision and raw dtype of a channel."""
+        _, gain, prec = self.format.channels[key]
+        if gain is not None and self.format.divide:
+            gain = 1 / gain
+        return {"unit": UNITS.get(key, ""), "gain": gain, "precision": prec, "dtype": str(self.raw[key].dtype)}
+
+    def rows(self, i0, i1) -> "SensorRecord":
+        """Record of the rows i0 ... i1 - 1, sharing the raw values of this record (no copy)."""
+        i0, i1, _ = slice(i0, i1).indices(len(self))
+        i1 = max(i0, i1)
+        return SensorRecord(
+            self.format,
+            {key: values[i0:i1] for key, values in self.raw.items()},
+            None if self.counter is None else self.counter[i0:i1],
+            self.row0 + i0,
+            self.first,
+            self.source,
+        )
+
+
+def _native(values):
+    return np.ascontiguousarray(values, dtype=values.dtype.newbyteorder("="))
+
+
+def load_record(path, t_start=None, t_end=None, channels=None, sensor=None) -> SensorRecord:
+    """Loads a time window and a subset of channels of a sensor file as raw values.
+
+    Takes the same arguments as rapid.reader.read and gives the same values on access, but keeps the raw
+    integer samples in memory instead of float64 arrays.
+
+    Parameters
+    ----------
+    path : str or Path
+        Location of the binary file
+    t_start, t_end : float, optional
+        Window limits in seconds, both inclusive. By default the whole file is loaded.
+    channels : list of str, optional
+        Channels to load, by default all channels of the format
+    sensor : str, optional
+        Sensor type (IMP, HIG, EDF, BDS100 or BDS250), inferred from the extension for .IMP and .HIG
+
+    Returns
+    -------
+    SensorRecord
+    """
+    packet_format = get_format(path, sensor)
+    channels = _check_channels(packet_format, channels)
+
+    packets = map_packets(path, packet_format.dtype)
+    i0, i1 = find_rows(packets, packet_format, t_start, t_end)
+    rows = np.arange(i0, i1)
+    src = rows if packet_format.source_rows is None else packet_format.source_rows(rows)
+
+    # one contiguous copy per channel in native byte order, the file is not kept open
+    raw = {key: _native(packets[packet_format.channels[key][0]][src]) for key in channels}
+    counter = first = None
+    if packet_format.time_field is not None:
+        counter = _native(packets[packet_format.time_field][rows])
+        first = packets[packet_format.time_field][0] if len(packets) else None
+    return SensorRecord(packet_format, raw, counter, i0, first, str(path))
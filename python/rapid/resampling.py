@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Resampling of sensor data onto a regular time grid, the Python counterpart of the MATLAB function
+
+    [dataOut, xq, RMSE] = interpolateRegFcn(dataIn, nOut, interpMethod)
+
+The importers derive the time straight from the raw counters (TimeRaw / FS, (time - time[0]) / 1000, the
+EDF row number / fs), so jitter of the clock and dropped packets end up in the time axis. resample puts all
+channels of a stream, as one (n, channels) matrix, onto a uniform grid:
+
+    linear    linear interpolation between the neighbouring samples
+    cubic     shape-preserving piecewise cubic Hermite interpolation (PCHIP, MATLAB interp1 'cubic'),
+              no overshoot at strikes or pressure steps
+    decimate  linear interpolation onto a grid q times finer than the output, a zero-phase Hamming windowed
+              FIR low-pass at the output Nyquist frequency and every q-th sample kept, so the output has no
+              aliasing when a 2000 Hz or 2048 Hz stream is compared with a 100 Hz or 250 Hz one
+
+Time steps larger than GAP_FACTOR times the median step are reported as gaps (dropped packets) and the grid
+points inside them are flagged as not valid (NaN by default). Samples whose time does not increase are
+dropped. The RMSE of each channel compares the input samples with the output interpolated linearly back to
+their time, i.e. the error of the round trip through the grid; for decimate it is the content above the new
+Nyquist frequency which is removed.
+"""
+
+import numpy as np
+
+from rapid.formats import get_format
+from rapid.framing import COUNTERS, frame_packets
+from rapid.packets import map_packets
+from rapid.reader import _check_channels, read
+
+
+METHODS = ('linear', 'cubic', 'decimate')
+GAP_FACTOR = 1.5  # time steps above GAP_FACTOR * median step are gaps (BDS jitter: 10 to 11 ms steps)
+FIR_ORDER = 20  # taps per decimation factor of the low-pass filter, as scipy.signal.decimate(ftype='fir')
+
+
+def regular_grid(t_start, t_end, fs=None, n_out=None):
+    """Uniform time grid from t_start to t_end, given by the sampling rate fs or the number of points n_out."""
+    if (fs is None) == (n_out is None):
+        raise ValueError("Give either the sampling rate fs or the number of points n_out")
+    if n_out is not None:
+        return np.linspace(t_start, t_end, int(n_out))
+    n = int(np.floor((t_end - t_start) * fs + 1e-9)) + 1 if t_end >= t_start else 0
+    return t_start + np.arange(n) / fs
+
+
+def find_gaps(time, gap_factor=GAP_FACTOR) -> dict:
+    """Time steps of more than gap_factor times the median step.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Increasing sample times (s)
+    gap_factor : float, optional
+        Threshold relative to the median step, by default GAP_FACTOR
+
+    Returns
+    -------
+    dict
+        Arrays row (last sample before the gap), t_start, t_end and missing (estimated dropped samples),
+        plus the median step 'period'
+    """
+    step = np.diff(time)
+    period = float(np.median(step)) if len(step) else np.nan
+    rows = np.flatnonzero(step > gap_factor * period) if len(step) else np.zeros(0, dtype=np.int64)
+    return {
+        'row': rows,
+        't_start': time[rows],
+        't_end': time[rows + 1],
+        'missing': np.maximum(np.round(step[rows] / period).astype(np.int64) - 1, 0),
+        'period': period,
+    }
+
+
+def _segments(time, xq):
+    """Index k of the interval time[k] ... time[k + 1] of each query point and its fraction."""
+    k = np.clip(np.searchsorted(time, xq, side='right') - 1, 0, max(len(time) - 2, 0))
+    h = time[k + 1] - time[k] if len(time) > 1 else np.ones(len(xq))
+    return k, (xq - time[k]) / h
+
+
+def interp_linear(time, values, xq) -> np.ndarray:
+    """Linear interpolation of all columns of values (n, channels) at xq, one index search for all of them."""
+    if len(time) == 1:
+        return np.repeat(values[:1], len(xq), axis=0)
+    k, w = _segments(time, xq)
+    w = w[:, None]
+    return values[k] * (1 - w) + values[k + 1] * w
+
+
+def _pchip_slopes(h, delta):
+    """Derivatives of the shape-preserving cubic at the samples (Fritsch-Carlson, as MATLAB pchip)."""
+    n = len(h) + 1
+    d = np.zeros((n, delta.shape[1]))
+    if n == 2:
+        d[:] = delta[0]
+        return d
+    hl, hr = h[:-1, None], h[1:, None]
+    dl, dr = delta[:-1], delta[1:]
+    w1, w2 = 2 * hr + hl, hr + 2 * hl
+    same = np.sign(dl) * np.sign(dr) > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d[1:-1] = np.where(same, (w1 + w2) / (w1 / dl + w2 / dr), 0.0)
+    for end, h0, h1, d0, d1 in ((0, h[0], h[1], delta[0], delta[1]), (-1, h[-1], h[-2], delta[-1], delta[-2])):
+        slope = ((2 * h0 + h1) * d0 - h0 * d1) / (h0 + h1)
+        slope = np.where(np.sign(slope) != np.sign(d0), 0.0, slope)
+        slope = np.where((np.sign(d0) != np.sign(d1)) & (np.abs(slope) > np.abs(3 * d0)), 3 * d0, slope)
+        d[end] = slope
+    return d
+
+
+def interp_cubic(time, values, xq) -> np.ndarray:
+    """Shape-preserving piecewise cubic (PCHIP) interpolation of all columns of values at xq."""
+    if len(time) < 3:
+        return interp_linear(time, values, xq)
+    h = np.diff(time)
+    delta = np.diff(values, axis=0) / h[:, None]
+    d = _pchip_slopes(h, delta)
+    k, t = _segments(time, xq)
+    t = t[:, None]
+    hk = h[k][:, None]
+    t2, t3 = t * t, t * t * t
+    return ((2 * t3 - 3 * t2 + 1) * values[k] + (t3 - 2 * t2 + t) * hk * d[k]
+            + (-2 * t3 + 3 * t2) * values[k + 1] + (t3 - t2) * hk * d[k + 1])
+
+
+def lowpass_fir(q, order=FIR_ORDER) -> np.ndarray:
+    """Hamming windowed sinc low-pass with the cutoff at 1 / q of the Nyquist frequency, order * q + 1 taps."""
+    n = order * q + 1
+    m = np.arange(n) - (n - 1) / 2
+    taps = np.sinc(m / q) / q * np.hamming(n)
+    return taps / taps.sum()
+
+
+def filtfilt_fir(values, taps) -> np.ndarray:
+    """Zero-phase filtering of all columns with a symmetric FIR filter, one FFT for the whole matrix.
+
+    The columns are extended with their first and last value, so the filter does not pull the ends to zero.
+    """
+    half = (len(taps) - 1) // 2
+    padded = np.pad(values, ((half, half), (0, 0)), mode='edge')
+    n_fft = 1 << int(np.ceil(np.log2(len(padded) + len(taps) - 1)))
+    spectrum = np.fft.rfft(padded, n_fft, axis=0) * np.fft.rfft(taps, n_fft)[:, None]
+    filtered = np.fft.irfft(spectrum, n_fft, axis=0)
+    return filtered[2 * half:2 * half + len(values)]
+
+
+def _decimate(time, values, xq, period):
+    if len(xq) < 2:
+        return interp_linear(time, values, xq)
+    step = xq[1] - xq[0]
+    q = max(int(round(step / period)), 1)
+    if q == 1:
+        return interp_linear(time, values, xq)
+    fine = xq[0] + np.arange((len(xq) - 1) * q + 1) * (step / q)
+    filtered = filtfilt_fir(interp_linear(time, values, fine), lowpass_fir(q))
+    return filtered[::q]
+
+
+def resample(time, values, fs=None, n_out=None, method='linear', t_start=None, t_end=None,
+             gap_factor=GAP_FACTOR, fill=np.nan) -> dict:
+    """Resamples channels onto a uniform time grid.
+
+    Parameters
+    ----------
+    time : array_like
+        Sample times (s), increasing apart from jitter
+    values : array_like
+        Samples, (n,) for one channel or (n, channels) for a channel matrix
+    fs : float, optional
+        Sampling rate of the grid (Hz)
+    n_out : int, optional
+        Number of grid points from t_start to t_end, instead of fs (nOut of interpolateRegFcn)
+    method : str, optional
+        One of METHODS: 'linear' (default), 'cubic' or 'decimate'
+    t_start, t_end : float, optional
+        Limits of the grid, by default the first and the last sample
+    gap_factor : float, optional
+        Time steps above gap_factor times the median step are gaps, by default GAP_FACTOR
+    fill : float or None, optional
+        Value of the grid points in gaps and outside the samples, by default NaN. None keeps the interpolated
+        (extrapolated: nearest) values.
+
+    Returns
+    -------
+    dict
+        time (grid), values (same number of dimensions as the input), valid (grid points with samples on
+        both sides and not in a gap), gaps (see find_gaps), dropped (samples whose time did not increase)
+        and rmse (one value per channel)
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method!r}, expected one of {list(METHODS)}")
+    time = np.asarray(time, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    single = values.ndim == 1
+    if single:
+        values = values[:, None]
+    if len(time) != len(values):
+        raise ValueError(f"time has {len(time)} samples, values {len(values)}")
+
+    # samples whose time does not increase (counter resets, duplicated packets) are dropped
+    keep = np.ones(len(time), dtype=bool)
+    if len(time) > 1:
+        keep[1:] = time[1:] > np.maximum.accumulate(time)[:-1]
+    time, values = time[keep], values[keep]
+    if len(time) == 0:
+        raise ValueError("No samples to resample")
+
+    t_start = time[0] if t_start is None else t_start
+    t_end = time[-1] if t_end is None else t_end
+    xq = regular_grid(t_start, t_end, fs, n_out)
+    gaps = find_gaps(time, gap_factor)
+
+    if method == 'linear':
+        out = interp_linear(time, values, xq)
+    elif method == 'cubic':
+        out = interp_cubic(time, values, xq)
+    else:
+        out = _decimate(time, values, xq, gaps['period'])
+    # nearest sample outside the samples, like np.interp
+    out[xq < time[0]] = values[0]
+    out[xq > time[-1]] = values[-1]
+
+    valid = (xq >= time[0]) & (xq <= time[-1])
+    if len(gaps['row']):
+        k = np.maximum(np.searchsorted(gaps['t_start'], xq, side='right') - 1, 0)
+        valid &= ~((xq > gaps['t_start'][k]) & (xq < gaps['t_end'][k]))
+
+    rmse = _rmse(time, values, xq, out, valid, gaps)
+    if fill is not None:
+        out[~valid] = fill
+    return {
+        'time': xq,
+        'values': out[:, 0] if single else out,
+        'valid': valid,
+        'gaps': gaps,
+        'dropped': int(np.count_nonzero(~keep)),
+        'rmse': rmse[0] if single else rmse,
+    }
+
+
+def _rmse(time, values, xq, out, valid, gaps):
+    """RMSE of the samples against the grid values interpolated back to their time, per channel."""
+    n_channels = values.shape[1]
+    if np.count_nonzero(valid) < 2:
+        return np.full(n_channels, np.nan)
+    # only samples between two valid grid points, away from the gaps
+    inside = (time >= xq[valid][0]) & (time <= xq[valid][-1])
+    near_gap = np.zeros(len(time), dtype=bool)
+    near_gap[gaps['row']] = near_gap[gaps['row'] + 1] = True
+    inside &= ~near_gap
+    if not np.any(inside):
+        return np.full(n_channels, np.nan)
+    back = interp_linear(xq[valid], out[valid], time[inside])
+    return np.sqrt(np.mean((back - values[inside]) ** 2, axis=0))
+
+
+def interpolate_regular(dataIn, nOut, interpMethod='linear'):
+    """Port of the MATLAB interpolateRegFcn.
+
+    Parameters
+    ----------
+    dataIn : array_like
+        Matrix with the time (s) in the first column and one channel per further column
+    nOut : int
+        Number of points of the regular grid from the first to the last time
+    interpMethod : str, optional
+        One of METHODS, by default 'linear'
+
+    Returns
+    -------
+    tuple
+        (dataOut, xq, RMSE): the resampled channels (nOut, channels), the grid and the RMSE of each channel.
+        Grid points in gaps are NaN.
+    """
+    dataIn = np.asarray(dataIn, dtype=np.float64)
+    result = resample(dataIn[:, 0], dataIn[:, 1:], n_out=nOut, method=interpMethod)
+    return result['values'], result['time'], result['rmse']
+
+
+def sample_time(path, sensor=None, resync=True) -> np.ndarray:
+    """Time (s) of every row of a sensor file, with the dropped packets of the EDF files counted.
+
+    RAPID V3 and BDS files carry a time counter, which read() converts. The EDF packets carry an index
+    which wraps after 2048 packets, read() takes the row number as time. Here the index steps are unwrapped,
+    so a packet dropped by the logger leaves a gap in the time instead of shifting all later samples.
+    With resync (default) the corrupted regions of the file are cut out first, see rapid.framing.
+    """
+    packet_format = get_format(path, sensor)
+    if packet_format.time_field is not None:
+        data = read(path, channels=[], sensor=packet_format.name, resync=resync)
+        return data['ts'] if 'ts' in data else data['time']
+    field, _, _, rate, wrap = COUNTERS[packet_format.name]
+    if resync:
+        packets = frame_packets(path, packet_format.name)[0].to_array()
+    else:
+        packets = map_packets(path, packet_format.dtype)
+    index = packets[field].astype(np.int64)
+    steps = np.diff(index) % wrap
+    return np.concatenate(([0], np.cumsum(steps))) / rate
+
+
+def resample_file(path, fs=None, n_out=None, method='linear', channels=None, sensor=None, t_start=None, t_end=None,
+                  gap_factor=GAP_FACTOR, fill=np.nan, resync=True):
+    """Reads a sensor file and resamples its channels onto a uniform grid, see resample.
+
+    Files of different sensors resampled with the same fs, t_start and t_end share the grid. By default the
+    corrupted regions of the file are cut out before (resync, see rapid.framing), so misaligned packets do not
+    end up as garbage time stamps.
+
+    Parameters
+    ----------
+    path : str or Path
+        Location of the binary file
+    channels : list of str, optional
+        Channels to resample, by default all channels of the format
+    sensor : str, optional
+        Sensor type (IMP, HIG, EDF, BDS100 or BDS250), inferred from the extension for .IMP and .HIG
+    resync : bool, optional
+        Cut out the corrupted regions of the file, by default True
+    fs, n_out, method, t_start, t_end, gap_factor, fill : optional
+        See resample
+
+    Returns
+    -------
+    tuple
+        (data, report): data holds the time key of the format (ts for RAPID V3, time otherwise) with the grid
+        and one array per channel, report the valid mask, gaps, dropped samples and the RMSE of each channel
+    """
+    packet_format = get_format(path, sensor)
+    channels = _check_channels(packet_format, channels)
+    time = sample_time(path, packet_format.name, resync)
+    data = read(path, channels=channels, sensor=packet_format.name, resync=resync)
+    matrix = np.zeros((len(time), 0))
+    if channels:
+        matrix = np.column_stack([data[key] for key in channels]).astype(np.float64)
+    result = resample(time, matrix, fs, n_out, method, t_start, t_end, gap_factor, fill)
+
+    time_key = 'ts' if packet_format.name in ('IMP', 'HIG') else 'time'
+    resampled = {time_key: result['time']}
+    for i, key in enumerate(channels):
+        resampled[key] = result['values'][:, i]
+    report = {key: result[key] for key in ('valid', 'gaps', 'dropped')}
+    report['rmse'] = dict(zip(channels, result['rmse'].tolist()))
+    return resampled, report
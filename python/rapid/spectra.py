@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Welch power spectral densities and spectrograms of the vibration channels, straight from the sensor files.
+
+The segments of all channels of a block of rows are cut with one strided view, detrended, windowed and
+transformed with a single batched np.fft.rfft call (segments x channels x samples), so a file costs one FFT
+call per block of rapid.reader.iter_chunks instead of one per channel and segment. The segments follow the
+rows of the whole recording: the samples of an unfinished segment are carried over to the next block, so the
+streamed PSD equals scipy.signal.welch of the whole file (average='mean', detrend='constant') with bounded
+memory. Segments holding a time step of more than GAP_PERIODS sample periods (dropped packets) are skipped.
+
+The window, its scaling and the frequencies depend only on the sampling rate and the segment length. They
+are kept in a SpectralPlan cached per process, so all files of the same rate (e.g. a fleet of .IMP files)
+reuse the plan. The sampling rate is measured from the time of the rows: the .IMP rows are 100 Hz although
+their counter runs at FS = 2000 counts per second.
+
+    spectra = file_spectra('B38-0928141315.IMP')
+    spectra['freq'], spectra['psd']['ax']          # Hz, g**2/Hz
+"""
+
+import functools
+
+import numpy as np
+
+from rapid.batch import find_files, map_files
+from rapid.events import time_key
+from rapid.export import write_table
+from rapid.formats import get_format
+from rapid.reader import CHUNK_SIZE, iter_chunks
+
+
+NPERSEG = 256  # samples per segment
+WINDOW = 'hann'
+# largest time step in sample periods within a segment: the BDS files step by 10 to 11 ms at 100 Hz, with a
+# step of 16 to 27 ms (one dropped packet) every ~137 rows, which would otherwise leave no segment of NPERSEG
+GAP_PERIODS = 3
+# vibration channels analysed by default
+SPECTRAL_CHANNELS = {
+    'IMP': ['ax', 'ay', 'az', 'gx', 'gy', 'gz'],
+    'HIG': ['ax', 'ay', 'az'],
+    'EDF': ['accx', 'accy', 'accz'],
+    'BDS100': ['accx', 'accy', 'accz', 'gyrox', 'gyroy', 'gyroz'],
+    'BDS250': ['accx', 'accy', 'accz', 'gyrox', 'gyroy', 'gyroz'],
+}
+BANDS = ((0, 5), (5, 20), (20, 50), (50, 200), (200, 1000))  # frequency bands of spectral_summary (Hz)
+SUMMARY_FORMATS = {'fs': '%.3f', 'n_segments': '%d', 'skipped': '%d', 'peak_hz': '%.3f', 'rms': '%.6g', 'file': '%s',
+                   'sensor': '%s', 'channel': '%s'}
+
+
+def get_window(name, n) -> np.ndarray:
+    """Periodic window of n samples ('hann', 'hamming', 'blackman' or 'boxcar'), as scipy.signal.get_window."""
+    windows = {'hann': np.hanning, 'hamming': np.hamming, 'blackman': np.blackman, 'boxcar': np.ones}
+    if name not in windows:
+        raise ValueError(f"Unknown window {name!r}, expected one of {list(windows)}")
+    return np.ones(n) if name == 'boxcar' else windows[name](n + 1)[:-1]
+
+
+class SpectralPlan:
+    def __init__(self, fs, nperseg=NPERSEG, noverlap=None, window=WINDOW) -> None:
+        """Window, scaling and frequencies of the spectra of one sampling rate, see spectral_plan.
+
+        Parameters
+        ----------
+        fs : float
+            Sampling rate in Hz
+        nperseg : int, optional
+            Samples per segment, by default NPERSEG
+        noverlap : int, optional
+            Samples shared by consecutive segments, by default nperseg // 2
+        window : str, optional
+            Window function, see get_window, by default WINDOW
+        """
+        self.fs = fs
+        self.nperseg = nperseg
+        self.noverlap = nperseg // 2 if noverlap is None else noverlap
+        if not 0 <= self.noverlap < nperseg:
+            raise ValueError(f"noverlap must be at least 0 and less than nperseg ({nperseg}), got {noverlap}")
+        self.step = nperseg - self.noverlap
+        self.window = get_window(window, nperseg)
+        self.freq = np.fft.rfftfreq(nperseg, 1 / fs)
+        # power spectral density, one-sided: the bins between DC and Nyquist hold both signs of frequency
+        self.scale = np.full(len(self.freq), 2 / (fs * np.sum(self.window**2)))
+        self.scale[0] /= 2
+        if nperseg % 2 == 0:
+            self.scale[-1] /= 2
+
+    def __repr__(self) -> str:
+        return f"SpectralPlan(fs={self.fs}, nperseg={self.nperseg}, noverlap={self.noverlap})"
+
+    def spectra(self, values, starts) -> np.ndarray:
+        """Power spectral densities of the segments starting at the rows starts of values (rows, channels).
+
+        Returns
+        -------
+        np.ndarray
+            (segments, channels, frequencies)
+        """
+        if len(starts) == 0:
+            return np.zeros((0, values.shape[1], len(self.freq)))
+        segments = np.lib.stride_tricks.sliding_window_view(values, self.nperseg, axis=0)[starts]
+        segments = segments - segments.mean(axis=-1, keepdims=True)
+        spectrum = np.fft.rfft(segments * self.window, axis=-1)
+        return (spectrum.real**2 + spectrum.imag**2) * self.scale
+
+
+@functools.lru_cache(maxsize=32)
+def spectral_plan(fs, nperseg=NPERSEG, noverlap=None, window=WINDOW) -> SpectralPlan:
+    """SpectralPlan shared by all files of the same sampling rate and segment settings in this process."""
+    return SpectralPlan(fs, nperseg, noverlap, window)
+
+
+class SpectrumAccumulator:
+    def __init__(self, plan, n_channels, spectrogram=False, skip_gaps=True) -> None:
+        """Welch PSD (and spectrogram) of consecutive blocks of one recording.
+
+        Parameters
+        ----------
+        plan : SpectralPlan
+            Window and segment settings
+        n_channels : int
+            Columns of the blocks
+        spectrogram : bool, optional
+            Also keep the spectrum of every segment, by default False
+        skip_gaps : bool, optional
+            Leave out the segments holding a time step of more than GAP_PERIODS sample periods, by default True
+        """
+        self.plan = plan
+        self.spectrogram = spectrogram
+        self.skip_gaps = skip_gaps
+        self._sum = np.zeros((n_channels, len(plan.freq)))
+        self.n_segments = 0
+        self.skipped = 0
+        self._time = np.zeros(0)
+        self._values = np.zeros((0, n_channels))
+        self._times, self._spectra = [], []
+
+    def update(self, time, values) -> None:
+        """Adds the next block of rows.
+
+        Parameters
+        ----------
+        time : np.ndarray
+            Time of the rows in s
+        values : np.ndarray
+            (rows, channels)
+        """
+        plan = self.plan
+        time = np.concatenate((self._time, np.asarray(time, dtype=np.float64)))
+        values = np.concatenate((self._values, np.asarray(values, dtype=np.float64)))
+        starts = np.arange(0, len(time) - plan.nperseg + 1, plan.step)
+        if len(starts):
+            clean = np.ones(len(starts), dtype=bool)
+            if self.skip_gaps:
+                # segments holding a gap of the time counter
+                gaps = np.concatenate(([0], np.cumsum(np.diff(time) > GAP_PERIODS / plan.fs)))
+                clean = gaps[starts + plan.nperseg - 1] == gaps[starts]
+            self.skipped += int(np.count_nonzero(~clean))
+            spectra = plan.spectra(values, starts[clean])
+            self._sum += spectra.sum(axis=0)
+            self.n_segments += len(spectra)
+            if self.spectrogram:
+                self._times.append(time[starts[clean] + plan.nperseg // 2])
+                self._spectra.append(spectra)
+        # rows of the segments which start in the next block
+        keep = len(starts) * plan.step
+        self._time, self._values = time[keep:], values[keep:]
+
+    def result(self) -> dict:
+        """freq (Hz), psd (channels, frequencies), n_segments and skipped, plus times (s, centre of each
+        segment) and spectrogram (segments, channels, frequencies) if requested."""
+        psd = self._sum / self.n_segments if self.n_segments else np.full(self._sum.shape, np.nan)
+        result = {'freq': self.plan.freq, 'psd': psd, 'n_segments': self.n_segments, 'skipped': self.skipped}
+        if self.spectrogram:
+            result['times'] = np.concatenate(self._times) if self._times else np.zeros(0)
+            result['spectrogram'] = (np.concatenate(self._spectra) if self._spectra
+                                     else np.zeros((0,) + self._sum.shape))
+        return result
+
+
+def measured_rate(time) -> float:
+    """Sampling rate in Hz from the median time step, rounded to mHz so equal rates share a SpectralPlan."""
+    step = np.median(np.diff(time))
+    return float(np.round(1 / step, 3))
+
+
+def file_spectra(path, sensor=None, channels=None, nperseg=NPERSEG, noverlap=None, window=WINDOW,
+                 spectrogram=False, chunk_size=CHUNK_SIZE, resync=True, skip_gaps=True) -> dict:
+    """Welch PSD and optionally the spectrogram of the channels of a sensor file with bounded memory.
+
+    Parameters
+    ----------
+    path : str or Path
+        Location of the binary file
+    sensor : str, optional
+        Sensor type, inferred from the extension for .IMP and .HIG
+    channels : list of str, optional
+        Channels to analyse, by default SPECTRAL_CHANNELS of the sensor
+    nperseg, noverlap, window : optional
+        Segment settings, see SpectralPlan
+    spectrogram : bool, optional
+        Also return the spectrum of every segment, by default False
+    chunk_size : int, optional
+        Rows decoded at a time, by default rapid.reader.CHUNK_SIZE
+    resync : bool, optional
+        Cut out corrupted regions of the file, by default True (see rapid.framing)
+    skip_gaps : bool, optional
+        Leave out the segments holding a time step of more than GAP_PERIODS sample periods, by default True.
+        The single packets which the BDS loggers drop every ~137 rows are tolerated.
+
+    Returns
+    -------
+    dict
+        sensor, fs (measured), freq, psd (channel -> PSD in unit**2/Hz), n_segments, skipped (segments with
+        gaps), plus times and spectrogram (channel -> (segments, frequencies)) if requested
+    """
+    sensor = get_format(path, sensor).name
+    channels = SPECTRAL_CHANNELS[sensor] if channels is None else list(channels)
+    accumulator = None
+    for data in iter_chunks(path, chunk_size, channels, sensor, resync=resync):
+        time = data[time_key(sensor)]
+        if accumulator is None:
+            if len(time) < 2:
+                continue  # the sampling rate needs two rows
+            plan = spectral_plan(measured_rate(time), nperseg, noverlap, window)
+            accumulator = SpectrumAccumulator(plan, len(channels), spectrogram, skip_gaps)
+        accumulator.update(time, np.column_stack([data[key] for key in channels]))
+    if accumulator is None:
+        raise ValueError(f'{path} holds too few rows for a spectrum')
+
+    result = accumulator.result()
+    spectra = {'sensor': sensor, 'fs': accumulator.plan.fs, 'freq': result['freq'],
+               'psd': dict(zip(channels, result['psd'])), 'n_segments': result['n_segments'],
+               'skipped': result['skipped']}
+    if spectrogram:
+        spectra['times'] = result['times']
+        spectra['spectrogram'] = {key: result['spectrogram'][:, i] for i, key in enumerate(channels)}
+    return spectra
+
+
+def fleet_spectra(files, sensor=None, workers=None, verbose=True, **options):
+    """Welch PSDs of many sensor files with a pool of worker processes, see file_spectra.
+
+    Each worker keeps its SpectralPlans, so the files of one rate share the window and frequencies.
+
+    Parameters
+    ----------
+    files : str, Path or list
+        Folder searched for .IMP and .HIG files (.txt files if sensor is given), or a list of files
+    sensor : str, optional
+        Sensor type of all files, required for the .txt files of BDS and EDF sensors
+    workers : int, optional
+        Number of worker processes, by default os.cpu_count()
+    verbose : bool, optional
+        Print the failures, by default True
+    **options : optional
+        Further arguments of file_spectra
+
+    Returns
+    -------
+    tuple of dict
+        (spectra, failed): file -> result of file_spectra, file -> error message
+    """
+    if not isinstance(files, (list, tuple)):
+        files = find_files(files, ('.IMP', '.HIG') if sensor is None else ('.txt',))
+    return map_files(file_spectra, list(files), workers, verbose, sensor=sensor, **options)
+
+
+def spectral_summary(spectra, bands=BANDS) -> dict:
+    """Table of the dominant frequency, RMS and band powers of every channel of many files.
+
+    Parameters
+    ----------
+    spectra : dict
+        File -> result of file_spectra, e.g. the first result of fleet_spectra
+    bands : tuple of tuple, optional
+        (low, high) frequency bands in Hz, by default BANDS
+
+    Returns
+    -------
+    dict
+        Columns file, sensor, channel, fs, n_segments, skipped (segments with gaps), peak_hz (largest PSD
+        above DC), rms (square root of the integrated PSD) and one band power column per band, NaN for bands
+        above the Nyquist frequency. All values of a file without segments are NaN.
+    """
+    names = [f'band_{low:g}_{high:g}' for low, high in bands]
+    columns = ['file', 'sensor', 'channel', 'fs', 'n_segments', 'skipped', 'peak_hz', 'rms'] + names
+    table = {column: [] for column in columns}
+    for fileFull, result in spectra.items():
+        freq = result['freq']
+        df = freq[1] - freq[0]
+        for channel, psd in result['psd'].items():
+            table['file'].append(str(fileFull))
+            table['sensor'].append(result['sensor'])
+            table['channel'].append(channel)
+            table['fs'].append(result['fs'])
+            table['n_segments'].append(result['n_segments'])
+            table['skipped'].append(result['skipped'])
+            empty = result['n_segments'] == 0 or len(freq) < 2 or not np.any(np.isfinite(psd[1:]))
+            table['peak_hz'].append(np.nan if empty else freq[1:][np.nanargmax(psd[1:])])
+            table['rms'].append(np.sqrt(np.sum(psd) * df))
+            for name, (low, high) in zip(names, bands):
+                inside = (freq >= low) & (freq < high)
+                table[name].append(np.sum(psd[inside]) * df if low < freq[-1] else np.nan)
+    return {column: np.asarray(values) for column, values in table.items()}
+
+
+def write_spectra(exportFile, spectra):
+    """Exports the PSDs of file_spectra in ASCII .csv text format, one column per channel."""
+    table = {'freq_hz': spectra['freq']}
+    table.update({f'{key}_psd': psd for key, psd in spectra['psd'].items()})
+    write_table(exportFile, table, {column: '%.6g' for column in table})
+
+
+def write_summary(exportFile, summary):
+    """Exports the table of spectral_summary in ASCII .csv text format."""
+    write_table(exportFile, summary, {**{c: '%.6g' for c in summary}, **SUMMARY_FORMATS})
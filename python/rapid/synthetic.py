@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Synthetic sensor files of any size for benchmarks and correctness checks.
+
+The files have the packet layouts of FORMATS with the counters of the real sensors (.IMP every 20 counts of
+FS, .HIG every count, BDS in ms, EDF index wrapping after 2048 packets), raw values scaled with the gains of
+rapid.v3 and rapid.formats, a slow pressure passage and injected strike events with known time and peak.
+The file is written block by block, so multi-GB files need little memory. write_growing writes the same
+file at the pace of a logging sensor, for the live decoders of rapid.live.
+"""
+
+import time
+
+import numpy as np
+
+from rapid import v3
+from rapid.formats import EDF_ACC_GAIN, EDF_FS, EDF_P_GAIN, FORMATS
+
+
+G = 9.81  # m/s2 per g
+BLOCK_SIZE = 2**18  # packets generated and written at a time
+WRITE_SIZE = 4093  # bytes appended per write by write_growing, splits packets of every format
+EDF_INDEX_WRAP = 2048  # the EDF packet index counts 0 ... 2047
+
+# sample period of each sensor type in counts of its time counter and the counter rate (counts per second)
+COUNTER = {
+    'IMP': (20, v3.FS),
+    'HIG': (1, v3.FS),
+    'EDF': (1, EDF_FS),
+    'BDS100': (10, 1000),
+    'BDS250': (10, 1000),
+}
+HIG_RANGE_G = 400  # saturation of the high-g accelerometer
+
+
+def sample_rate(sensor):
+    """Rows per second of the synthetic files of a sensor type."""
+    step, rate = COUNTER[sensor]
+    return rate / step
+
+
+def default_strikes(sensor, n_packets, n_strikes=5, seed=0):
+    """Strike events spread over the recording, as (time in s, peak in g, duration in s) tuples."""
+    rng = np.random.default_rng(seed)
+    fs = sample_rate(sensor)
+    # on a sample, so the peak is recorded at full height, and at least a few samples wide
+    times = np.round(np.sort(rng.uniform(0.1, 0.9, n_strikes)) * n_packets) / fs
+    peaks = rng.uniform(20, 300, n_strikes) if sensor != 'IMP' else rng.uniform(5, 15, n_strikes)  # IMU: 16 g
+    width = max(0.005, 3 / fs)
+    return [(float(t), float(p), width) for t, p in zip(times, peaks)]
+
+
+def _signals(t, strikes, duration, rng):
+    """Acceleration (g, 3 axes) and pressure (mbar) of the samples at time t."""
+    n = len(t)
+    acc = rng.normal(0, 0.02, (n, 3))
+    acc[:, 2] += 1.0  # gravity
+    for t_strike, peak, width in strikes:
+        near = np.abs(t - t_strike) < 5 * width
+        if np.any(near):
+            shape = np.exp(-0.5 * ((t[near] - t_strike) / (width / 2)) ** 2)
+            acc[near, 0] += peak * shape  # |acc| = sqrt(peak**2 + 1) at the strike
+    # passage: compression to 2.5 bar around the middle of the recording, nadir of about 600 mbar after it
+    phase = t / duration
+    pres = 1000 + 1500 * np.exp(-0.5 * ((phase - 0.45) / 0.05) ** 2) - 400 * np.exp(-0.5 * ((phase - 0.6) / 0.01) ** 2)
+    pres += rng.normal(0, 0.3, n)
+    return acc, pres
+
+
+def _block(sensor, rows, duration, strikes, rng):
+    packet_format = FORMATS[sensor]
+    step, rate = COUNTER[sensor]
+    t = rows * step / rate
+    acc, pres = _signals(t, strikes, duration, rng)
+    packets = np.zeros(len(rows), dtype=packet_format.dtype)
+
+    if sensor in ('IMP', 'HIG'):
+        packets['time'] = rows * step
+        packets['eol'] = 0x0B
+        if sensor == 'HIG':
+            acc = np.clip(acc, -HIG_RANGE_G, HIG_RANGE_G)
+            for i, axis in enumerate(('ax', 'ay', 'az')):
+                packets[axis] = np.round(acc[:, i] / v3.GAIN_HIG)
+            return packets
+        acc = np.clip(acc, -16, 16)
+        for i, axis in enumerate(('ax', 'ay', 'az')):
+            packets[axis] = np.round(acc[:, i] / v3.GAIN_AC)
+        for axis in ('gx', 'gy', 'gz'):
+            packets[axis] = np.round(rng.normal(0, 2, len(rows)) / v3.GAIN_GY)
+        for i, axis in enumerate(('mx', 'my', 'mz')):
+            packets[axis] = np.round((40 * np.cos(i) + rng.normal(0, 1, len(rows))) / v3.GAIN_MG)
+        packets['p'] = np.round(pres / v3.GAIN_PR)
+        packets['t'] = np.round(16.5 / v3.GAIN_T)
+        packets['b'] = np.round((4.1 - 1e-6 * t) / v3.GAIN_BT)
+        return packets
+
+    if sensor == 'EDF':
+        packets['index'] = rows % EDF_INDEX_WRAP
+        for i, axis in enumerate(('accx', 'accy', 'accz')):
+            packets[axis] = np.clip(np.round(acc[:, i] * G * EDF_ACC_GAIN), -32768, 32767)
+        packets['pres'] = np.round(pres * EDF_P_GAIN)
+        # the pad byte of >5hx is the 0x0B end of line written by the loggers
+        packets.view(np.uint8).reshape(len(rows), -1)[:, -1] = 0x0B
+        return packets
+
+    # BDS: native float channels in hPa, m/s2 and deg/s, ms time counter
+    columns = packets.dtype.names
+    packets[columns[0]] = 2573  # sample rate field as written by the loggers
+    packets['time'] = 25000 + np.round(t * rate).astype(np.int64)
+    for k in (1, 2, 3):
+        packets[f'P{k}'] = pres + rng.normal(0, 0.05, len(rows))
+        packets[f'T{k}'] = 15.0
+    for i, axis in enumerate(('accx', 'accy', 'accz')):
+        packets[axis] = acc[:, i] * G
+    for axis in ('gyrox', 'gyroy', 'gyroz'):
+        packets[axis] = rng.normal(0, 0.05, len(rows))
+    if 'quat w' in columns:
+        packets['quat w'] = 1.0  # sensor frame aligned with the earth frame
+        packets['magz'] = -49.0
+    return packets
+
+
+def write_synthetic(path, sensor, n_packets, strikes=None, seed=0, block_size=BLOCK_SIZE):
+    """Writes a synthetic sensor file.
+
+    Parameters
+    ----------
+    path : str or Path
+        Location of the file, overwritten
+    sensor : str
+        Sensor type, key in FORMATS
+    n_packets : int
+        Number of packets, the file has n_packets * packet_size bytes
+    strikes : list of tuple, optional
+        (time in s, peak in g, duration in s) of the injected strikes, by default default_strikes
+    seed : int, optional
+        Seed of the sensor noise, by default 0
+    block_size : int, optional
+        Packets generated and written at a time, by default BLOCK_SIZE
+
+    Returns
+    -------
+    list of tuple
+        Injected strikes
+    """
+    if strikes is None:
+        strikes = default_strikes(sensor, n_packets, seed=seed)
+    with open(path, 'wb') as f:
+        for packets in _blocks(sensor, n_packets, strikes, seed, block_size):
+            packets.tofile(f)
+    return strikes
+
+
+def _blocks(sensor, n_packets, strikes, seed, block_size):
+    rng = np.random.default_rng(seed)
+    duration = n_packets / sample_rate(sensor)
+    for i0 in range(0, n_packets, block_size):
+        rows = np.arange(i0, min(i0 + block_size, n_packets))
+        yield _block(sensor, rows, duration, strikes, rng)
+
+
+def write_growing(path, sensor, n_packets, speed=1.0, write_size=WRITE_SIZE, strikes=None, seed=0):
+    """Writes the same file as write_synthetic piece by piece at the pace of a logging sensor.
+
+    Every write appends write_size bytes, which is not a multiple of the packet sizes, so readers of the
+    growing file see partial packets. Run it in a separate process to test the live decoders of rapid.live.
+
+    Parameters
+    ----------
+    path : str, Path or file
+        Location of the file, overwritten, or a binary file object (e.g. sys.stdout.buffer)
+    sensor : str
+        Sensor type, key in FORMATS
+    n_packets : int
+        Number of packets
+    speed : float, optional
+        Multiple of the real-time data rate of the sensor, by default 1.0. None writes as fast as possible.
+    write_size : int, optional
+        Bytes per write, by default WRITE_SIZE
+    strikes, seed : optional
+        See write_synthetic
+
+    Returns
+    -------
+    list of tuple
+        Injected strikes
+    """
+    if strikes is None:
+        strikes = default_strikes(sensor, n_packets, seed=seed)
+    bytes_per_s = sample_rate(sensor) * FORMATS[sensor].packet_size * (speed or np.inf)
+    t0 = time.perf_counter()
+    written = 0
+    f = path if hasattr(path, 'write') else open(path, 'wb')
+    try:
+        for packets in _blocks(sensor, n_packets, strikes, seed, BLOCK_SIZE):
+            data = packets.tobytes()
+            for i in range(0, len(data), write_size):
+                piece = data[i:i + write_size]
+                written += len(piece)
+                # the bytes are written once the sensor has recorded them
+                delay = written / bytes_per_s - (time.perf_counter() - t0)
+                if delay > 0:
+                    time.sleep(delay)
+                f.write(piece)
+                f.flush()
+    finally:
+        if f is not path:
+            f.close()
+    return strikes
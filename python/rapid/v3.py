@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Vectorized decoders for the binary files of the RAPID V3 sensors.
+
+Each .IMP packet is 29 bytes long: 1 x int32 time counter, 12 x int16/uint16 sensor values and
+one 0x0B end of line byte. Each .HIG packet is 11 bytes long: 1 x int32 time counter, 3 x int16
+high-g accelerometer values and one 0x0B end of line byte. Instead of unpacking every value with
+struct, the whole file is memory mapped as an array of packets, so the decoding runs at memory
+bandwidth. The returned dicts match the RAPIDIMP and RAPIDHIG dicts of the original
+import_IMP_RAPID_v3.py and import_HIG_RAPID_v3.py scripts value for value.
+"""
+
+import numpy as np
+
+from rapid.packets import map_packets
+
+
+#  Constants of the RAPID V3 sensors
+FS = 2000  # Sampling rate in Hz
+IMU_PREC = 3 # decimal place precision of exported data
+P_PREC = 1 # decimal place precision of pressure sensor
+T_BAT_PREC = 2 # decimal place precision of pressure sensor temp and battery voltage
+HIG_PREC = 1 # decimal place precision of exported high-g accelerometer (+/- 400g) data
+TIME_PREC = 4 # decimal place precision of the exported time, resolves 1 / FS = 0.0005 s
+
+GAIN_AC = 0.005 / 9.81  # imu acc gain (g), comment out the / 9.81 if you wish to have units of ms-2
+GAIN_GY = 0.1  # imu gyro gain (deg/s)
+GAIN_MG = 0.1  # imu magnetometer gain (mT)
+GAIN_PR = 0.1  # pressure sensor gain (mbar)
+GAIN_T = 0.01  # pressure sensor temperature gain (C)
+GAIN_BT = 0.01  # battery voltage gain (V)
+GAIN_HIG = 0.1 # imu acc gain to convert raw data to units of g (1 g = 9.81 ms-2)
+
+# 1 x int32 (4 bytes) + 12 x int16 (2 bytes) + one byte for 0x0B end of line
+IMP_DTYPE = np.dtype([
+    ('time', '>i4'),
+    ('ax', '>i2'), ('ay', '>i2'), ('az', '>i2'),  # acc X, Y, Z
+    ('gx', '>i2'), ('gy', '>i2'), ('gz', '>i2'),  # gyro X, Y, Z
+    ('mx', '>i2'), ('my', '>i2'), ('mz', '>i2'),  # mag X, Y, Z
+    ('p', '>u2'),  # pressure sensor
+    ('t', '>i2'),  # pressure sensor temp
+    ('b', '>i2'),  # battery voltage
+    ('eol', 'u1'),  # 0x0B end of line
+])
+IMP_PACKET_SIZE = IMP_DTYPE.itemsize
+
+# 1 x int32 (4 bytes) + 3 x int16 (2 bytes) + 1 byte for 0x0B end of line
+HIG_DTYPE = np.dtype([
+    ('time', '>i4'),
+    ('ax', '>i2'), ('ay', '>i2'), ('az', '>i2'),  # high-g acc X, Y, Z
+    ('eol', 'u1'),  # 0x0B end of line
+])
+HIG_PACKET_SIZE = HIG_DTYPE.itemsize
+
+# physical channels: key in the RAPIDIMP / RAPIDHIG dict -> (packet field, gain, decimal place precision)
+IMP_CHANNELS = {
+    'ax': ('ax', GAIN_AC, IMU_PREC),
+    'ay': ('ay', GAIN_AC, IMU_PREC),
+    'az': ('az', GAIN_AC, IMU_PREC),
+    'gx': ('gx', GAIN_GY, IMU_PREC),
+    'gy': ('gy', GAIN_GY, IMU_PREC),
+    'gz': ('gz', GAIN_GY, IMU_PREC),
+    'mx': ('mx', GAIN_MG, IMU_PREC),
+    'my': ('my', GAIN_MG, IMU_PREC),
+    'mz': ('mz', GAIN_MG, IMU_PREC),
+    'p': ('p', GAIN_PR, P_PREC),
+    't': ('t', GAIN_T, T_BAT_PREC),
+    'b': ('b', GAIN_BT, T_BAT_PREC),
+}
+HIG_CHANNELS = {
+    'ax': ('ax', GAIN_HIG, HIG_PREC),
+    'ay': ('ay', GAIN_HIG, HIG_PREC),
+    'az': ('az', GAIN_HIG, HIG_PREC),
+}
+
+
+def read_imp_packets(fileFull):
+    """Maps a .IMP file as a read-only structured array of packets.
+
+    Parameters
+    ----------
+    fileFull : str or Path
+        Location of the .IMP file
+
+    Returns
+    -------
+    np.memmap
+        One record per complete packet with the fields of IMP_DTYPE, in big-endian byte order
+    """
+    return map_packets(fileFull, IMP_DTYPE)
+
+
+def read_hig_packets(fileFull):
+    """Maps a .HIG file as a read-only structured array of packets, see read_imp_packets."""
+    return map_packets(fileFull, HIG_DTYPE)
+
+
+def imp_source_rows(rows):
+    """Packet index holding the sensor values of each exported row of a .IMP file.
+
+    The original script reads the sensor values one packet behind the time counter and then
+    overwrites the first row with the second one (DataRaw[0,:] = DataRaw[1,:]).
+    """
+    return np.maximum(rows - 1, 0)
+
+
+def hig_source_rows(rows):
+    """Packet index holding the sensor values of each exported row of a .HIG file.
+
+    The original script skips the very first entry to match the MATLAB code time alignment,
+    so the sensor values are read one packet ahead of the time counter.
+    """
+    return rows + 1
+
+
+def _to_dict(packets, channels, source_rows):
+    # the last complete packet is never exported, like flen = (size // packetSize) - 1 in the scripts
+    flen = max(len(packets) - 1, 0)
+    TimeRaw = packets['time'][:flen].astype(np.float64)
+    src = source_rows(np.arange(flen))
+
+    data = {'td': TimeRaw, 'ts': TimeRaw / FS}
+    for key, (field, gain, prec) in channels.items():
+        data[key] = np.round(packets[field][src] * gain, prec)
+    return data
+
+
+def imp_to_dict(packets):
+    """Converts decoded .IMP packets into physical units.
+
+    Parameters
+    ----------
+    packets : np.ndarray
+        Structured array with the fields of IMP_DTYPE, all complete packets of the file
+
+    Returns
+    -------
+    dict
+        RAPIDIMP dict with the keys td, ts, ax, ay, az, gx, gy, gz, mx, my, mz, p, t and b
+    """
+    return _to_dict(packets, IMP_CHANNELS, imp_source_rows)
+
+
+def hig_to_dict(packets):
+    """Converts decoded .HIG packets into physical units.
+
+    Parameters
+    ----------
+    packets : np.ndarray
+        Structured array with the fields of HIG_DTYPE, all complete packets of the file
+
+    Returns
+    -------
+    dict
+        RAPIDHIG dict with the keys td, ts, ax, ay and az
+    """
+    return _to_dict(packets, HIG_CHANNELS, hig_source_rows)
+
+
+def decode_imp(fileFull):
+    """Decodes a .IMP file of the RAPID V3 sensors into physical units.
+
+    Parameters
+    ----------
+    fileFull : str or Path
+        Location of the .IMP file
+
+    Returns
+    -------
+    dict
+        RAPIDIMP dict, see imp_to_dict
+    """
+    return imp_to_dict(read_imp_packets(fileFull))
+
+
+def decode_hig(fileFull):
+    """Decodes a .HIG file of the RAPID V3 sensors into physical units.
+
+    Parameters
+    ----------
+    fileFull : str or Path
+        Location of the .HIG file
+
+    Returns
+    -------
+    dict
+        RAPIDHIG dict, see hig_to_dict
+    """
+    return hig_to_dict(read_hig_packets(fileFull))
+
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""Shared fixtures: small synthetic sensor files of rapid.synthetic."""
+
+import pytest
+
+from rapid.synthetic import write_synthetic
+
+
+SUFFIX = {'IMP': '.IMP', 'HIG': '.HIG'}  # the other sensors write .txt files
+
+
+@pytest.fixture
+def synthetic(tmp_path):
+    """Writes a synthetic file of a sensor type into tmp_path and returns its location."""
+    def write(sensor, n_packets, strikes=None, seed=0, name='synthetic'):
+        path = tmp_path / (name + SUFFIX.get(sensor, '.txt'))
+        write_synthetic(path, sensor, n_packets, strikes=strikes, seed=seed)
+        return path
+    return write
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Vectorized decoders against the struct decoding of the original V3 scripts and Rapid classes."""
+
+import struct
+
+import numpy as np
+import pytest
+
+from rapid import v3
+from rapid.formats import (BDS100_COLUMNS, BDS100_FMT, BDS250_COLUMNS, BDS250_FMT, EDF_ACC_GAIN, EDF_COLUMNS,
+                           EDF_FMT, EDF_FS, EDF_P_GAIN)
+from rapid.reader import iter_chunks, read
+
+
+N_PACKETS = 3000
+STRUCT_FMT = {'EDF': (EDF_FMT, EDF_COLUMNS), 'BDS100': (BDS100_FMT, BDS100_COLUMNS),
+              'BDS250': (BDS250_FMT, BDS250_COLUMNS)}
+
+
+def reference_v3(path, sensor):
+    """RAPIDIMP / RAPIDHIG dict decoded one value at a time as in the original V3 scripts."""
+    packetSize = v3.IMP_PACKET_SIZE if sensor == 'IMP' else v3.HIG_PACKET_SIZE
+    with open(path, 'rb') as file_ID:
+        binary = file_ID.read()
+    flen = len(binary) // packetSize - 1
+    TimeRaw = [struct.unpack_from('>i', binary, k * packetSize)[0] for k in range(flen)]
+    data = {'td': np.array(TimeRaw, dtype=np.float64)}
+    data['ts'] = data['td'] / v3.FS
+    fmt = '>12hx' if sensor == 'IMP' else '>3hx'
+    # .IMP values are read one packet behind the counter (DataRaw[0, :] = DataRaw[1, :]), .HIG values one ahead
+    src = [max(k - 1, 0) if sensor == 'IMP' else k + 1 for k in range(flen)]
+    raw = np.array([struct.unpack_from(fmt, binary, k * packetSize + 4) for k in src]).reshape(flen, -1)
+    channels = v3.IMP_CHANNELS if sensor == 'IMP' else v3.HIG_CHANNELS
+    for i, (key, (field, gain, prec)) in enumerate(channels.items()):
+        values = raw[:, i].astype(np.uint16) if key == 'p' else raw[:, i]
+        data[key] = np.round(values * gain, prec)
+    return data
+
+
+def reference_v1(path, sensor):
+    """Columns of the BDS / EDF classes decoded with struct.iter_unpack."""
+    fmt, columns = STRUCT_FMT[sensor]
+    with open(path, 'rb') as f:
+        binary = f.read()
+    binary = binary[:len(binary) // struct.calcsize(fmt) * struct.calcsize(fmt)]
+    raw = {name: np.array(values) for name, values in zip(columns, zip(*struct.iter_unpack(fmt, binary)))}
+    if sensor == 'EDF':
+        data = {'time': np.arange(len(raw['index'])) / EDF_FS, 'pres': raw['pres'] / EDF_P_GAIN}
+        data.update({axis: raw[axis] / EDF_ACC_GAIN for axis in ('accx', 'accy', 'accz')})
+        return data
+    data = {name: values for name, values in raw.items() if name != 'time'}
+    data['time'] = (raw['time'] - raw['time'][0]) / 1000
+    return data
+
+
+@pytest.mark.parametrize('sensor', ['IMP', 'HIG', 'EDF', 'BDS100', 'BDS250'])
+def test_read_matches_struct(synthetic, sensor):
+    path = synthetic(sensor, N_PACKETS)
+    reference = reference_v3(path, sensor) if sensor in ('IMP', 'HIG') else reference_v1(path, sensor)
+    decoded = read(path, sensor=sensor)
+    assert set(reference) <= set(decoded)
+    for key, values in reference.items():
+        assert len(decoded[key]) == len(values), key
+        np.testing.assert_array_equal(decoded[key], values, err_msg=key)
+
+
+@pytest.mark.parametrize('sensor', ['IMP', 'HIG', 'EDF', 'BDS250'])
+@pytest.mark.parametrize('chunk_size', [1, 7, 1000])
+def test_iter_chunks_matches_read(synthetic, sensor, chunk_size):
+    path = synthetic(sensor, N_PACKETS)
+    decoded = read(path, sensor=sensor)
+    chunks = list(iter_chunks(path, chunk_size, sensor=sensor))
+    for key, values in decoded.items():
+        np.testing.assert_array_equal(np.concatenate([chunk[key] for chunk in chunks]), values, err_msg=key)
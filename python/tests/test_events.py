@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Streaming event detection in blocks of any size against a sample by sample loop."""
+
+import numpy as np
+import pytest
+
+from rapid.events import REFRACTORY_S, EventDetector, concat_tables, file_events
+from rapid.reader import read
+
+
+THRESHOLD = 10.0
+BLOCK_SIZES = (1, 7, 1000, 10**6)
+
+
+def reference_events(time, magnitude, pres, fs, threshold=THRESHOLD, refractory=REFRACTORY_S):
+    """Event table of rapid.events found one sample at a time."""
+    events, current = [], None
+    for i in range(len(time)):
+        if magnitude[i] < threshold:
+            continue
+        if current is not None and (i == current[1] + 1 or time[i] - time[current[1]] <= refractory):
+            current[1] = i
+            current[2] = i if magnitude[i] > magnitude[current[2]] else current[2]
+        else:
+            if current is not None:
+                events.append(current)
+            current = [i, i, i]
+    if current is not None:
+        events.append(current)
+    table = {key: [] for key in ('t_start', 't_peak', 'row', 'peak_g', 'duration', 'pressure')}
+    for first, last, peak in events:
+        table['t_start'].append(time[first])
+        table['t_peak'].append(time[peak])
+        table['row'].append(peak)
+        table['peak_g'].append(magnitude[peak])
+        table['duration'].append(time[last + 1] - time[first] if last + 1 < len(time)
+                                 else time[last] - time[first] + 1 / fs)
+        table['pressure'].append(pres[peak] if pres is not None else np.nan)
+    return {key: np.array(values) for key, values in table.items()}
+
+
+def streamed_events(time, magnitude, pres, block_size):
+    detector = EventDetector(None, THRESHOLD, REFRACTORY_S)
+    tables = [detector.update(time[i:i + block_size], magnitude[i:i + block_size],
+                              None if pres is None else pres[i:i + block_size])
+              for i in range(0, len(time), block_size)]
+    return concat_tables(tables + [detector.finish()])
+
+
+def signal(n, fs, strikes, seed=0):
+    """Time, acceleration magnitude and pressure of n rows at fs with strikes of (first row, rows, peak g)."""
+    rng = np.random.default_rng(seed)
+    time = 12.5 + np.arange(n) / fs
+    magnitude = 1 + np.abs(rng.normal(0, 0.05, n))
+    for first, rows, peak in strikes:
+        magnitude[first:first + rows] = peak * (1 - 0.1 * np.abs(np.arange(rows) - rows // 2))
+    pres = 1000 + rng.normal(0, 1, n)
+    return time, magnitude, pres
+
+
+# single rows, runs across the block borders, crossings merged within the refractory time and an event
+# still open at the end of the recording
+STRIKES = [(3, 1, 15.0), (6, 12, 40.0), (500, 3, 20.0), (505, 2, 30.0), (998, 5, 25.0), (2993, 7, 50.0)]
+
+
+@pytest.mark.parametrize('block_size', BLOCK_SIZES)
+@pytest.mark.parametrize('fs', [100.0, 2000.0])
+def test_events_do_not_depend_on_the_block_size(fs, block_size):
+    time, magnitude, pres = signal(3000, fs, STRIKES)
+    reference = reference_events(time, magnitude, pres, fs)
+    assert len(reference['row']) >= 4
+    events = streamed_events(time, magnitude, pres, block_size)
+    for key, values in reference.items():
+        np.testing.assert_array_equal(events[key], values, err_msg=f'{key}, blocks of {block_size} rows')
+
+
+def test_open_event_lasts_to_the_next_imp_row(synthetic):
+    # the .IMP rows are 100 Hz although their counter runs at 2000 counts per second
+    n_packets = 3000
+    t_last = (n_packets - 2) * 20 / 2000
+    path = synthetic('IMP', n_packets, strikes=[(t_last, 12.0, 0.1)])
+    data = read(path)
+    time = data['ts']
+    assert time[-1] == t_last
+    events = [file_events(path, chunk_size=chunk_size) for chunk_size in (7, 1000, 10**6)]
+    for table in events[1:]:
+        for key, values in events[0].items():
+            np.testing.assert_array_equal(table[key], values, err_msg=key)
+    last = events[0]
+    first = np.searchsorted(time, last['t_start'][-1])
+    assert first < len(time) - 1
+    assert last['duration'][-1] == pytest.approx(time[-1] - time[first] + 0.01)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Fixed precision .csv export against the repr of the rounded values written by csv.writer."""
+
+import csv
+
+import numpy as np
+import pytest
+
+from rapid.export import HIG_HEADER, HIG_PRECISION, IMP_HEADER, IMP_PRECISION, trim_zeros, write_csv
+
+
+def round_columns(block, precision):
+    return np.column_stack([np.round(block[:, i], prec) for i, prec in enumerate(precision)])
+
+
+def reference_csv(path, cHeader, blocks):
+    """.csv file of the original V3 scripts: csv.writer of the rounded values."""
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(cHeader)
+        for block in blocks:
+            writer.writerows(block.tolist())
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('431.700,1.000\r\n', '431.7,1.0\r\n'),
+    ('-1.000,0.500,10.000\r\n', '-1.0,0.5,10.0\r\n'),
+    ('100.0,-0.000,0.0005\r\n', '100.0,-0.0,0.0005\r\n'),
+    ('2000.100,20.0\r\n', '2000.1,20.0\r\n'),
+])
+def test_trim_zeros(text, expected):
+    assert trim_zeros(text, [4, 4, 4]) == expected
+
+
+@pytest.mark.parametrize('cHeader, precision', [(IMP_HEADER, IMP_PRECISION), (HIG_HEADER, HIG_PRECISION)])
+def test_write_csv_matches_csv_writer(tmp_path, cHeader, precision):
+    rng = np.random.default_rng(0)
+    scale = np.array([1000.0] + [20.0] * (len(cHeader) - 1))
+    blocks = [rng.normal(0, 1, (n, len(cHeader))) * scale for n in (500, 1, 37)]
+    # negative values which round to -0.0, integers and values with trailing zeros
+    blocks[0][:10] = -1e-5
+    blocks[0][10:20] = np.round(blocks[0][10:20])
+    blocks[0][20:30] = np.round(blocks[0][20:30], 1)
+    blocks = [round_columns(block, precision) for block in blocks]
+    write_csv(tmp_path / 'fast.csv', cHeader, blocks, precision)
+    reference_csv(tmp_path / 'reference.csv', cHeader, blocks)
+    text = (tmp_path / 'fast.csv').read_bytes()
+    assert text == (tmp_path / 'reference.csv').read_bytes()
+    assert b',-0.0,' in text
+
+
+def test_write_csv_needs_a_decimal_place(tmp_path):
+    with pytest.raises(ValueError):
+        write_csv(tmp_path / 'out.csv', ['a', 'b'], [np.zeros((2, 2))], [1, 0])
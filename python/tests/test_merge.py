@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Alignment of the .IMP and .HIG rows by rapid.merge against a row by row search."""
+
+import numpy as np
+import pytest
+
+from rapid.formats import FORMATS
+from rapid.merge import IMP_PERIOD, MERGED_HEADER, align, estimate_offset, iter_merged, merge_files
+
+
+def reference_align(td_imp, td_hig, offset, period=IMP_PERIOD):
+    """.IMP row of each .HIG row: the last one at or before its counter, less than one period earlier."""
+    rows = []
+    for counter in np.asarray(td_hig) + offset:
+        before = [k for k, c in enumerate(td_imp) if c <= counter]
+        rows.append(before[-1] if before and counter - td_imp[before[-1]] < period else -1)
+    return np.array(rows, dtype=np.int64)
+
+
+def counters(n_imp, drop_imp=(), drop_hig=(), shift=0):
+    """Counters of a .IMP and a .HIG file with the given packets dropped and the .HIG counter shifted."""
+    td_imp = np.delete(np.arange(n_imp) * IMP_PERIOD, list(drop_imp))
+    td_hig = np.delete(np.arange(n_imp * IMP_PERIOD), list(drop_hig)) + shift
+    return td_imp, td_hig
+
+
+def test_every_hig_row_carries_its_imp_period():
+    td_imp, td_hig = counters(50)
+    td, rows_imp, rows_hig = align(td_imp, td_hig)
+    np.testing.assert_array_equal(td, td_hig)
+    np.testing.assert_array_equal(rows_hig, np.arange(len(td_hig)))
+    np.testing.assert_array_equal(rows_imp, td_hig // IMP_PERIOD)
+
+
+@pytest.mark.parametrize('how', ['outer', 'inner', 'hig', 'imp'])
+def test_dropped_packets(how):
+    # two dropped .IMP rows, a whole dropped .HIG period and single dropped .HIG rows
+    td_imp, td_hig = counters(40, drop_imp=[5, 6], drop_hig=list(range(200, 220)) + [3, 401, 799])
+    expected = reference_align(td_imp, td_hig, 0)
+    td, rows_imp, rows_hig = align(td_imp, td_hig, how=how)
+    assert np.all(np.diff(td) >= 0)
+    hig = rows_hig >= 0
+    if how in ('outer', 'inner', 'hig'):
+        kept = expected >= 0 if how == 'inner' else np.ones(len(td_hig), dtype=bool)
+        np.testing.assert_array_equal(rows_hig[hig], np.flatnonzero(kept))
+        np.testing.assert_array_equal(rows_imp[hig], expected[rows_hig[hig]])
+        np.testing.assert_array_equal(td[hig], td_hig[rows_hig[hig]])
+    if how == 'outer':
+        # the .IMP row of the dropped .HIG period is kept on its own
+        lonely = rows_imp[~hig]
+        np.testing.assert_array_equal(lonely, [np.flatnonzero(td_imp == 200)[0]])
+        np.testing.assert_array_equal(td[~hig], td_imp[lonely])
+    if how == 'imp':
+        np.testing.assert_array_equal(rows_imp, np.arange(len(td_imp)))
+        first = [np.flatnonzero(expected == k)[0] if np.any(expected == k) else -1 for k in range(len(td_imp))]
+        np.testing.assert_array_equal(rows_hig, first)
+    # the .HIG rows of the dropped .IMP rows 5 and 6 have no IMU values
+    assert np.all(expected[(td_hig >= 100) & (td_hig < 140)] == -1)
+
+
+def test_counter_offset_is_estimated():
+    td_imp, td_hig = counters(30, shift=-1234)
+    offset = estimate_offset(td_imp, td_hig)
+    assert offset == 1234
+    _, rows_imp, rows_hig = align(td_imp, td_hig, offset)
+    np.testing.assert_array_equal(rows_imp, reference_align(td_imp, td_hig, offset))
+    np.testing.assert_array_equal(rows_imp, (td_hig + offset) // IMP_PERIOD)
+
+
+def test_duplicate_counters():
+    td_imp = np.array([0, 20, 20, 40, 60])
+    td_hig = np.array([0, 1, 20, 20, 21, 40, 41, 60])
+    td, rows_imp, rows_hig = align(td_imp, td_hig, how='outer')
+    # every .HIG row stays a row of its own, attached to the last .IMP row of a duplicated counter
+    hig = rows_hig >= 0
+    np.testing.assert_array_equal(rows_hig[hig], np.arange(len(td_hig)))
+    np.testing.assert_array_equal(rows_imp[hig], [0, 0, 2, 2, 2, 3, 3, 4])
+    np.testing.assert_array_equal(rows_imp[hig], reference_align(td_imp, td_hig, 0))
+    # the first .IMP row of the duplicated counter has no .HIG rows and is kept on its own before them
+    np.testing.assert_array_equal(td, [0, 1, 20, 20, 20, 21, 40, 41, 60])
+    np.testing.assert_array_equal(rows_imp[~hig], [1])
+    assert np.flatnonzero(~hig)[0] == 2
+
+
+def _drop_packets(path, sensor, packets):
+    size = FORMATS[sensor].packet_size
+    binary = bytearray(path.read_bytes())
+    for k in sorted(packets, reverse=True):
+        del binary[k * size:(k + 1) * size]
+    path.write_bytes(bytes(binary))
+
+
+def test_merged_files_do_not_depend_on_the_block_size(synthetic):
+    impFile = synthetic('IMP', 300, name='B38-0928141315')
+    higFile = synthetic('HIG', 300 * IMP_PERIOD, name='B38-0928141315')
+    _drop_packets(impFile, 'IMP', [50, 51, 120])
+    _drop_packets(higFile, 'HIG', list(range(3000, 3100)) + [4000])
+    merged = merge_files(impFile, higFile)
+    assert list(merged) == MERGED_HEADER
+    assert np.all(np.diff(merged['Time (s)']) >= 0)
+    # rows without .IMP values: the .HIG rows of the three dropped .IMP periods and of the last period, whose
+    # .IMP packet is not exported (skip_last) while the .HIG file still has 19 rows of it
+    assert np.count_nonzero(np.isnan(merged['Pressure (mbar)'])) == 3 * IMP_PERIOD + IMP_PERIOD - 1
+    # rows without .HIG values: the .IMP rows of the five dropped .HIG periods
+    assert np.count_nonzero(np.isnan(merged['HIGAccel_X (g)'])) == 100 // IMP_PERIOD
+    for chunk_size in (1, 7, 1000):
+        blocks = list(iter_merged(impFile, higFile, chunk_size=chunk_size))
+        for name in MERGED_HEADER:
+            np.testing.assert_array_equal(np.concatenate([block[name] for block in blocks]), merged[name],
+                                          err_msg=f'{name}, blocks of {chunk_size} rows')
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Benchmark of the decoders, post-processing and exports on synthetic sensor files.
+
+For each sensor type a synthetic file of the requested size is written with rapid.synthetic, then every stage
+runs in a fresh worker process, so the peak resident memory (RSS) of each stage is measured on its own.
+The throughput is reported in MB/s of the binary file and in packets/s. Before the timings the outputs are
+checked for correctness:
+
+    - the first packets decoded with struct one value at a time, like the original V3 scripts and Rapid classes
+    - the data of the BDS / EDF classes of RAPID_V1/import_BDS_RAPID_v1.py (if pandas and its imports are available)
+    - the injected strikes found by the event detector
+    - the events of rows around the first strike, fed to the streaming detector in blocks of 1 to 10**6 rows,
+      against a sample-by-sample reference loop
+
+Usage, from the python folder:
+
+    python tools/benchmark.py --size-mb 200 --sensors IMP BDS100
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import resource
+import struct
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # shared routines in python/rapid
+
+from rapid import v3
+from rapid.events import (REFRACTORY_S, EventDetector, acceleration_magnitude, concat_tables, file_events, pressure,
+                          time_key)
+from rapid.export import convert_hig, convert_imp
+from rapid.formats import FORMATS, BDS100_FMT, BDS250_FMT, EDF_FMT
+from rapid.metrics import file_metrics
+from rapid.reader import iter_chunks, read
+from rapid.synthetic import sample_rate, write_synthetic
+
+
+SENSORS = ['IMP', 'HIG', 'EDF', 'BDS100', 'BDS250']
+SUFFIX = {'IMP': '.IMP', 'HIG': '.HIG'}  # the other sensors write .txt files
+STRUCT_FMT = {'EDF': EDF_FMT, 'BDS100': BDS100_FMT, 'BDS250': BDS250_FMT}
+CHECK_PACKETS = 20000  # packets compared with the one-value-at-a-time decoding
+EVENT_CHUNKS = (1, 7, 1000, 10**6)  # block sizes of the streaming event detection compared with the reference
+V1_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'RAPID_V1', 'import_BDS_RAPID_v1.py')
+
+
+# stages, each run in its own process: sensor, path, output folder -> None
+
+def _decode(sensor, path, out):
+    read(path, sensor=sensor)
+
+
+def _stream(sensor, path, out):
+    for _ in iter_chunks(path, sensor=sensor):
+        pass
+
+
+def _events(sensor, path, out):
+    file_events(path, sensor)
+
+
+def _metrics(sensor, path, out):
+    file_metrics(path, sensor)
+
+
+def _export(output):
+    def export(sensor, path, out):
+        if sensor in ('IMP', 'HIG'):
+            (convert_imp if sensor == 'IMP' else convert_hig)(path, out, output=output)
+        else:
+            _rapid_class(sensor)(path, chunksize=2**16, output=output, directory=out)
+    return export
+
+
+STAGES = {
+    'decode': _decode,
+    'stream': _stream,
+    'events': _events,
+    'metrics': _metrics,
+    'export_csv': _export('csv'),
+    'export_npz': _export('npz'),
+}
+
+
+def _rapid_class(sensor):
+    """BDS100, BDS250 or EDF class of the RAPID_V1 script."""
+    spec = importlib.util.spec_from_file_location('import_BDS_RAPID_v1', V1_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, sensor)
+
+
+def peak_rss():
+    """Peak resident memory of this process in MB."""
+    # ru_maxrss survives exec, so a spawned worker would report the peak of its parent; VmHWM does not
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_stage(stage, sensor, path, out):
+    """Runs a stage in this (fresh) process, returns the elapsed time in s and the peak RSS in MB."""
+    t0 = time.perf_counter()
+    STAGES[stage](sensor, path, out)
+    elapsed = time.perf_counter() - t0
+    return elapsed, peak_rss()
+
+
+def _in_process(function, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(function, *args).result()
+
+
+def reference_v3(path, sensor, n_packets):
+    """RAPIDIMP / RAPIDHIG dict of the first n_packets decoded one value at a time as in the original scripts."""
+    packetSize = v3.IMP_PACKET_SIZE if sensor == 'IMP' else v3.HIG_PACKET_SIZE
+    with open(path, 'rb') as file_ID:
+        binary = file_ID.read(packetSize * n_packets)
+    flen = len(binary) // packetSize - 1
+    TimeRaw = [struct.unpack_from('>i', binary, k * packetSize)[0] for k in range(flen)]
+    data = {'td': np.array(TimeRaw, dtype=np.float64)}
+    data['ts'] = data['td'] / v3.FS
+    fmt = '>12hx' if sensor == 'IMP' else '>3hx'
+    # .IMP values are read one packet behind the counter (DataRaw[0, :] = DataRaw[1, :]), .HIG values one ahead
+    src = [max(k - 1, 0) if sensor == 'IMP' else k + 1 for k in range(flen)]
+    raw = np.array([struct.unpack_from(fmt, binary, k * packetSize + 4) for k in src]).reshape(flen, -1)
+    channels = v3.IMP_CHANNELS if sensor == 'IMP' else v3.HIG_CHANNELS
+    for i, (key, (field, gain, prec)) in enumerate(channels.items()):
+        values = raw[:, i].astype(np.uint16) if key == 'p' else raw[:, i]
+        data[key] = np.round(values * gain, prec)
+    return data
+
+
+def reference_events(time, magnitude, pres, fs, threshold, refractory):
+    """Event table of rapid.events found one sample at a time."""
+    events, current = [], None
+    for i in range(len(time)):
+        if magnitude[i] < threshold:
+            continue
+        if current is not None and (i == current[1] + 1 or time[i] - time[current[1]] <= refractory):
+            current[1] = i
+            current[2] = i if magnitude[i] > magnitude[current[2]] else current[2]
+        else:
+            if current is not None:
+                events.append(current)
+            current = [i, i, i]
+    if current is not None:
+        events.append(current)
+    table = {key: [] for key in ('t_start', 't_peak', 'row', 'peak_g', 'duration', 'pressure')}
+    for first, last, peak in events:
+        table['t_start'].append(time[first])
+        table['t_peak'].append(time[peak])
+        table['row'].append(peak)
+        table['peak_g'].append(magnitude[peak])
+        table['duration'].append(time[last + 1] - time[first] if last + 1 < len(time)
+                                 else time[last] - time[first] + 1 / fs)
+        table['pressure'].append(pres[peak] if pres is not None else np.nan)
+    return {key: np.array(values) for key, values in table.items()}
+
+
+def check_event_chunks(sensor, data, t_strike, threshold):
+    """Streaming event detection of the rows around t_strike, and of the rows up to its peak (an event open at
+    the end of the recording), for each block size of EVENT_CHUNKS against reference_events, returns
+    (passed, detail)."""
+    time_all = data[time_key(sensor)]
+    magnitude_all, pres_all = acceleration_magnitude(data, sensor), pressure(data, sensor)
+    peak = int(np.searchsorted(time_all, t_strike))
+    start = max(peak - CHECK_PACKETS // 2, 0)
+    # the row rate of the synthetic file, not measured by the code under test (100 Hz for .IMP)
+    fs = sample_rate(sensor)
+    n_events = 0
+    for window in (slice(start, start + CHECK_PACKETS), slice(start, peak + 1)):
+        time, magnitude = time_all[window], magnitude_all[window]
+        pres = pres_all[window] if pres_all is not None else None
+        reference = reference_events(time, magnitude, pres, fs, threshold, REFRACTORY_S)
+        n_events += len(reference['row'])
+        for chunk in EVENT_CHUNKS:
+            detector = EventDetector(None, threshold, REFRACTORY_S)
+            tables = [detector.update(time[i:i + chunk], magnitude[i:i + chunk],
+                                      None if pres is None else pres[i:i + chunk])
+                      for i in range(0, len(time), chunk)]
+            events = concat_tables(tables + [detector.finish()])
+            if not all(np.array_equal(events[key], values, equal_nan=True) for key, values in reference.items()):
+                return False, f'{len(reference["row"])} events, differ with blocks of {chunk} rows'
+    return True, f'{n_events} events in two windows of {CHECK_PACKETS} and {peak + 1 - start} rows'
+
+
+def check(sensor, path, strikes):
+    """Correctness checks of a synthetic file, returns a list of (check, passed, detail) tuples."""
+    results = []
+    n = min(CHECK_PACKETS, os.stat(path).st_size // FORMATS[sensor].packet_size)
+    decoded = read(path, sensor=sensor)
+
+    if sensor in ('IMP', 'HIG'):
+        reference = reference_v3(path, sensor, n)
+        rows = len(reference['td'])
+        same = all(np.array_equal(decoded[key][:rows], values) for key, values in reference.items())
+        results.append(('struct decoding (original script)', same, f'{rows} rows'))
+    else:
+        packet_format = FORMATS[sensor]
+        with open(path, 'rb') as f:
+            binary = f.read(n * packet_format.packet_size)
+        names = packet_format.dtype.names
+        raw = list(zip(*struct.iter_unpack(STRUCT_FMT[sensor], binary)))
+        same = True
+        for key in packet_format.channels:
+            values = np.asarray(raw[names.index(packet_format.channels[key][0])])
+            same &= bool(np.array_equal(decoded[key][:n], packet_format.convert(key, values)))
+        results.append(('struct decoding (Rapid classes)', same, f'{n} packets'))
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                data = _rapid_class(sensor)(path, savecsv=False, directory=tmp).data
+            keys = ['accx', 'accy', 'accz'] + (['pres'] if sensor == 'EDF' else ['P1'])
+            same = all(np.allclose(data[key].to_numpy()[:n], decoded[key][:n]) for key in keys if key in data)
+            results.append((f'{sensor} class data', same, f'{len(data)} rows'))
+        except Exception as error:
+            results.append((f'{sensor} class data', None, f'{type(error).__name__}: {error}'))
+
+    events = file_events(path, sensor, threshold=4)
+    found = 0
+    for t_strike, peak, _ in strikes:
+        near = np.abs(events['t_peak'] - t_strike) <= 2 / sample_rate(sensor)
+        found += bool(np.any(near & (np.abs(events['peak_g'] - peak) <= 0.05 * peak)))
+    results.append(('injected strikes detected', found == len(strikes), f'{found} of {len(strikes)}'))
+    results.append(('events independent of the block size', *check_event_chunks(sensor, decoded, strikes[0][0], 4)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1], formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=50, help='size of each synthetic file (default 50 MB)')
+    parser.add_argument('--sensors', nargs='+', default=SENSORS, choices=SENSORS)
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=list(STAGES))
+    parser.add_argument('--dir', help='folder of the synthetic files and exports, by default a temporary folder')
+    parser.add_argument('--json', help='also write the results as JSON lines to this file')
+    args = parser.parse_args(argv)
+
+    tmp = None
+    if args.dir is None:
+        tmp = tempfile.TemporaryDirectory()
+        args.dir = tmp.name
+    os.makedirs(args.dir, exist_ok=True)
+
+    baseline = _in_process(peak_rss)
+    print(f'peak RSS of an idle worker process: {baseline:.0f} MB')
+    print(f'{"sensor":8} {"stage":12} {"time (s)":>9} {"MB/s":>9} {"packets/s":>12} {"peak RSS (MB)":>14}')
+    records = []
+    for sensor in args.sensors:
+        n_packets = int(args.size_mb * 2**20) // FORMATS[sensor].packet_size
+        path = os.path.join(args.dir, f'S00-0101000000{SUFFIX.get(sensor, ".txt")}')
+        if sensor in ('BDS100', 'BDS250', 'EDF'):
+            path = path.replace('S00', sensor)
+        strikes = write_synthetic(path, sensor, n_packets)
+        size_mb = os.stat(path).st_size / 2**20
+
+        for name, passed, detail in check(sensor, path, strikes):
+            status = 'skipped' if passed is None else 'ok' if passed else 'FAILED'
+            print(f'{sensor:8} check {name}: {status} ({detail})')
+            records.append({'sensor': sensor, 'check': name, 'passed': passed, 'detail': detail})
+
+        out = os.path.join(args.dir, f'out-{sensor}')
+        os.makedirs(out, exist_ok=True)
+        for stage in args.stages:
+            if stage == 'metrics' and sensor == 'HIG':
+                continue  # no pressure channel
+            try:
+                elapsed, rss = _in_process(_run_stage, stage, sensor, path, out)
+            except Exception as error:
+                print(f'{sensor:8} {stage:12} skipped ({type(error).__name__}: {error})')
+                continue
+            print(f'{sensor:8} {stage:12} {elapsed:9.3f} {size_mb / elapsed:9.1f} {n_packets / elapsed:12.0f} {rss:14.0f}')
+            records.append({'sensor': sensor, 'stage': stage, 'size_mb': size_mb, 'packets': n_packets,
+                             'seconds': elapsed, 'mb_per_s': size_mb / elapsed,
+                             'packets_per_s': n_packets / elapsed, 'peak_rss_mb': rss})
+        os.remove(path)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+    if tmp is not None:
+        tmp.cleanup()
+    return 0 if all(r.get('passed') is not False for r in records) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
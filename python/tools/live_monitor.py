@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jeffrey Tuhtan, Tallinn University of Technology
+Copyright 2024
+CC BY-NC 4.0 License
+https://creativecommons.org/licenses/by-nc/4.0/
+
+Live decoding of a synthetic sensor file written by a separate writer process.
+
+The writer process (rapid.synthetic.write_growing) appends the packets at the pace of the sensor, in writes
+which split the packets. The monitor decodes them with rapid.live while they arrive and prints for each block
+the rows, the last time stamp, the largest acceleration and the lag behind the writer (measured from the
+moment the file appears, so it includes the poll interval; with --stream from the start of the writer). At the end the decoded rows are compared with
+rapid.reader.read of the finished file.
+
+Usage, from the python folder:
+
+    python tools/live_monitor.py --sensor IMP --seconds 20
+    python tools/live_monitor.py --sensor EDF --seconds 60 --speed 10 --stream
+
+--stream decodes the stdout of the writer process (as for a serial link) instead of tailing the file.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # shared routines in python/rapid
+
+from rapid.live import iter_stream, tail_file
+from rapid.reader import read
+from rapid.synthetic import sample_rate, write_growing
+
+
+SENSORS = ['IMP', 'HIG', 'EDF', 'BDS100', 'BDS250']
+SUFFIX = {'IMP': '.IMP', 'HIG': '.HIG'}  # the other sensors write .txt files
+ACC_KEYS = {'IMP': 'ax', 'HIG': 'ax', 'EDF': 'accx', 'BDS100': 'accx', 'BDS250': 'accx'}
+
+
+def _report(sensor, block, t0, speed):
+    """Prints one line per decoded block, returns the lag in s."""
+    t = block['ts'] if 'ts' in block else block['time']
+    # the synthetic files start at time 0 (BDS: relative time), the writer is at (wall time * speed) s of data
+    lag = time.perf_counter() - t0 - t[-1] / speed
+    key = ACC_KEYS[sensor]
+    print(f'{len(t):8d} rows  t = {t[-1]:9.3f} s  max |{key}| = {np.max(np.abs(block[key])):8.2f}  '
+          f'lag = {lag * 1000:7.1f} ms')
+    return lag
+
+
+async def monitor_file(path, sensor, n_packets, speed, write_size, poll_interval):
+    """Starts a writer process on path and decodes the file while it grows."""
+    writer = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.abspath(__file__), '--write', path, '--sensor', sensor,
+        '--packets', str(n_packets), '--speed', str(speed), '--write-size', str(write_size),
+    )
+    while not os.path.exists(path):
+        await asyncio.sleep(poll_interval / 10)
+    t0 = time.perf_counter()
+    blocks, lags = [], []
+    stop = asyncio.Event()
+    waiting = asyncio.ensure_future(writer.wait())
+    waiting.add_done_callback(lambda _: stop.set())
+    async for block in tail_file(path, sensor, poll_interval=poll_interval, stop=stop):
+        lags.append(_report(sensor, block, t0, speed))
+        blocks.append(block)
+    await waiting
+    return blocks, lags
+
+
+async def monitor_stream(sensor, n_packets, speed, write_size):
+    """Starts a writer process and decodes its stdout."""
+    writer = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.abspath(__file__), '--write', '-', '--sensor', sensor,
+        '--packets', str(n_packets), '--speed', str(speed), '--write-size', str(write_size),
+        stdout=asyncio.subprocess.PIPE,
+    )
+    t0 = time.perf_counter()
+    blocks, lags = [], []
+    async for block in iter_stream(writer.stdout, sensor):
+        lags.append(_report(sensor, block, t0, speed))
+        blocks.append(block)
+    await writer.wait()
+    return blocks, lags
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1], formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--sensor', default='IMP', choices=SENSORS)
+    parser.add_argument('--seconds', type=float, default=10, help='length of the recording (default 10 s)')
+    parser.add_argument('--speed', type=float, default=1.0, help='multiple of the real-time data rate (default 1)')
+    parser.add_argument('--poll-interval', type=float, default=0.05, help='seconds between file checks (default 0.05)')
+    parser.add_argument('--write-size', type=int, default=509, help='bytes per write of the writer (default 509)')
+    parser.add_argument('--stream', action='store_true', help='decode the stdout of the writer instead of the file')
+    parser.add_argument('--write', metavar='PATH', help=argparse.SUPPRESS)  # writer process, '-' for stdout
+    parser.add_argument('--packets', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.write is not None:
+        write_growing(sys.stdout.buffer if args.write == '-' else args.write, args.sensor, args.packets,
+                      speed=args.speed, write_size=args.write_size)
+        return 0
+
+    n_packets = int(args.seconds * sample_rate(args.sensor))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f'{args.sensor}-0101000000{SUFFIX.get(args.sensor, ".txt")}')
+        if args.stream:
+            blocks, lags = asyncio.run(monitor_stream(args.sensor, n_packets, args.speed, args.write_size))
+            write_growing(path, args.sensor, n_packets, speed=None)  # the same bytes, for the comparison
+        else:
+            blocks, lags = asyncio.run(monitor_file(path, args.sensor, n_packets, args.speed, args.write_size,
+                                                   args.poll_interval))
+        expected = read(path, sensor=args.sensor)
+
+    decoded = {key: np.concatenate([block[key] for block in blocks]) for key in expected} if blocks else {}
+    same = bool(blocks) and all(np.array_equal(decoded[key], values) for key, values in expected.items())
+    rows = len(next(iter(decoded.values()))) if decoded else 0
+    print(f'{len(blocks)} blocks, {rows} rows, median lag {np.median(lags) * 1000 if lags else np.nan:.1f} ms, '
+          f'max lag {max(lags, default=np.nan) * 1000:.1f} ms')
+    print(f'decoded rows equal to read() of the finished file: {"ok" if same else "FAILED"}')
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())